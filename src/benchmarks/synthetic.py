@@ -0,0 +1,195 @@
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataprocessing.pipeline import iter_raw_records
+from dataprocessing.profiling import profile_field_values
+from dataprocessing.recordio import JsonArrayWriter
+
+# Fields holding comma-separated tags, re-sampled tag by tag for realistic variety
+TAG_FIELDS = ("positive_tags",)
+BATCH_SIZE = 10_000
+
+
+def _leaf_values(value_map: Any) -> Iterator[Tuple[str, List[Any]]]:
+    """Yields (field, values) for every leaf list of a nested value map."""
+    if isinstance(value_map, dict):
+        for field, values in value_map.items():
+            if isinstance(values, list):
+                yield field, values
+            else:
+                yield from _leaf_values(values)
+
+
+def build_field_samplers(
+    raw_files: List[str],
+    fields_to_keep: List[str],
+    value_map: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Tuple[List[Any], List[int]]]:
+    """
+    Builds the value distribution of every field that synthetic records should carry.
+
+    Distributions are the value frequencies observed in the raw files, so synthetic
+    records look like the raw input the pipeline expects. Fields of `fields_to_keep`
+    that never occur in the raw files fall back to the values listed in `value_map`
+    (value-map.json), with equal weights, and to null otherwise.
+
+    Args:
+        raw_files (List[str]): Paths of the real raw JSON files.
+        fields_to_keep (List[str]): The fields of the records, from config.json.
+        value_map (Optional[Dict[str, Any]]): The nested value map of value-map.json.
+
+    Returns:
+        Dict[str, Tuple[List[Any], List[int]]]: The (values, cumulative weights) of each
+        field, in `fields_to_keep` order.
+    """
+    profiles = profile_field_values(iter_raw_records(raw_files), exact_threshold=100_000)
+    fallback = dict(_leaf_values(value_map or {}))
+    samplers = {}
+    for field in fields_to_keep:
+        profile = profiles.get(field)
+        if profile and profile["values"]:
+            values = [entry["value"] for entry in profile["values"]]
+            weights = [entry["count"] for entry in profile["values"]]
+        elif fallback.get(field):
+            values = fallback[field]
+            weights = [1] * len(values)
+        else:
+            values, weights = [None], [1]
+        cumulative = []
+        total = 0
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        samplers[field] = (values, cumulative)
+    return samplers
+
+
+def _tag_sampler(values: List[Any]) -> Tuple[List[str], List[int], List[int]]:
+    """Returns the tag vocabulary, its cumulative frequencies and the observed tag counts."""
+    tag_counts: Dict[str, int] = {}
+    lengths = []
+    for value in values:
+        if isinstance(value, str) and value:
+            tags = [tag.strip() for tag in value.split(',') if tag.strip()]
+            lengths.append(len(tags))
+            for tag in tags:
+                tag_counts[tag] = tag_counts.get(tag, 0) + 1
+    tags = list(tag_counts)
+    cumulative = []
+    total = 0
+    for tag in tags:
+        total += tag_counts[tag]
+        cumulative.append(total)
+    return tags, cumulative, lengths or [0]
+
+
+def generate_records(
+    count: int,
+    samplers: Dict[str, Tuple[List[Any], List[int]]],
+    seed: int = 0,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Generates `count` synthetic raw records, in batches of BATCH_SIZE per field.
+
+    Every field is sampled independently from its distribution. Tag fields are
+    rebuilt from tags drawn one by one, so they take many more distinct values than in
+    the real data, as free text does at scale. The same seed gives the same records.
+
+    Args:
+        count (int): Number of records to generate.
+        samplers (Dict[str, Tuple[List[Any], List[int]]]): From `build_field_samplers`.
+        seed (int): Seed of the random generator.
+
+    Yields:
+        Dict[str, Any]: Each synthetic record.
+    """
+    rng = random.Random(seed)
+    tag_samplers = {field: _tag_sampler(samplers[field][0])
+                    for field in TAG_FIELDS if field in samplers}
+    fields = list(samplers)
+    produced = 0
+    while produced < count:
+        size = min(BATCH_SIZE, count - produced)
+        columns = []
+        for field in fields:
+            values, cumulative = samplers[field]
+            column = rng.choices(values, cum_weights=cumulative, k=size)
+            if field in tag_samplers:
+                tags, tag_cumulative, lengths = tag_samplers[field]
+                if tags:
+                    column = [",".join(rng.choices(tags, cum_weights=tag_cumulative,
+                                                   k=rng.choice(lengths)))
+                              if isinstance(value, str) else value
+                              for value in column]
+            columns.append(column)
+        for row in zip(*columns):
+            yield dict(zip(fields, row))
+        produced += size
+
+
+def write_raw_files(
+    output_dir: str,
+    count: int,
+    samplers: Dict[str, Tuple[List[Any], List[int]]],
+    years: Tuple[str, ...] = ("2023", "2024", "2025"),
+    seed: int = 0,
+) -> List[str]:
+    """
+    Writes `count` synthetic records to one raw JSON array file per year, as in data/raw.
+
+    Args:
+        output_dir (str): Directory of the raw files.
+        count (int): Total number of records, split evenly across the years.
+        samplers (Dict[str, Tuple[List[Any], List[int]]]): From `build_field_samplers`.
+        years (Tuple[str, ...]): Names of the raw files, without extension.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        List[str]: Paths of the files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    records = generate_records(count, samplers, seed)
+    paths = []
+    for i, year in enumerate(years):
+        share = count // len(years) + (1 if i < count % len(years) else 0)
+        path = os.path.join(output_dir, f"{year}.json")
+        with JsonArrayWriter(path) as writer:
+            for _ in range(share):
+                writer.write(next(records))
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic raw application records.")
+    parser.add_argument("count", type=int, help="Number of records to generate.")
+    parser.add_argument("--output-dir", required=True, help="Directory of the raw files to write.")
+    parser.add_argument("--config", default="pipeline-setup/config.json",
+                        help="Config file with dataPaths and fields_to_keep.")
+    parser.add_argument("--value-map", default="value-map.json",
+                        help="Value map used for fields absent from the raw files.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator.")
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    value_map = None
+    if os.path.exists(args.value_map):
+        with open(args.value_map, 'r', encoding='utf-8') as f:
+            value_map = json.load(f)
+    raw_dir = config["dataPaths"]["rawDir"]
+    raw_files = [os.path.join(raw_dir, name) for name in sorted(os.listdir(raw_dir))
+                 if name.endswith(".json")]
+    samplers = build_field_samplers(raw_files, config["fields_to_keep"], value_map)
+    for path in write_raw_files(args.output_dir, args.count, samplers, seed=args.seed):
+        print(f"Wrote {path}")
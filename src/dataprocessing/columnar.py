@@ -0,0 +1,206 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dataprocessing.normalize import (
+    _SHAREABLE_TYPES,
+    CompiledField,
+    _CopyOnRead,
+    NormalizationCache,
+    compile_normalization_map,
+    normalize_record,
+)
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Types whose equal values always normalize the same way, so they can key a cache
+_HASHABLE_TYPES = {type(None), bool, int, str}
+
+
+def records_to_columns(records: List[Dict[str, Any]], fields: Tuple[str, ...]) -> Dict[str, List[Any]]:
+    """
+    Transposes records that share the same fields into one list per field.
+
+    Args:
+        records (List[Dict[str, Any]]): Records whose keys are exactly `fields`.
+        fields (Tuple[str, ...]): The shared field names, in record order.
+
+    Returns:
+        Dict[str, List[Any]]: The values of each field, in record order.
+    """
+    return {field: [record[field] for record in records] for field in fields}
+
+
+def columns_to_records(columns: Dict[str, List[Any]], fields: Tuple[str, ...]) -> List[Dict[str, Any]]:
+    """Transposes columns back into records, keeping the field order."""
+    return [dict(zip(fields, row)) for row in zip(*(columns[field] for field in fields))]
+
+
+class _ResultCache(dict):
+    """Maps distinct values to their normalized value, computing each one on first use."""
+
+    def __init__(self, normalize):
+        super().__init__()
+        self._normalize = normalize
+
+    def __missing__(self, value):
+        result = self._normalize(value)
+        if type(result) in _SHAREABLE_TYPES:
+            self[value] = result
+        return result
+
+
+def normalize_column(values: List[Any], compiled: CompiledField) -> List[Any]:
+    """
+    Normalizes a whole column with the plan of its field.
+
+    The column is factorized: the plan runs once per distinct value, which applies the
+    value mappings as a categorical map, '$in' as a membership test and '$regex' as a
+    string match over the distinct values only, and the results are broadcast back to
+    the rows. Values that cannot be factorized (lists, dicts) and results that must not
+    be shared between rows (lists, dicts) are computed row by row. When the rules call
+    functions with a batch variant, the distinct values are normalized together, each
+    function being called once per chunk (see `CompiledField.normalize_many`). Rules
+    calling impure functions are applied to every row.
+
+    Args:
+        values (List[Any]): The standardized values of one field.
+        compiled (CompiledField): The compiled normalization config of that field.
+
+    Returns:
+        List[Any]: The normalized values, in the same order.
+    """
+    normalize = compiled.normalize
+    if not compiled.pure:
+        return [normalize(value) for value in values]
+    if compiled.batched:
+        return _normalize_column_batched(values, compiled)
+    value_types = set(map(type, values))
+    if value_types <= _HASHABLE_TYPES and not {bool, int} <= value_types:
+        # No two values of different types compare equal: they can key the cache directly
+        return list(map(_ResultCache(normalize).__getitem__, values))
+
+    # Mixed types are keyed on their type too, so that 1, 1.0 and True stay apart
+    results = {}
+    out = []
+    append = out.append
+    for value in values:
+        value_type = type(value)
+        # Floats are keyed on their exact bits so that 0.0 and -0.0 stay apart
+        key = (value_type, value.hex() if value_type is float else value)
+        try:
+            result = results.get(key, results)
+        except TypeError:
+            append(normalize(value))
+            continue
+        if result is results:
+            result = normalize(value)
+            if type(result) in _SHAREABLE_TYPES:
+                results[key] = result
+        append(result)
+    return out
+
+
+def _normalize_column_batched(values: List[Any], compiled: CompiledField) -> List[Any]:
+    """Normalizes a column through `normalize_many` over its distinct values."""
+    value_types = set(map(type, values))
+    if value_types <= _HASHABLE_TYPES and not {bool, int} <= value_types:
+        # As in `normalize_column`, the values can key the results directly
+        distinct = list(dict.fromkeys(values))
+        results = dict(zip(distinct, compiled.normalize_many(distinct)))
+        if all(type(result) in _SHAREABLE_TYPES for result in results.values()):
+            return list(map(results.__getitem__, values))
+        shared = {value: result if type(result) in _SHAREABLE_TYPES else _CopyOnRead(result)
+                  for value, result in results.items()}
+        return [result.copy() if type(result) is _CopyOnRead else result
+                for result in map(shared.__getitem__, values)]
+
+    # Mixed and unhashable types: keyed on their type, or normalized row by row
+    positions: Dict[Any, int] = {}
+    distinct = []
+    codes = []
+    for value in values:
+        value_type = type(value)
+        key = (value_type, value.hex() if value_type is float else value)
+        try:
+            code = positions.get(key)
+        except TypeError:
+            codes.append(-1 - len(distinct))
+            distinct.append(value)
+            continue
+        if code is None:
+            code = positions[key] = len(distinct)
+            distinct.append(value)
+        codes.append(code)
+    results = [result if type(result) in _SHAREABLE_TYPES else _CopyOnRead(result)
+               for result in compiled.normalize_many(distinct)]
+    out = []
+    append = out.append
+    for code in codes:
+        result = results[code if code >= 0 else -1 - code]
+        append(result.copy() if type(result) is _CopyOnRead else result)
+    return out
+
+
+def normalize_chunk_columnar(records: List[Dict[str, Any]], plan: List[Tuple[str, CompiledField]]) -> List[Dict[str, Any]]:
+    """
+    Normalizes a chunk of records column by column.
+
+    The columnar path needs every record of the chunk to have the same fields in the
+    same order, as standardized records do. Otherwise, and for fields whose rules look
+    at other fields of the item ('$condition'), the chunk falls back to row mode. The
+    output is identical to calling `normalize_record` on each record.
+
+    Args:
+        records (List[Dict[str, Any]]): A chunk of standardized records.
+        plan (List[Tuple[str, CompiledField]]): A plan from `compile_normalization_map`.
+
+    Returns:
+        List[Dict[str, Any]]: The normalized records, in the same order.
+    """
+    if not records:
+        return []
+    first = records[0]
+    fields = tuple(first) if isinstance(first, dict) else None
+    if fields is None or any(compiled.uses_item for _, compiled in plan) or \
+            any(not isinstance(record, dict) or tuple(record) != fields for record in records):
+        return [normalize_record(record, plan) for record in records]
+
+    columns = records_to_columns(records, fields)
+    for field, compiled in plan:
+        if field in columns:
+            columns[field] = normalize_column(columns[field], compiled)
+    return columns_to_records(columns, fields)
+
+
+def normalize_columnar_stage(
+    records: Iterable[Dict[str, Any]],
+    normalization_map: Dict[str, Any],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    cache: Optional[NormalizationCache] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Columnar counterpart of `pipeline.normalize_stage`.
+
+    The stream is cut into chunks of `chunk_size` records, each normalized column by
+    column, so memory is bounded by one chunk whatever the number of records.
+
+    Args:
+        records (Iterable[Dict[str, Any]]): Standardized records.
+        normalization_map (Dict[str, Any]): The normalization map from config.json.
+        chunk_size (int): Number of records loaded into columns at a time.
+        cache (Optional[NormalizationCache]): Memo shared across chunks, so a value
+            seen in an earlier chunk is not normalized again.
+
+    Yields:
+        Dict[str, Any]: Each normalized record, in input order.
+    """
+    plan = compile_normalization_map(normalization_map)
+    if cache is not None:
+        plan = cache.memoize(plan)
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield from normalize_chunk_columnar(chunk, plan)
+            chunk = []
+    if chunk:
+        yield from normalize_chunk_columnar(chunk, plan)
@@ -0,0 +1,293 @@
+import bisect
+import itertools
+import json
+import os
+import sys
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataprocessing.functions import bin_labels
+from dataprocessing.grouping import grouping_ops
+from dataprocessing.recordio import open_record_writer
+
+DEFAULT_MAX_DIMENSIONS = 2
+# A value-map.json field with more values than this is not treated as categorical
+DEFAULT_MAX_CATEGORIES = 50
+PERIODS = ("year", "quarter", "month")
+
+
+def categorical_fields(value_map: Dict[str, Any], max_categories: int = DEFAULT_MAX_CATEGORIES) -> List[str]:
+    """
+    Returns the categorical fields of a value map such as value-map.json: the fields
+    whose allowed values are a short list of strings, nulls aside.
+
+    Args:
+        value_map (Dict[str, Any]): The value map, nested like the grouped records.
+        max_categories (int): The most values a categorical field may have.
+
+    Returns:
+        List[str]: The names of the categorical fields, in the order of the map.
+    """
+    fields = []
+    for name, values in value_map.items():
+        if isinstance(values, dict):
+            fields.extend(categorical_fields(values, max_categories))
+        elif isinstance(values, list):
+            categories = [value for value in values if value is not None]
+            if categories and len(categories) <= max_categories and all(isinstance(value, str) for value in categories):
+                fields.append(name)
+    return fields
+
+
+class Dimension:
+    """
+    One axis of the cube: a field of the grouped records, taken as is, cut into ranges
+    by `bins`, or truncated to a `period` of its ISO date.
+    """
+
+    def __init__(self, name: str, path: Tuple[str, ...], bins: Optional[Sequence[float]] = None,
+                 period: Optional[str] = None):
+        if bins is not None and list(bins) != sorted(bins):
+            raise ValueError(f"The bins of dimension '{name}' must be in ascending order")
+        if period is not None and period not in PERIODS:
+            raise ValueError(f"Unknown period '{period}' for dimension '{name}', "
+                             f"expected one of {', '.join(PERIODS)}")
+        self.name = name
+        self.path = path
+        self.bins = list(bins) if bins else None
+        self.labels = bin_labels(self.bins) if self.bins else None
+        self.period = period
+
+    def value(self, record: Dict[str, Any]) -> Any:
+        """Returns the coordinate of a grouped record on this axis; None if the field is missing."""
+        value = record
+        for key in self.path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        if value is None:
+            return None
+        if self.bins is not None:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                return None
+            return self.labels[bisect.bisect_right(self.bins, value)]
+        if self.period is not None:
+            if not isinstance(value, str) or len(value) < 7:
+                return None
+            if self.period == "year":
+                return value[:4]
+            if self.period == "month":
+                return value[:7]
+            try:
+                return f"{value[:4]}-Q{(int(value[5:7]) - 1) // 3 + 1}"
+            except ValueError:
+                return None
+        return value if isinstance(value, (str, int, float, bool)) else json.dumps(value)
+
+
+class OlapCube:
+    """
+    Counts and rate aggregates of grouped records for every combination of up to
+    `max_dimensions` dimensions, computed in one streaming pass.
+
+    Each cell of a cuboid, i.e. of one combination of dimensions, holds the number of
+    records, their count per value of the measure field (e.g. per outcome), the rate
+    of the positive value over the positive and negative ones (e.g. the approval rate),
+    and the sum, count and mean of each `sums` field. The cuboid without dimensions
+    holds the totals.
+    """
+
+    def __init__(
+        self,
+        dimensions: List[Dimension],
+        measure: Dimension,
+        positive: Any,
+        negative: Sequence[Any],
+        max_dimensions: int = DEFAULT_MAX_DIMENSIONS,
+        cuboids: Optional[List[List[str]]] = None,
+        sums: Optional[List[Dimension]] = None,
+    ):
+        names = [dimension.name for dimension in dimensions]
+        if len(set(names)) != len(names):
+            raise ValueError("Cube dimensions must have distinct names")
+        reserved = {"cuboid", "count", "rate", "sums", measure.name} & set(names)
+        if reserved:
+            raise ValueError(f"Cube dimension name(s) {', '.join(sorted(reserved))} are taken by the cell aggregates")
+        self.dimensions = dimensions
+        self.measure = measure
+        self.positive = positive
+        self.negative = set(negative)
+        self.sums = sums or []
+        if cuboids is None:
+            combinations = [combination for size in range(min(max_dimensions, len(dimensions)) + 1)
+                            for combination in itertools.combinations(range(len(dimensions)), size)]
+        else:
+            unknown = sorted({name for cuboid in cuboids for name in cuboid} - set(names))
+            if unknown:
+                raise ValueError(f"Cuboid dimension(s) {', '.join(unknown)} are not cube dimensions")
+            combinations = [()] + [tuple(sorted(names.index(name) for name in cuboid)) for cuboid in cuboids]
+            combinations = list(dict.fromkeys(combinations))
+        self.cuboids: List[Tuple[int, ...]] = combinations
+        # One {coordinates: [count, {measure value: count}, [sum, count] per sums field]} per cuboid
+        self.cells: List[Dict[Tuple[Any, ...], list]] = [{} for _ in combinations]
+        self.count = 0
+
+    def add(self, record: Dict[str, Any]):
+        """Adds a grouped record to every cuboid."""
+        self.count += 1
+        values = [dimension.value(record) for dimension in self.dimensions]
+        outcome = self.measure.value(record)
+        amounts = [field.value(record) for field in self.sums]
+        for cuboid, cells in zip(self.cuboids, self.cells):
+            key = tuple(values[i] for i in cuboid)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0, {}, [[0, 0] for _ in amounts]]
+            cell[0] += 1
+            cell[1][outcome] = cell[1].get(outcome, 0) + 1
+            for total, amount in zip(cell[2], amounts):
+                if isinstance(amount, (int, float)) and not isinstance(amount, bool):
+                    total[0] += amount
+                    total[1] += 1
+
+    def documents(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yields one document per cell, cuboid by cuboid: its cuboid, as the comma-joined
+        names of its dimensions, its coordinates under each dimension name, and its
+        aggregates. Cells come most populated first within a cuboid.
+        """
+        for cuboid, cells in zip(self.cuboids, self.cells):
+            names = [self.dimensions[i].name for i in cuboid]
+            cuboid_name = ",".join(names)
+            for key, (count, outcomes, totals) in sorted(
+                    cells.items(), key=lambda item: (-item[1][0], json.dumps(item[0]))):
+                positive = outcomes.get(self.positive, 0)
+                decided = positive + sum(n for value, n in outcomes.items() if value in self.negative)
+                document = {"cuboid": cuboid_name}
+                document.update(zip(names, key))
+                document["count"] = count
+                document[self.measure.name] = {"null" if value is None else str(value): n
+                                               for value, n in sorted(outcomes.items(), key=lambda item: -item[1])}
+                document["rate"] = round(positive / decided, 6) if decided else None
+                if self.sums:
+                    document["sums"] = {
+                        field.name: {"sum": total, "count": n, "mean": round(total / n, 6) if n else None}
+                        for field, (total, n) in zip(self.sums, totals)}
+                yield document
+
+    def summary(self) -> List[str]:
+        """Returns the lines summing up the cube."""
+        cells = sum(len(cells) for cells in self.cells)
+        return [f"Cube: {self.count} records in {cells} cells of {len(self.cuboids)} cuboids "
+                f"over {len(self.dimensions)} dimensions"]
+
+
+def cube_stage(records: Iterable[Dict[str, Any]], cube: OlapCube) -> Iterator[Dict[str, Any]]:
+    """Adds each grouped record to the cube, and yields it unchanged."""
+    add = cube.add
+    for record in records:
+        add(record)
+        yield record
+
+
+def write_cube(cube: OlapCube, path: str) -> int:
+    """
+    Writes the cells of a cube to a record file, in the format given by its extension.
+
+    Returns:
+        int: The number of cells written.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open_record_writer(path) as writer:
+        for document in cube.documents():
+            writer.write(document)
+    return writer.count
+
+
+def make_cube(settings: Optional[Dict[str, Any]], grouping_config: Dict[str, Any],
+              value_map: Optional[Dict[str, Any]] = None) -> Optional[OlapCube]:
+    """
+    Builds an OlapCube from the "cube" section of config.json, or returns None if the
+    section is missing or not enabled.
+
+    Args:
+        settings (Optional[Dict[str, Any]]): The "cube" section. Its `dimensions` are
+            field names of grouping.json, or objects with a `field` and either `bins`
+            or a `period`, and an optional `name`. With `categorical`, true when there
+            are no `dimensions`, the categorical fields of `value_map` come first.
+        grouping_config (Dict[str, Any]): The grouping configuration, to find the fields.
+        value_map (Optional[Dict[str, Any]]): value-map.json, for the default dimensions.
+
+    Returns:
+        Optional[OlapCube]: The cube, empty.
+    """
+    if not settings or not settings.get("enabled", False):
+        return None
+    paths = {source: path for path, source in grouping_ops(grouping_config) if source is not None}
+
+    def dimension(spec):
+        if isinstance(spec, str):
+            spec = {"field": spec}
+        field = spec["field"]
+        if field not in paths:
+            raise ValueError(f"Cube field '{field}' is not in the grouping configuration")
+        name = spec.get("name") or (f"{field}_{spec['period']}" if spec.get("period") else field)
+        return Dimension(name, paths[field], spec.get("bins"), spec.get("period"))
+
+    measure_settings = settings.get("measure", {"field": "outcome"})
+    measure = dimension(measure_settings["field"])
+    specs = list(settings.get("dimensions", []))
+    if settings.get("categorical", "dimensions" not in settings):
+        if value_map is None:
+            raise ValueError("The cube needs value-map.json to find the categorical fields")
+        listed = {spec if isinstance(spec, str) else spec["field"] for spec in specs}
+        specs[:0] = [field for field in categorical_fields(value_map, settings.get("max_categories", DEFAULT_MAX_CATEGORIES))
+                     if field != measure.name and field in paths and field not in listed]
+    return OlapCube(
+        [dimension(spec) for spec in specs],
+        measure,
+        measure_settings.get("positive", "APPROVED"),
+        measure_settings.get("negative", ["REFUSED"]),
+        settings.get("max_dimensions", DEFAULT_MAX_DIMENSIONS),
+        settings.get("cuboids"),
+        [dimension(field) for field in settings.get("sums", [])],
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from dataprocessing.recordio import iter_records
+
+    parser = argparse.ArgumentParser(description="Compute the aggregate cube of a grouped record file.")
+    parser.add_argument("input_file", help="Grouped records.")
+    parser.add_argument("--config", default="pipeline-setup/config.json", help="Path to config.json.")
+    parser.add_argument("--output", required=True, help="Path of the cube cells file.")
+    parser.add_argument("--show", metavar="CUBOID",
+                        help="Print the cells of a cuboid, e.g. 'entry_level' or 'entry_level,school_type'.")
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    data_paths = config["dataPaths"]
+    with open(data_paths["groupingConfigPath"], 'r', encoding='utf-8') as f:
+        grouping_config = json.load(f)
+    value_map = None
+    if data_paths.get("valueMapPath") and os.path.exists(data_paths["valueMapPath"]):
+        with open(data_paths["valueMapPath"], 'r', encoding='utf-8') as f:
+            value_map = json.load(f)
+    cube = make_cube(dict(config.get("cube") or {}, enabled=True), grouping_config, value_map)
+    for _ in cube_stage(iter_records(args.input_file), cube):
+        pass
+    cells = write_cube(cube, args.output)
+    print("\n".join(cube.summary()))
+    print(f"Wrote {cells} cells to {args.output}")
+    if args.show is not None:
+        for document in cube.documents():
+            if document["cuboid"] == args.show:
+                print(json.dumps(document, ensure_ascii=False))
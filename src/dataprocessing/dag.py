@@ -0,0 +1,295 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+# A resource is a file path, or 'path#key' for one top-level key of a JSON file
+KEY_SEPARATOR = "#"
+
+
+class Step:
+    """
+    One step of a pipeline DAG: a function with the resources it reads and writes.
+
+    Edges are not declared: a step depends on the steps of the same run that write one
+    of its inputs. A disabled step is left out of the run unless it is asked for by
+    name (see `PipelineDag.select`).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Any],
+        inputs: Iterable[str] = (),
+        outputs: Iterable[str] = (),
+        params: Optional[Dict[str, Any]] = None,
+        enabled: bool = True,
+        description: str = "",
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        # Options that change what the step writes, part of its checkpoint fingerprint
+        self.params = params or {}
+        self.enabled = enabled
+        self.description = description or name
+
+
+def _load_json_key(path: str, key: str) -> Any:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get(key)
+
+
+def resource_exists(resource: str) -> bool:
+    """Tells whether a file, or a key of a JSON file, exists."""
+    path, _, key = resource.partition(KEY_SEPARATOR)
+    if not os.path.isfile(path):
+        return False
+    if not key:
+        return True
+    with open(path, 'r', encoding='utf-8') as f:
+        return key in json.load(f)
+
+
+def resource_fingerprint(resource: str) -> Optional[str]:
+    """
+    Returns a fingerprint of a resource that changes whenever the resource does, or
+    None if it does not exist. Files are fingerprinted by size and modification time,
+    so that a large input is never read just to decide whether a step is up to date.
+    JSON keys are fingerprinted by content, so an edit elsewhere in the file does not
+    count as a change.
+    """
+    path, _, key = resource.partition(KEY_SEPARATOR)
+    if not os.path.isfile(path):
+        return None
+    if not key:
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    text = json.dumps(_load_json_key(path, key), ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class PipelineDag:
+    """
+    Steps of a pipeline, declared in an order where every step comes after the steps
+    that write its inputs.
+    """
+
+    def __init__(self, steps: List[Step]):
+        self.steps = {}
+        self.producers: Dict[str, str] = {}
+        for step in steps:
+            if step.name in self.steps:
+                raise ValueError(f"Duplicate step name: {step.name}")
+            for resource in step.inputs:
+                if resource in self.producers:
+                    continue
+                for later in steps[len(self.steps):]:
+                    if resource in later.outputs:
+                        raise ValueError(
+                            f"Step '{step.name}' reads {resource}, which is written by "
+                            f"the later step '{later.name}'")
+            for resource in step.outputs:
+                if resource in self.producers:
+                    raise ValueError(
+                        f"{resource} is written by both '{self.producers[resource]}' "
+                        f"and '{step.name}'")
+                self.producers[resource] = step.name
+            self.steps[step.name] = step
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.steps)
+
+    def _check_names(self, names: Iterable[str]):
+        unknown = [name for name in names if name not in self.steps]
+        if unknown:
+            raise ValueError(f"Unknown step(s) {', '.join(unknown)}; "
+                             f"the steps are: {', '.join(self.steps)}")
+
+    def dependencies(self, name: str, among: Optional[Set[str]] = None) -> Set[str]:
+        """Returns the steps, among `among` if given, that write an input of step `name`."""
+        deps = {self.producers[resource] for resource in self.steps[name].inputs
+                if resource in self.producers}
+        return deps & among if among is not None else deps
+
+    def _closure(self, name: str, downstream: bool) -> Set[str]:
+        """Returns a step with all its descendants, or with all its ancestors."""
+        found = {name}
+        names = list(self.steps)
+        ordered = names[names.index(name):] if downstream else reversed(names[:names.index(name) + 1])
+        for other in ordered:
+            if downstream and self.dependencies(other) & found:
+                found.add(other)
+            elif not downstream and other in found:
+                found |= self.dependencies(other)
+        return found
+
+    def select(
+        self,
+        start: Optional[str] = None,
+        stop: Optional[str] = None,
+        only: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        Returns the names of the steps to run, in declaration order.
+
+        Args:
+            start (Optional[str]): Run this step and every step downstream of it.
+            stop (Optional[str]): Run this step and every step upstream of it.
+            only (Optional[List[str]]): Run exactly these steps, enabled or not.
+
+        Returns:
+            List[str]: The selected steps. Apart from those listed in `only`, disabled
+            steps are left out.
+
+        Raises:
+            ValueError: If a step name is unknown, or `only` is combined with a range.
+        """
+        if only:
+            if start or stop:
+                raise ValueError("--only cannot be combined with --from or --to")
+            self._check_names(only)
+            return [name for name in self.steps if name in only]
+        self._check_names([name for name in (start, stop) if name])
+        selected = {name for name, step in self.steps.items() if step.enabled}
+        if start:
+            selected &= self._closure(start, downstream=True)
+        if stop:
+            selected &= self._closure(stop, downstream=False)
+        return [name for name in self.steps if name in selected]
+
+    def check_inputs(self, selected: List[str]):
+        """
+        Raises a ValueError if a selected step reads a resource that a step left out of
+        the run should have written, and that does not exist yet.
+        """
+        for name in selected:
+            for resource in self.steps[name].inputs:
+                producer = self.producers.get(resource)
+                if producer and producer not in selected and not resource_exists(resource):
+                    raise ValueError(
+                        f"Step '{name}' needs {resource}, which step '{producer}' writes: "
+                        f"run '{producer}' first")
+
+    def fingerprint(self, name: str) -> str:
+        """Returns the fingerprint of a step's inputs and params, used by checkpoints."""
+        step = self.steps[name]
+        state = {"inputs": {resource: resource_fingerprint(resource) for resource in step.inputs},
+                 "params": step.params}
+        text = json.dumps(state, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def is_up_to_date(self, name: str, checkpoint: Dict[str, Any]) -> bool:
+        """Tells whether a step completed with the same inputs, and its outputs still exist."""
+        entry = checkpoint.get("steps", {}).get(name)
+        return (entry is not None and entry.get("fingerprint") == self.fingerprint(name)
+                and all(resource_exists(resource) for resource in self.steps[name].outputs))
+
+    def run(
+        self,
+        selected: List[str],
+        checkpoint_path: Optional[str] = None,
+        resume: bool = False,
+        jobs: int = 1,
+        wrap: Optional[Callable[[str, Callable[[], Any]], Callable[[], Any]]] = None,
+    ) -> bool:
+        """
+        Runs the selected steps, each as soon as the selected steps it depends on are done.
+
+        Up to `jobs` independent steps run at the same time, on threads: steps overlap
+        their file and database I/O, and the CPU-bound work of a step is spread over its
+        own process pool when it has one. A step whose input files do not exist when it
+        starts fails without running. After each completed step, its fingerprint is
+        saved to `checkpoint_path`. If a step fails, the steps already running are
+        finished, nothing else is started, and the run can be resumed.
+
+        Args:
+            selected (List[str]): Names of the steps to run, from `select`.
+            checkpoint_path (Optional[str]): JSON file recording the completed steps.
+            resume (bool): Skip the steps that completed with the same inputs and params
+                in an earlier run and whose outputs still exist.
+            jobs (int): Maximum number of steps running at the same time.
+            wrap (Optional[Callable]): Called with each step's name and function, and
+                returns the function to run instead, e.g. to time it.
+
+        Returns:
+            bool: True if every selected step completed or was up to date.
+        """
+        checkpoint = {"steps": {}}
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        lock = threading.Lock()
+        selected_set = set(selected)
+        remaining = {name: self.dependencies(name, selected_set) for name in selected}
+        done: Set[str] = set()
+        failed: List[str] = []
+
+        def save_checkpoint(name, fingerprint):
+            with lock:
+                checkpoint["steps"][name] = {
+                    "fingerprint": fingerprint,
+                    "completed": datetime.datetime.now().isoformat(timespec="seconds"),
+                }
+                if checkpoint_path:
+                    directory = os.path.dirname(checkpoint_path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    temp_path = checkpoint_path + ".tmp"
+                    with open(temp_path, 'w', encoding='utf-8') as f:
+                        json.dump(checkpoint, f, indent=2)
+                    os.replace(temp_path, checkpoint_path)
+
+        def run_step(name):
+            step = self.steps[name]
+            # A step never runs on a missing file, which it would read as empty
+            missing = [resource for resource in step.inputs
+                       if KEY_SEPARATOR not in resource and not os.path.isfile(resource)]
+            if missing:
+                raise FileNotFoundError(f"missing input {', '.join(missing)}")
+            # Fingerprinted before running, so it describes the inputs the step read
+            fingerprint = self.fingerprint(name)
+            func = wrap(name, step.func) if wrap else step.func
+            func()
+            save_checkpoint(name, fingerprint)
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            running = {}
+            while remaining or running:
+                if not failed:
+                    ready = [name for name in selected
+                             if name in remaining and remaining[name] <= done]
+                    for name in ready:
+                        del remaining[name]
+                        if resume and self.is_up_to_date(name, checkpoint):
+                            print(f"\n--- Skipping '{name}': up to date since the last run ---")
+                            done.add(name)
+                            continue
+                        print(f"\n--- Running '{name}': {self.steps[name].description} ---")
+                        running[executor.submit(run_step, name)] = name
+                    if any(name in remaining and remaining[name] <= done for name in selected):
+                        # A skipped step made more steps ready
+                        continue
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        print(f"\nStep '{name}' failed: {type(error).__name__}: {error}")
+                        failed.append(name)
+                    else:
+                        done.add(name)
+
+        if failed:
+            print(f"\nPipeline stopped after the failure of {', '.join(failed)}. "
+                  f"Completed steps are recorded in {checkpoint_path}; rerun with --resume "
+                  f"to continue from there.")
+            return False
+        return True
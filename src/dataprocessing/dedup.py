@@ -0,0 +1,389 @@
+import json
+import os
+import re
+import sqlite3
+import zlib
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from dataprocessing.ids import canonical_json
+from dataprocessing.recordio import NdjsonWriter, iter_ndjson
+
+DEDUP_POLICIES = ("first", "last", "most_complete")
+DEFAULT_POLICY = "first"
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+DEFAULT_SHINGLE_SIZE = 3
+# Dropped records listed one by one in the report; the counts always cover all of them
+MAX_REPORTED_DUPLICATES = 1000
+# Page cache of the SQLite index, in KiB: enough to keep its upper B-tree levels in memory
+INDEX_CACHE_KB = 65536
+
+_WORD = re.compile(r"\w+")
+
+# (content id, MinHash signature or None, number of filled fields) of a record
+DedupKey = Tuple[str, Optional[Tuple[int, ...]], int]
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures of records over a subset of their fields.
+
+    A record is turned into a set of shingles: the word n-grams of its text values, and
+    the JSON of every other value or list item, each hashed with CRC-32 seeded by its
+    field. The share of equal positions in two signatures estimates the Jaccard
+    similarity of their shingle sets.
+
+    Rather than hashing every shingle `num_perm` times, signatures use one permutation
+    hashing: each shingle is hashed once, the hash picks one of `num_perm` bins, and each
+    bin keeps its smallest hash. An empty bin borrows the value of the next non-empty
+    bin, tagged with its distance (rotation densification), so that two empty bins only
+    match when their neighbourhoods do. A record with a hundred shingles then costs a
+    hundred hashes instead of several thousand.
+    """
+
+    def __init__(self, fields: Sequence[str], num_perm: int = DEFAULT_NUM_PERM,
+                 shingle_size: int = DEFAULT_SHINGLE_SIZE):
+        if num_perm < 1:
+            raise ValueError(f"num_perm must be positive, got {num_perm}")
+        self.fields = list(fields)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # Text and other values of a field hash apart from each other and other fields
+        self._seeds = [(field, zlib.crc32(f"{field}:".encode("utf-8")),
+                        zlib.crc32(f"{field}=".encode("utf-8"))) for field in self.fields]
+
+    def shingle_hashes(self, record: Dict[str, Any]) -> Set[int]:
+        """Returns the 32-bit hashes of the shingles of a record's fields."""
+        hashes = set()
+        size = self.shingle_size
+        crc32 = zlib.crc32
+        for field, text_seed, value_seed in self._seeds:
+            value = record.get(field)
+            if value is None:
+                continue
+            if isinstance(value, str):
+                words = _WORD.findall(value.lower())
+                if len(words) <= size:
+                    if words:
+                        hashes.add(crc32(" ".join(words).encode("utf-8"), text_seed))
+                    continue
+                # Shingles are slices of the words joined by single spaces
+                text = " ".join(words)
+                ends = []
+                end = -1
+                for word in words:
+                    end += len(word) + 1
+                    ends.append(end)
+                starts = [0] + [end + 1 for end in ends]
+                hashes.update(crc32(text[starts[i]:ends[i + size - 1]].encode("utf-8"), text_seed)
+                              for i in range(len(words) - size + 1))
+            elif isinstance(value, list):
+                hashes.update(crc32(canonical_json(item).encode("utf-8"), value_seed)
+                              for item in value)
+            else:
+                hashes.add(crc32(canonical_json(value).encode("utf-8"), value_seed))
+        return hashes
+
+    def signature(self, record: Dict[str, Any]) -> Optional[Tuple[int, ...]]:
+        """Returns the MinHash signature of a record, or None if its fields are all empty."""
+        hashes = self.shingle_hashes(record)
+        if not hashes:
+            return None
+        num_perm = self.num_perm
+        bins: List[Optional[int]] = [None] * num_perm
+        for h in hashes:
+            index, value = h % num_perm, h // num_perm
+            if bins[index] is None or value < bins[index]:
+                bins[index] = value
+        signature = []
+        for index in range(num_perm):
+            distance = 0
+            while bins[(index + distance) % num_perm] is None:
+                distance += 1
+            signature.append(bins[(index + distance) % num_perm] + (distance << 32))
+        return tuple(signature)
+
+
+def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Estimates the Jaccard similarity of two records from their MinHash signatures."""
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+def dedup_key(record: Dict[str, Any], hasher: Optional[MinHasher] = None) -> DedupKey:
+    """
+    Returns what deduplication needs to know of a record with its content `id`.
+
+    Args:
+        record (Dict[str, Any]): A record with its id, before grouping.
+        hasher (Optional[MinHasher]): The hasher of the near-duplicate fields, if any.
+
+    Returns:
+        DedupKey: The record's id, signature and number of filled fields, small
+            enough to be sent back from a worker process with the grouped record.
+    """
+    filled = sum(1 for field, value in record.items()
+                 if field != 'id' and value is not None and value != "" and value != [])
+    signature = hasher.signature(record) if hasher is not None else None
+    return record['id'], signature, filled
+
+
+class Deduplicator:
+    """
+    Drops exact and near duplicates from a record stream, using an on-disk index.
+
+    Records are clustered in stream order. A record whose content id is already in
+    the index joins the cluster of that id. Otherwise, with near-duplicate fields, the
+    locality-sensitive hashing buckets of its signature give the clusters that may be
+    similar, and it joins the most similar one if their estimated Jaccard similarity
+    reaches `threshold`. Otherwise it starts a new cluster. Each record is compared to
+    a handful of candidates instead of every record seen, and the ids, buckets and
+    signatures live in SQLite, so neither time nor memory grows quadratically.
+
+    One record of each cluster survives, chosen by `policy`:
+
+    - "first": the earliest record; the stream is filtered as it flows.
+    - "last": the latest record, e.g. from the most recent yearly dump.
+    - "most_complete": the record with the most filled fields, the earliest on ties.
+
+    With "last" and "most_complete", the records are spilled to disk next to the index
+    and survivors are emitted, in stream order, once the stream is exhausted.
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        near_duplicate_fields: Sequence[str] = (),
+        threshold: float = DEFAULT_THRESHOLD,
+        num_perm: int = DEFAULT_NUM_PERM,
+        bands: int = DEFAULT_BANDS,
+        shingle_size: int = DEFAULT_SHINGLE_SIZE,
+        policy: str = DEFAULT_POLICY,
+    ):
+        if policy not in DEDUP_POLICIES:
+            raise ValueError(f"Unknown dedup policy '{policy}', expected one of {', '.join(DEDUP_POLICIES)}")
+        if not 0 < threshold <= 1:
+            raise ValueError(f"The dedup threshold must be in (0, 1], got {threshold}")
+        if bands < 1 or num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.index_path = index_path
+        self.policy = policy
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = (MinHasher(near_duplicate_fields, num_perm, shingle_size)
+                       if near_duplicate_fields else None)
+        self.report: Optional[Dict[str, Any]] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._ordinal = 0
+
+    def key(self, record: Dict[str, Any]) -> DedupKey:
+        """Returns the dedup key of a record (see `dedup_key`)."""
+        return dedup_key(record, self.hasher)
+
+    def open(self):
+        """Starts a new, empty index, replacing the one of an earlier run."""
+        directory = os.path.dirname(self.index_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        db = sqlite3.connect(self.index_path)
+        # A scratch index rebuilt by every run: durability is not worth its cost
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute(f"PRAGMA cache_size = -{INDEX_CACHE_KB}")
+        # A cluster is numbered after the stream position of its first record
+        db.executescript("""
+            CREATE TABLE ids (id TEXT PRIMARY KEY, cluster INTEGER) WITHOUT ROWID;
+            CREATE TABLE buckets (band_key INTEGER, cluster INTEGER,
+                                  PRIMARY KEY (band_key, cluster)) WITHOUT ROWID;
+            CREATE TABLE clusters (cluster INTEGER PRIMARY KEY, id TEXT, signature BLOB,
+                                   survivor INTEGER, survivor_id TEXT, filled INTEGER,
+                                   size INTEGER);
+            CREATE TABLE duplicates (ordinal INTEGER PRIMARY KEY, id TEXT, cluster INTEGER,
+                                     kind TEXT, similarity REAL);
+        """)
+        self._insert_buckets = ("INSERT OR IGNORE INTO buckets VALUES "
+                                + ",".join(["(?, ?)"] * self.bands))
+        self._db = db
+        self._ordinal = 0
+        self.report = None
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[int]:
+        rows = self.rows
+        # Hashes of tuples of ints do not depend on PYTHONHASHSEED
+        return [hash((band,) + signature[band * rows:(band + 1) * rows])
+                for band in range(self.bands)]
+
+    def _nearest_cluster(self, signature: Tuple[int, ...], band_keys: List[int]) -> Tuple[Optional[int], float]:
+        placeholders = ",".join("?" * len(band_keys))
+        best, best_similarity = None, 0.0
+        for cluster, blob in self._db.execute(
+                f"SELECT cluster, signature FROM clusters WHERE cluster IN "
+                f"(SELECT cluster FROM buckets WHERE band_key IN ({placeholders}))", band_keys):
+            score = similarity(signature, array('Q', blob))
+            if score >= self.threshold and (score > best_similarity or
+                                            (score == best_similarity and cluster < best)):
+                best, best_similarity = cluster, score
+        return best, best_similarity
+
+    def add(self, key: DedupKey) -> bool:
+        """
+        Adds the next record of the stream to the index.
+
+        Returns:
+            bool: True if the record starts a new cluster, i.e. is not a duplicate of
+                an earlier record.
+        """
+        db = self._db
+        record_id, signature, filled = key
+        ordinal = self._ordinal
+        self._ordinal += 1
+        kind = None
+        row = db.execute("SELECT cluster FROM ids WHERE id = ?", (record_id,)).fetchone()
+        if row is not None:
+            cluster, kind, score = row[0], "exact", 1.0
+        elif signature is not None:
+            band_keys = self._band_keys(signature)
+            cluster, score = self._nearest_cluster(signature, band_keys)
+            if cluster is not None:
+                kind = "near"
+
+        if kind is None:
+            blob = array('Q', signature).tobytes() if signature is not None else None
+            db.execute("INSERT INTO clusters VALUES (?, ?, ?, ?, ?, ?, 1)",
+                       (ordinal, record_id, blob, ordinal, record_id, filled))
+            if signature is not None:
+                db.execute(self._insert_buckets,
+                           [value for band_key in band_keys for value in (band_key, ordinal)])
+            db.execute("INSERT INTO ids VALUES (?, ?)", (record_id, ordinal))
+            return True
+
+        if self.policy == "last":
+            db.execute("UPDATE clusters SET survivor = ?, survivor_id = ?, filled = ?, size = size + 1 "
+                       "WHERE cluster = ?", (ordinal, record_id, filled, cluster))
+        elif self.policy == "most_complete":
+            db.execute("UPDATE clusters SET survivor = CASE WHEN ? > filled THEN ? ELSE survivor END, "
+                       "survivor_id = CASE WHEN ? > filled THEN ? ELSE survivor_id END, "
+                       "filled = MAX(filled, ?), size = size + 1 WHERE cluster = ?",
+                       (filled, ordinal, filled, record_id, filled, cluster))
+        else:
+            db.execute("UPDATE clusters SET size = size + 1 WHERE cluster = ?", (cluster,))
+        if kind == "near":
+            db.execute("INSERT OR IGNORE INTO ids VALUES (?, ?)", (record_id, cluster))
+        db.execute("INSERT INTO duplicates VALUES (?, ?, ?, ?, ?)", (ordinal, record_id, cluster, kind, score))
+        return False
+
+    def survivors(self) -> Iterator[int]:
+        """Yields the stream positions of the surviving records, in increasing order."""
+        for (ordinal,) in self._db.execute("SELECT survivor FROM clusters ORDER BY survivor"):
+            yield ordinal
+
+    def close(self):
+        """Builds the report of the run and closes the index, which is kept on disk."""
+        db = self._db
+        counts = dict(db.execute("SELECT kind, COUNT(*) FROM duplicates GROUP BY kind"))
+        duplicates = [
+            {"id": record_id, "survivor": survivor_id, "kind": kind,
+             "similarity": round(score, 3)}
+            for _, record_id, survivor_id, kind, score in db.execute(
+                "SELECT d.ordinal, d.id, c.survivor_id, d.kind, d.similarity "
+                "FROM duplicates d JOIN clusters c ON c.cluster = d.cluster "
+                "WHERE d.ordinal != c.survivor "
+                "UNION ALL "
+                # A dropped first record is reported with how its survivor matched it
+                "SELECT c.cluster, c.id, c.survivor_id, s.kind, s.similarity "
+                "FROM clusters c JOIN duplicates s ON s.ordinal = c.survivor "
+                "WHERE c.survivor != c.cluster "
+                "ORDER BY 1 LIMIT ?", (MAX_REPORTED_DUPLICATES,))
+        ]
+        records_out, clusters = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size > 1), 0) FROM clusters").fetchone()
+        self.report = {
+            "policy": self.policy,
+            "near_duplicate_fields": self.hasher.fields if self.hasher is not None else [],
+            "threshold": self.threshold,
+            "records_in": self._ordinal,
+            "records_out": records_out,
+            "exact_duplicates": counts.get("exact", 0),
+            "near_duplicates": counts.get("near", 0),
+            "duplicate_clusters": clusters,
+            "duplicates": duplicates,
+        }
+        db.commit()
+        db.close()
+        self._db = None
+
+    def summary(self) -> str:
+        """Describes the last run in one line."""
+        report = self.report
+        return (f"Dedup: kept {report['records_out']} of {report['records_in']} records, "
+                f"dropped {report['exact_duplicates']} exact and {report['near_duplicates']} "
+                f"near duplicate(s) ({self.policy} record of each cluster kept).")
+
+    def write_report(self, path: str):
+        """Writes the report of the last run as JSON."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report, f, indent=2, ensure_ascii=False)
+
+
+def dedup_stage(records: Iterable[Any], deduplicator: Deduplicator, keyed: bool = False) -> Iterator[Any]:
+    """
+    Drops the duplicates of a record stream (see `Deduplicator`).
+
+    Args:
+        records (Iterable[Any]): Records with their ids, or with `keyed`, (record, key)
+            pairs whose key was computed earlier, e.g. by a worker before grouping.
+        deduplicator (Deduplicator): Holds the settings, and the report once the
+            stream is exhausted.
+        keyed (bool): Whether `records` holds (record, key) pairs.
+
+    Yields:
+        Any: The surviving records, in stream order.
+    """
+    pairs = records if keyed else ((record, deduplicator.key(record)) for record in records)
+    deduplicator.open()
+    if deduplicator.policy == "first":
+        for record, key in pairs:
+            if deduplicator.add(key):
+                yield record
+        deduplicator.close()
+        return
+
+    # The survivors are only known at the end: spill the stream and read it back
+    spill_path = deduplicator.index_path + ".spill.ndjson"
+    with NdjsonWriter(spill_path) as writer:
+        for record, key in pairs:
+            deduplicator.add(key)
+            writer.write(record)
+    survivors = deduplicator.survivors()
+    next_survivor = next(survivors, None)
+    for ordinal, record in enumerate(iter_ndjson(spill_path)):
+        if ordinal == next_survivor:
+            yield record
+            next_survivor = next(survivors, None)
+    deduplicator.close()
+    os.remove(spill_path)
+
+
+def make_deduplicator(settings: Optional[Dict[str, Any]], index_path: str) -> Optional[Deduplicator]:
+    """
+    Builds a Deduplicator from the "dedup" section of config.json, or returns None if
+    it is missing or not enabled.
+    """
+    if not settings or not settings.get("enabled", False):
+        return None
+    return Deduplicator(
+        index_path,
+        settings.get("near_duplicate_fields", []),
+        settings.get("threshold", DEFAULT_THRESHOLD),
+        settings.get("num_perm", DEFAULT_NUM_PERM),
+        settings.get("bands", DEFAULT_BANDS),
+        settings.get("shingle_size", DEFAULT_SHINGLE_SIZE),
+        settings.get("policy", DEFAULT_POLICY),
+    )
@@ -0,0 +1,337 @@
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataprocessing.normalize import _MISSING, _run_compiled_rule, compile_normalization_map
+from dataprocessing.profiling import DEFAULT_EXACT_THRESHOLD, DEFAULT_TOP_K, profile_field_values
+from dataprocessing.recordio import iter_records
+
+# Outcomes of a value, in the order CompiledField.normalize tries them
+OUTCOMES = ("mapping", "rule", "default", "unchanged")
+# Values listed per field and per category in the text report
+DEFAULT_SHOWN_VALUES = 10
+
+# (value, number of records holding it, or None when the values file has no counts)
+FieldValue = Tuple[Any, Optional[int]]
+
+
+def load_map(path: str) -> Dict[str, Any]:
+    """Loads a normalization map from a file holding either config.json or the map itself."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict) and "normalization_map" in data:
+        return data["normalization_map"]
+    return data
+
+
+def load_field_values(path: str) -> Dict[str, List[FieldValue]]:
+    """
+    Loads the distinct values of each field from a file written by
+    `normalize.collect_field_values`: plain value lists, or field profiles whose values
+    carry their record counts. Profiles of high-cardinality fields only list their most
+    frequent values.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    field_values = {}
+    for field, values in data.items():
+        if isinstance(values, dict):
+            field_values[field] = [(entry["value"], entry["count"]) for entry in values.get("values", [])]
+        else:
+            field_values[field] = [(value, None) for value in values]
+    return field_values
+
+
+def sample_field_values(
+    records: Iterable[Any],
+    sample_size: int,
+    seed: int = 0,
+    exact_threshold: int = DEFAULT_EXACT_THRESHOLD,
+    top_k: int = DEFAULT_TOP_K,
+) -> Dict[str, List[FieldValue]]:
+    """
+    Profiles the values of a uniform sample of `sample_size` records (reservoir
+    sampling, so the stream is read once and only the sample is kept), for when there
+    is no up-to-date field values file. Counts are those of the sample.
+    """
+    rng = random.Random(seed)
+    sample = []
+    for seen, record in enumerate(records):
+        if len(sample) < sample_size:
+            sample.append(record)
+        else:
+            slot = rng.randrange(seen + 1)
+            if slot < sample_size:
+                sample[slot] = record
+    profiles = profile_field_values(sample, exact_threshold, top_k)
+    return {field: [(entry["value"], entry["count"]) for entry in profile.get("values", [])]
+            for field, profile in profiles.items()}
+
+
+def _key(value: Any) -> str:
+    """The value-mapping key of a value, as in generate_normalization_map."""
+    return value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+
+
+def _same(a: Any, b: Any) -> bool:
+    return type(a) is type(b) and json.dumps(a, sort_keys=True) == json.dumps(b, sort_keys=True)
+
+
+def evaluate_value(compiled: Any, value: Any) -> Tuple[str, Optional[int], Any]:
+    """
+    Normalizes one value as the pipeline does, without the record (see
+    `normalize.normalize_record`), and tells how.
+
+    Returns:
+        Tuple[str, Optional[int], Any]: The outcome (one of OUTCOMES), the index of the
+        dynamic rule that fired, if any, and the normalized value.
+    """
+    mapped = compiled.lookup(value)
+    if mapped is not _MISSING:
+        return "mapping", None, mapped
+    for index, (ops, action) in enumerate(compiled.rules):
+        result = _run_compiled_rule(value, ops, action)
+        if result is not None:
+            return "rule", index, result
+    if compiled.has_default:
+        return "default", None, compiled.default
+    return "unchanged", None, value
+
+
+def _by_count(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return sorted(entries, key=lambda entry: -(entry["count"] or 0))
+
+
+def evaluate_field(field_config: Dict[str, Any], values: List[FieldValue]) -> Dict[str, Any]:
+    """
+    Evaluates the normalization config of one field against its distinct values.
+
+    Args:
+        field_config (Dict[str, Any]): The field's entry of a normalization map.
+        values (List[FieldValue]): Its distinct values, with their record counts if known.
+
+    Returns:
+        Dict[str, Any]: The number of values and records per outcome and per rule, the
+        unmapped values, which no value mapping or rule handles, each with its outcome:
+        "default" if it falls through to the default, "unchanged" if there is none; the
+        rules that never fire and the mappings that match no value.
+    """
+    compiled = compile_normalization_map({"field": field_config})[0][1]
+    rules = field_config.get("dynamic_rules", [])
+    outcomes = {outcome: {"values": 0, "records": 0} for outcome in OUTCOMES}
+    rule_hits = [0] * len(rules)
+    unmapped = []
+    matched_keys = set()
+    for value, count in values:
+        outcome, rule, result = evaluate_value(compiled, value)
+        outcomes[outcome]["values"] += 1
+        outcomes[outcome]["records"] += count or 0
+        if outcome == "mapping":
+            matched_keys.add(_key(value))
+        elif outcome == "rule":
+            rule_hits[rule] += 1
+        else:
+            unmapped.append({"value": value, "count": count, "result": result, "outcome": outcome})
+
+    never_fired = []
+    for index, hits in enumerate(rule_hits):
+        if hits:
+            continue
+        rule = rules[index]
+        note = ""
+        if "$condition" in rule.get("if", {}):
+            note = "'$condition' never fires: the pipeline applies rules without the record"
+        elif not compiled.rules[index][0]:
+            note = "its condition has no known operator or registered function"
+        never_fired.append({"rule": index, "if": rule.get("if", {}), "then": rule.get("then"), "note": note})
+    return {
+        "distinct_values": len(values),
+        "outcomes": outcomes,
+        "rule_hits": rule_hits,
+        "unmapped": _by_count(unmapped),
+        "rules_never_fired": never_fired,
+        "unused_mappings": [key for key in field_config.get("value_mappings", {}) if key not in matched_keys],
+    }
+
+
+def diff_field(candidate: Optional[Dict[str, Any]], deployed: Optional[Dict[str, Any]],
+               values: List[FieldValue]) -> List[Dict[str, Any]]:
+    """
+    Returns the values that the candidate config of a field normalizes differently from
+    the deployed one, with both results, most frequent first. A missing config leaves
+    values unchanged, as for a field absent from the map.
+    """
+    before_field = compile_normalization_map({"field": deployed})[0][1] if deployed is not None else None
+    after_field = compile_normalization_map({"field": candidate})[0][1] if candidate is not None else None
+    changes = []
+    for value, count in values:
+        before = evaluate_value(before_field, value) if before_field else ("unchanged", None, value)
+        after = evaluate_value(after_field, value) if after_field else ("unchanged", None, value)
+        if not _same(before[2], after[2]):
+            changes.append({"value": value, "count": count,
+                            "before": before[2], "before_outcome": before[0],
+                            "after": after[2], "after_outcome": after[0]})
+    return _by_count(changes)
+
+
+def dry_run(
+    candidate_map: Dict[str, Any],
+    field_values: Dict[str, List[FieldValue]],
+    deployed_map: Optional[Dict[str, Any]] = None,
+    fields: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Evaluates a candidate normalization map against the distinct values of each field,
+    instead of against every record: each distinct value goes through the map once.
+
+    Args:
+        candidate_map (Dict[str, Any]): The normalization map being edited.
+        field_values (Dict[str, List[FieldValue]]): Distinct values per field, from
+            `load_field_values` or `sample_field_values`.
+        deployed_map (Optional[Dict[str, Any]]): The map in use, e.g. from config.json.
+            If given, the report includes the values whose normalization changes.
+        fields (Optional[List[str]]): Only evaluate these fields.
+
+    Returns:
+        Dict[str, Any]: Per field, the report of `evaluate_field`, plus the changes of
+        `diff_field` when `deployed_map` is given; and the fields of the candidate map
+        that have no known values.
+    """
+    names = [field for field in candidate_map if fields is None or field in fields]
+    if deployed_map is not None:
+        names += [field for field in deployed_map
+                  if field not in candidate_map and (fields is None or field in fields)]
+    report = {"fields": {}, "fields_without_values": []}
+    for field in names:
+        values = field_values.get(field)
+        if values is None:
+            report["fields_without_values"].append(field)
+            continue
+        field_report = {}
+        if field in candidate_map:
+            field_report = evaluate_field(candidate_map[field], values)
+        else:
+            field_report = {"distinct_values": len(values), "removed": True}
+        if deployed_map is not None:
+            field_report["changes"] = diff_field(candidate_map.get(field), deployed_map.get(field), values)
+        report["fields"][field] = field_report
+    return report
+
+
+def _show(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _count(entry: Dict[str, Any]) -> str:
+    return f" ({entry['count']} records)" if entry["count"] is not None else ""
+
+
+def format_report(report: Dict[str, Any], max_values: int = DEFAULT_SHOWN_VALUES) -> List[str]:
+    """Lines of a text report of `dry_run`, listing at most `max_values` values per category."""
+    lines = []
+    totals = {"fields": 0, "unmapped": 0, "default": 0, "never_fired": 0, "changed": 0}
+    for field, field_report in report["fields"].items():
+        totals["fields"] += 1
+        field_lines = []
+        if field_report.get("removed"):
+            field_lines.append("  removed from the candidate map: values are left unchanged")
+        else:
+            counts = ", ".join(f"{outcome} {field_report['outcomes'][outcome]['values']}"
+                               for outcome in OUTCOMES if field_report["outcomes"][outcome]["values"])
+            totals["unmapped"] += len(field_report["unmapped"])
+            totals["never_fired"] += len(field_report["rules_never_fired"])
+            for outcome, text in (("default", "fall through to the default"), ("unchanged", "are left unchanged")):
+                unmapped = [entry for entry in field_report["unmapped"] if entry["outcome"] == outcome]
+                if outcome == "default":
+                    totals["default"] += len(unmapped)
+                if not unmapped:
+                    continue
+                field_lines.append(f"  {len(unmapped)} unmapped value(s) {text}:")
+                for entry in unmapped[:max_values]:
+                    field_lines.append(f"    {_show(entry['value'])}{_count(entry)} -> {_show(entry['result'])}")
+                if len(unmapped) > max_values:
+                    field_lines.append(f"    ... {len(unmapped) - max_values} more")
+            for rule in field_report["rules_never_fired"]:
+                note = f": {rule['note']}" if rule["note"] else ""
+                field_lines.append(f"  rule {rule['rule']} never fires {_show(rule['if'])}{note}")
+            if field_report["unused_mappings"]:
+                shown = ", ".join(_show(key) for key in field_report["unused_mappings"][:max_values])
+                field_lines.append(f"  {len(field_report['unused_mappings'])} mapping(s) match no value: {shown}")
+        changes = field_report.get("changes", [])
+        totals["changed"] += len(changes)
+        if changes:
+            field_lines.append(f"  {len(changes)} value(s) change against the deployed map:")
+            for change in changes[:max_values]:
+                field_lines.append(f"    {_show(change['value'])}{_count(change)}: "
+                                   f"{_show(change['before'])} -> {_show(change['after'])}")
+            if len(changes) > max_values:
+                field_lines.append(f"    ... {len(changes) - max_values} more")
+        if field_lines:
+            header = f"{field}: {field_report['distinct_values']} distinct value(s)"
+            if not field_report.get("removed"):
+                header += f" ({counts})"
+            lines.append(header)
+            lines.extend(field_lines)
+    if report["fields_without_values"]:
+        lines.append(f"No known values for {len(report['fields_without_values'])} field(s): "
+                     f"{', '.join(report['fields_without_values'])}")
+    lines.append(f"Dry run over {totals['fields']} field(s): {totals['unmapped']} unmapped value(s) "
+                 f"({totals['default']} falling through to the default), {totals['never_fired']} rule(s) "
+                 f"never firing, {totals['changed']} value(s) changed.")
+    return lines
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Evaluate a candidate normalization map against the distinct values of each field.")
+    parser.add_argument("candidate", help="The candidate map, or a config.json holding it.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--values", help="Field values file from 'normalize.py collect_values' (with or without --profile).")
+    source.add_argument("--records", help="Record file (e.g. standardized.ndjson) to sample values from instead.")
+    parser.add_argument("--sample", type=int, default=10000, help="Records sampled with --records.")
+    parser.add_argument("--deployed", default="pipeline-setup/config.json",
+                        help="The map in use, to diff against; 'none' to skip the diff.")
+    parser.add_argument("--field", action="append", help="Only evaluate this field (repeatable).")
+    parser.add_argument("--max-values", type=int, default=DEFAULT_SHOWN_VALUES,
+                        help="Values shown per field and category.")
+    parser.add_argument("--output", help="Also write the full report as JSON to this file.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Evaluate again whenever the candidate file changes.")
+    args = parser.parse_args()
+
+    if args.values:
+        field_values = load_field_values(args.values)
+    else:
+        field_values = sample_field_values(iter_records(args.records), args.sample)
+    deployed_map = None if args.deployed == "none" else load_map(args.deployed)
+
+    last_mtime = None
+    while True:
+        mtime = os.stat(args.candidate).st_mtime_ns
+        if mtime != last_mtime:
+            last_mtime = mtime
+            try:
+                candidate_map = load_map(args.candidate)
+            except ValueError as e:
+                print(f"Error reading {args.candidate}: {e}")
+            else:
+                start = time.perf_counter()
+                report = dry_run(candidate_map, field_values, deployed_map, args.field)
+                print("\n".join(format_report(report, args.max_values)))
+                print(f"Evaluated in {time.perf_counter() - start:.3f}s.")
+                if args.output:
+                    with open(args.output, 'w', encoding='utf-8') as f:
+                        json.dump(report, f, indent=2, ensure_ascii=False)
+                    print(f"Report written to {args.output}")
+        if not args.watch:
+            break
+        time.sleep(0.5)
@@ -0,0 +1,280 @@
+import bisect
+import datetime
+import json
+import os
+import sys
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataprocessing.functions import bin_labels
+from dataprocessing.grouping import grouping_ops
+
+DEFAULT_FEATURES_KEY = "derivedFeatures"
+DEFAULT_CHUNK_SIZE = 10_000
+# Operation name -> the settings naming its input fields, and whether they hold dates
+FEATURE_OPS: Dict[str, Tuple[Tuple[str, ...], bool]] = {
+    "days_between": (("start", "end"), True),
+    "year": (("field",), True),
+    "month": (("field",), True),
+    "weekday": (("field",), True),
+    "bucket": (("field",), False),
+    "ratio": (("numerator", "denominator"), False),
+    "difference": (("minuend", "subtrahend"), False),
+}
+# Day numbers of the date columns, with 0 for a missing or unparsable date
+_NO_DATE = 0
+
+
+def parse_date(value: Any) -> Optional[int]:
+    """
+    Returns the day number (`date.toordinal`) of an ISO date string, or of the date of
+    an ISO date-time string; None for anything else.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.date.fromisoformat(value[:10]).toordinal()
+    except ValueError:
+        return None
+
+
+def _number(value: Any) -> Optional[float]:
+    """Returns a value if it is a number, bools aside; None otherwise."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+class DerivedFeature:
+    """One derived feature: an operation over one or two fields of the grouped records."""
+
+    def __init__(self, name: str, settings: Dict[str, Any], paths: Dict[str, Tuple[str, ...]]):
+        op = settings.get("op")
+        if op not in FEATURE_OPS:
+            raise ValueError(f"Unknown operation '{op}' for derived feature '{name}', "
+                             f"expected one of {', '.join(FEATURE_OPS)}")
+        inputs, dates = FEATURE_OPS[op]
+        self.name = name
+        self.op = op
+        self.dates = dates
+        self.fields: List[str] = []
+        for setting in inputs:
+            field = settings.get(setting)
+            if field not in paths:
+                raise ValueError(f"Derived feature '{name}' needs '{setting}', a field of the "
+                                 f"grouping configuration, not {field!r}")
+            self.fields.append(field)
+        self.bins = self.labels = None
+        if op == "bucket":
+            self.bins = list(settings.get("bins") or [])
+            if not self.bins or self.bins != sorted(self.bins):
+                raise ValueError(f"Derived feature '{name}' needs ascending 'bins'")
+            self.labels = settings.get("labels") or bin_labels(self.bins)
+            if len(self.labels) != len(self.bins) + 1:
+                raise ValueError(f"Derived feature '{name}' needs one more label than bins")
+
+    def compute_row(self, values: List[Any]) -> Any:
+        """Returns the feature of one record from the values of its fields."""
+        if self.dates:
+            days = [parse_date(value) for value in values]
+            if None in days:
+                return None
+            if self.op == "days_between":
+                return days[1] - days[0]
+            date = datetime.date.fromordinal(days[0])
+            if self.op == "year":
+                return date.year
+            if self.op == "month":
+                return f"{date.year:04d}-{date.month:02d}"
+            return date.weekday()
+        numbers = [_number(value) for value in values]
+        if None in numbers:
+            return None
+        if self.op == "bucket":
+            return self.labels[bisect.bisect_right(self.bins, numbers[0])]
+        if self.op == "ratio":
+            return numbers[0] / numbers[1] if numbers[1] else None
+        return numbers[0] - numbers[1]
+
+    def compute_columns(self, columns: List[Any]) -> List[Any]:
+        """
+        Returns the feature of every record of a chunk from the columns of its fields:
+        day-number arrays for dates (see `FeatureSet.columns`), value lists otherwise.
+        """
+        if self.op == "days_between":
+            start, end = columns
+            return [e - s if s and e else None for s, e in zip(start, end)]
+        if self.dates:
+            # Calendar fields are computed once per distinct day
+            days = columns[0]
+            def convert(day):
+                if self.op == "weekday":
+                    return (day - 1) % 7  # Day 1, 0001-01-01, was a Monday
+                date = datetime.date.fromordinal(day)
+                return date.year if self.op == "year" else f"{date.year:04d}-{date.month:02d}"
+            results = {_NO_DATE: None}
+            for day in set(days) - results.keys():
+                results[day] = convert(day)
+            return list(map(results.__getitem__, days))
+        if self.op == "bucket":
+            bins, labels = self.bins, self.labels
+            return [None if value is None else labels[bisect.bisect_right(bins, value)]
+                    for value in columns[0]]
+        first, second = columns
+        if self.op == "ratio":
+            return [a / b if a is not None and b else None for a, b in zip(first, second)]
+        return [a - b if a is not None and b is not None else None for a, b in zip(first, second)]
+
+
+class FeatureSet:
+    """
+    The derived features of config.json, computed over chunks of grouped records.
+
+    Each input field is read once per chunk into a column. Date fields are parsed once
+    per distinct string into an array of day numbers, so that intervals are integer
+    subtractions over whole columns. Results go to `record[key][feature name]`.
+    """
+
+    def __init__(self, features: Dict[str, Dict[str, Any]], grouping_config: Dict[str, Any],
+                 key: str = DEFAULT_FEATURES_KEY):
+        paths = {source: path for path, source in grouping_ops(grouping_config) if source is not None}
+        if key in grouping_config:
+            raise ValueError(f"Derived features cannot be written to '{key}', "
+                             f"which the grouping configuration already produces")
+        self.features = [DerivedFeature(name, settings, paths) for name, settings in features.items()]
+        self.key = key
+        self.paths = paths
+        self.date_fields = sorted({field for feature in self.features if feature.dates for field in feature.fields})
+        self.number_fields = sorted({field for feature in self.features if not feature.dates for field in feature.fields})
+
+    def _value(self, record: Dict[str, Any], field: str) -> Any:
+        value = record
+        for key in self.paths[field]:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+
+    def columns(self, records: List[Dict[str, Any]]) -> Dict[Tuple[str, bool], Any]:
+        """Reads the input fields of a chunk into columns, keyed on (field, is a date)."""
+        columns = {}
+        for field in self.date_fields:
+            values = [self._value(record, field) for record in records]
+            if all(value is None or type(value) is str for value in values):
+                # Each distinct string is parsed once
+                days = {None: _NO_DATE}
+                for value in set(values):
+                    if value is not None:
+                        days[value] = parse_date(value) or _NO_DATE
+                column = array('l', map(days.__getitem__, values))
+            else:
+                column = array('l', (parse_date(value) or _NO_DATE for value in values))
+            columns[(field, True)] = column
+        for field in self.number_fields:
+            columns[(field, False)] = [_number(self._value(record, field)) for record in records]
+        return columns
+
+    def derive_chunk(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Computes the features of a chunk of grouped records, column by column, in place."""
+        columns = self.columns(records)
+        results = [feature.compute_columns([columns[(field, feature.dates)] for field in feature.fields])
+                   for feature in self.features]
+        names = [feature.name for feature in self.features]
+        key = self.key
+        for record, row in zip(records, zip(*results)):
+            record[key] = dict(zip(names, row))
+        return records
+
+    def derive_rowwise(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        The reference implementation: computes the features of one record on its own,
+        parsing its dates every time. `derive_chunk` must give the same results.
+        """
+        record[self.key] = {feature.name: feature.compute_row([self._value(record, field) for field in feature.fields])
+                            for feature in self.features}
+        return record
+
+
+def feature_stage(records: Iterable[Dict[str, Any]], features: FeatureSet,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Adds the derived features to each grouped record, a chunk at a time."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield from features.derive_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from features.derive_chunk(chunk)
+
+
+def make_feature_set(settings: Optional[Dict[str, Any]], grouping_config: Dict[str, Any]) -> Optional[FeatureSet]:
+    """
+    Builds a FeatureSet from the "derived_features" section of config.json, or returns
+    None if the section is missing or not enabled.
+    """
+    if not settings or not settings.get("enabled", False):
+        return None
+    return FeatureSet(settings.get("features", {}), grouping_config, settings.get("key", DEFAULT_FEATURES_KEY))
+
+
+def compare_with_reference(records: Iterable[Dict[str, Any]], features: FeatureSet,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[str]:
+    """
+    Computes the features of grouped records both column by column and row by row, and
+    returns a message per record whose results differ, in value or in type.
+    """
+    mismatches = []
+    chunk = []
+
+    def check(chunk):
+        expected = [features.derive_rowwise(dict(record))[features.key] for record in chunk]
+        for record, reference in zip(features.derive_chunk(chunk), expected):
+            got = record[features.key]
+            if json.dumps(got, sort_keys=True) != json.dumps(reference, sort_keys=True):
+                mismatches.append(f"{record.get('id')}: {got} != {reference}")
+
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            check(chunk)
+            chunk = []
+    if chunk:
+        check(chunk)
+    return mismatches
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from dataprocessing.recordio import iter_records, open_record_writer
+
+    parser = argparse.ArgumentParser(description="Compute the derived features of grouped records.")
+    parser.add_argument("input_file", help="Grouped records.")
+    parser.add_argument("--config", default="pipeline-setup/config.json", help="Path to config.json.")
+    parser.add_argument("--output", help="Write the records with their derived features here.")
+    parser.add_argument("--check", action="store_true",
+                        help="Check the column-wise results against the row-wise reference.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Records per chunk.")
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    with open(config["dataPaths"]["groupingConfigPath"], 'r', encoding='utf-8') as f:
+        grouping_config = json.load(f)
+    feature_set = make_feature_set(dict(config.get("derived_features") or {}, enabled=True), grouping_config)
+    if args.check:
+        mismatches = compare_with_reference(iter_records(args.input_file), feature_set, args.chunk_size)
+        for mismatch in mismatches[:20]:
+            print(mismatch)
+        print(f"{len(mismatches)} records differ from the row-wise reference.")
+        sys.exit(1 if mismatches else 0)
+    if args.output:
+        with open_record_writer(args.output) as writer:
+            for record in feature_stage(iter_records(args.input_file), feature_set, args.chunk_size):
+                writer.write(record)
+        print(f"Wrote {writer.count} records to {args.output}")
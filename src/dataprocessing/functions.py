@@ -0,0 +1,458 @@
+import bisect
+import datetime
+import functools
+import hashlib
+import os
+import re
+import sys
+import types
+import unicodedata
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Entry point group scanned for user plugins, e.g. in a plugin's pyproject.toml:
+#   [project.entry-points."dataprocessing.functions"]
+#   my_functions = "my_package.functions:register"
+PLUGIN_GROUP = "dataprocessing.functions"
+# Input types of the built-in string functions
+STRING = (str,)
+NUMBER = (int, float)
+
+
+class TransformFunction:
+    """
+    A function of the registry, for the 'apply_function' operator of dynamic rules.
+
+    `func` takes one value and returns its new value, or None to let the next rule or
+    the default decide. Values whose exact type is not in `input_types` (None: any
+    type) are returned unchanged without calling it. A pure function only depends on
+    its value, so its results may be memoized and computed once per distinct value; an
+    impure one is called for every record. `batch`, if given, takes a list of values of
+    the input types and returns the list of their results, as `func` would one by one.
+
+    Functions that take settings declare their names in `params`; a rule then gives
+    them with the function name, e.g. {"apply_function": {"name": "bucket", "bins": [400]}}.
+    `prepare`, if given, checks the settings and returns the keyword arguments passed to
+    `func` and `batch`.
+    """
+
+    __slots__ = ('name', 'func', 'pure', 'input_types', 'batch', 'params', 'prepare', 'description')
+
+    def __init__(self, name: str, func: Callable[..., Any], pure: bool = True,
+                 input_types: Optional[Sequence[type]] = STRING,
+                 batch: Optional[Callable[..., List[Any]]] = None,
+                 params: Sequence[str] = (), prepare: Optional[Callable[..., Dict[str, Any]]] = None,
+                 description: Optional[str] = None):
+        self.name = name
+        self.func = func
+        self.pure = pure
+        self.input_types = frozenset(input_types) if input_types is not None else None
+        self.batch = batch
+        self.params = tuple(params)
+        self.prepare = prepare
+        self.description = description or " ".join((func.__doc__ or "").split())
+
+    def __call__(self, value: Any, item: Optional[Dict[str, Any]] = None) -> Any:
+        if self.input_types is not None and type(value) not in self.input_types:
+            return value
+        return self.func(value)
+
+    def apply_many(self, values: List[Any]) -> List[Any]:
+        """Returns the result of each value, calling `batch` once on those of the input types."""
+        if self.batch is None:
+            return [self(value) for value in values]
+        input_types = self.input_types
+        if input_types is None:
+            return self.batch(values)
+        positions = [i for i, value in enumerate(values) if type(value) in input_types]
+        if len(positions) == len(values):
+            return self.batch(values)
+        results = list(values)
+        for i, result in zip(positions, self.batch([values[i] for i in positions])):
+            results[i] = result
+        return results
+
+    def bind(self, settings: Dict[str, Any]) -> 'TransformFunction':
+        """Returns this function with the settings of a rule applied."""
+        unknown = set(settings) - set(self.params)
+        if unknown:
+            raise ValueError(f"Function '{self.name}' does not take {', '.join(sorted(unknown))}")
+        kwargs = self.prepare(**settings) if self.prepare else settings
+        return TransformFunction(
+            self.name, functools.partial(self.func, **kwargs), self.pure,
+            self.input_types, functools.partial(self.batch, **kwargs) if self.batch else None,
+            description=self.description)
+
+
+class FunctionRegistry(dict):
+    """
+    Maps function names to TransformFunctions. Plain callables taking (value, item=None)
+    may still be stored directly; they are treated as impure, without a batch variant.
+    The plugins of the PLUGIN_GROUP entry point group are loaded on first resolve.
+
+    `distributions` maps the names registered by a plugin to the function it registered
+    and the name and version of the plugin's distribution, for `fingerprint`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.plugins_loaded = False
+        self.distributions: Dict[str, Tuple[Any, str]] = {}
+
+    def register(self, name: Optional[str] = None, **options: Any) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """
+        Decorator registering a one-value function under `name` (by default its own
+        name), with the options of TransformFunction. The function is returned as is.
+        """
+        def decorator(func):
+            self.add(TransformFunction(name or func.__name__, func, **options))
+            return func
+        return decorator
+
+    def add(self, function: TransformFunction) -> TransformFunction:
+        """Registers a TransformFunction, replacing any function of the same name."""
+        self[function.name] = function
+        return function
+
+    def load_plugins(self, group: str = PLUGIN_GROUP) -> List[str]:
+        """
+        Loads the functions of installed plugins. Each entry point of `group` names
+        either a TransformFunction, registered under the entry point's name, or a
+        callable that is called with this registry to register its own functions. A
+        plugin that fails to load is reported and skipped.
+
+        Returns:
+            List[str]: The names of the entry points loaded.
+        """
+        from importlib.metadata import entry_points
+
+        self.plugins_loaded = True
+        loaded = []
+        for entry_point in entry_points(group=group):
+            before = dict(self)
+            try:
+                plugin = entry_point.load()
+                if isinstance(plugin, TransformFunction):
+                    self[entry_point.name] = plugin
+                else:
+                    plugin(self)
+            except Exception as e:
+                print(f"Warning: could not load function plugin '{entry_point.name}': {e}")
+                continue
+            dist = getattr(entry_point, 'dist', None)
+            if dist is not None:
+                version = f"{dist.metadata['Name']}=={dist.version}"
+                for name, func in self.items():
+                    if before.get(name) is not func:
+                        self.distributions[name] = (func, version)
+            loaded.append(entry_point.name)
+        return loaded
+
+    def resolve(self, spec: Any) -> Optional[Callable[..., Any]]:
+        """
+        Returns the function named by the operand of an 'apply_function' operator: a
+        name, or a dict of the name and the function's settings. None if the function
+        is not registered.
+        """
+        if not self.plugins_loaded:
+            self.load_plugins()
+        if isinstance(spec, dict):
+            settings = dict(spec)
+            func = self.get(settings.pop('name', None))
+            if func is None:
+                return None
+            if not isinstance(func, TransformFunction):
+                if settings:
+                    raise ValueError(f"Function '{spec.get('name')}' does not take settings")
+                return func
+            return func.bind(settings) if settings or func.prepare else func
+        try:
+            func = self.get(spec)
+        except TypeError:
+            return None
+        if isinstance(func, TransformFunction) and func.prepare:
+            return func.bind({})
+        return func
+
+
+    def fingerprint(self, spec: Any) -> Optional[Dict[str, Any]]:
+        """
+        Identifies the function an 'apply_function' operand resolves to, so that caches
+        of its results can tell when it changed: its module and qualname, a digest of
+        its code (and of its batch variant and settings check), and the distribution of
+        the plugin that registered it. None if the function is not registered.
+        """
+        if self.resolve(spec) is None:
+            return None
+        name = spec.get('name') if isinstance(spec, dict) else spec
+        registered = self[name]
+        origin = self.distributions.get(name)
+        if isinstance(registered, TransformFunction):
+            target = registered.func
+            parts = [registered.func, registered.batch, registered.prepare]
+        else:
+            target = registered
+            parts = [registered]
+        digest = hashlib.sha256()
+        for part in parts:
+            _digest_code(digest, getattr(part, '__code__', None))
+        return {
+            'module': getattr(target, '__module__', None)
+            or getattr(getattr(target, '__objclass__', None), '__module__', None),
+            'qualname': getattr(target, '__qualname__', None),
+            'code': digest.hexdigest(),
+            'distribution': origin[1] if origin is not None and origin[0] is registered else None,
+        }
+
+
+def _digest_code(digest: Any, code: Optional[types.CodeType]) -> None:
+    """Feeds the bytecode, constants and global names of a code object to a digest."""
+    if code is None:
+        digest.update(b'-')
+        return
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _digest_code(digest, const)
+        else:
+            digest.update(repr(const).encode('utf-8'))
+
+
+def is_pure(func: Any) -> bool:
+    """Whether a registered function may be memoized: plain callables are assumed not to be."""
+    return isinstance(func, TransformFunction) and func.pure
+
+
+def has_batch(func: Any) -> bool:
+    """Whether a registered function has a batch variant."""
+    return isinstance(func, TransformFunction) and func.batch is not None
+
+
+FUNCTION_REGISTRY = FunctionRegistry()
+register = FUNCTION_REGISTRY.register
+
+
+# =============================================================================
+#  --- Built-in Functions ---
+# =============================================================================
+
+
+def _map_method(method):
+    """The batch variant of a function applying one str method."""
+    def batch(values):
+        return list(map(method, values))
+    return batch
+
+
+FUNCTION_REGISTRY.add(TransformFunction(
+    'to_uppercase', str.upper, batch=_map_method(str.upper), description="Converts a string value to uppercase."))
+FUNCTION_REGISTRY.add(TransformFunction(
+    'to_lowercase', str.lower, batch=_map_method(str.lower), description="Converts a string value to lowercase."))
+FUNCTION_REGISTRY.add(TransformFunction(
+    'casefold', str.casefold, batch=_map_method(str.casefold),
+    description="Case-folds a string value, for caseless comparisons."))
+FUNCTION_REGISTRY.add(TransformFunction(
+    'trim', str.strip, batch=_map_method(str.strip), description="Strips the leading and trailing whitespace of a string."))
+
+
+@register(batch=lambda values: [' '.join(value.split()) for value in values])
+def collapse_whitespace(value):
+    """Strips a string and replaces each run of whitespace inside it with one space."""
+    return ' '.join(value.split())
+
+
+@register()
+def split_comma(value):
+    """Splits a string on commas into a list of strings."""
+    return value.split(',')
+
+
+class _AccentTable(dict):
+    """A str.translate table decomposing each non-ASCII character once, on first use."""
+
+    def __missing__(self, code):
+        stripped = ''.join(c for c in unicodedata.normalize('NFKD', chr(code)) if not unicodedata.combining(c))
+        self[code] = stripped
+        return stripped
+
+
+_ACCENTS = _AccentTable()
+
+
+@register(batch=lambda values: [value if value.isascii() else value.translate(_ACCENTS) for value in values])
+def strip_accents(value):
+    """Removes the accents of a string: "Réunion" becomes "Reunion"."""
+    return value if value.isascii() else value.translate(_ACCENTS)
+
+
+_NUMBER = re.compile(r'[+-]?(\d+)?(\.\d+)?')
+# The integer part of a number with thousands separators, for each separator
+_GROUPED = {sep: re.compile(r'[+-]?\d{1,3}(?:' + re.escape(sep) + r'\d{3})+') for sep in ',.'}
+# Spaces, including the non-breaking ones of French formatting, and unit symbols
+_NUMBER_NOISE = str.maketrans('', '', ' \u00a0\u202f\'€$£%')
+
+
+def _number_settings(decimal=None):
+    if decimal not in (None, '.', ','):
+        raise ValueError("Function 'parse_number' takes a 'decimal' of '.' or ','")
+    return {'decimal': decimal}
+
+
+def _decimal_separator(text):
+    """
+    Guesses the decimal separator of a number: the last of two different separators, or
+    the other one when a separator repeats. A single separator followed by exactly three
+    digits may group thousands ("1,234") or not ("1.234"), so it gives None.
+    """
+    commas, dots = text.count(','), text.count('.')
+    if commas and dots:
+        return ',' if text.rfind(',') > text.rfind('.') else '.'
+    if commas > 1:
+        return '.'
+    if dots > 1:
+        return ','
+    if commas or dots:
+        separator = ',' if commas else '.'
+        if len(text) - text.index(separator) - 1 == 3:
+            return None
+        return separator
+    return '.'
+
+
+@register(params=('decimal',), prepare=_number_settings)
+def parse_number(value, decimal=None):
+    """
+    Parses a number written as a string, e.g. "1 234,50 €" or "1,234.50": an int if it
+    has no decimals, else a float. None if the string is not a number. `decimal` ('.'
+    or ',') is the decimal separator, and the other one groups thousands. Without it,
+    the separator is guessed, and a string such as "1,234" or "1.234", which reads
+    either way, gives None.
+    """
+    text = value.translate(_NUMBER_NOISE)
+    if decimal is None:
+        decimal = _decimal_separator(text)
+        if decimal is None:
+            return None
+    thousands = ',' if decimal == '.' else '.'
+    whole, point, fraction = text.partition(decimal)
+    if thousands in fraction or (thousands in whole and not _GROUPED[thousands].fullmatch(whole)):
+        return None
+    text = whole.replace(thousands, '') + ('.' + fraction if point else '')
+    if not text or text in '+-.' or not _NUMBER.fullmatch(text):
+        return None
+    return float(text) if '.' in text else int(text)
+
+
+_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%Y/%m/%d', '%d/%m/%y')
+
+
+@register()
+def parse_date(value):
+    """
+    Parses a date written as "YYYY-MM-DD", "DD/MM/YYYY", "DD-MM-YYYY", "DD.MM.YYYY",
+    "YYYY/MM/DD" or "DD/MM/YY" into an ISO "YYYY-MM-DD" string. A date-time keeps its
+    date. None if the string is not a date.
+    """
+    text = value.strip()
+    if 'T' in text:
+        text = text.split('T', 1)[0]
+    elif ' ' in text:
+        text = text.split(' ', 1)[0]
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def bin_labels(bins: Sequence[float]) -> List[str]:
+    """Labels of the ranges cut by ascending bin edges: "<a", "a-b", ..., "z+"."""
+    def edge(value):
+        return str(int(value)) if float(value).is_integer() else str(value)
+    labels = [f"<{edge(bins[0])}"]
+    labels.extend(f"{edge(low)}-{edge(high)}" for low, high in zip(bins, bins[1:]))
+    labels.append(f"{edge(bins[-1])}+")
+    return labels
+
+
+def _bucket_settings(bins=None, labels=None):
+    bins = list(bins or [])
+    if not bins or bins != sorted(bins):
+        raise ValueError("Function 'bucket' needs ascending 'bins'")
+    labels = labels or bin_labels(bins)
+    if len(labels) != len(bins) + 1:
+        raise ValueError("Function 'bucket' needs one more label than bins")
+    return {'bins': bins, 'labels': labels}
+
+
+def bucket(value, bins, labels):
+    """Replaces a number with the label of its range among ascending bin edges."""
+    return labels[bisect.bisect_right(bins, value)]
+
+
+def _bucket_batch(values, bins, labels):
+    return [labels[bisect.bisect_right(bins, value)] for value in values]
+
+
+FUNCTION_REGISTRY.add(TransformFunction(
+    'bucket', bucket, input_types=NUMBER, batch=_bucket_batch,
+    params=('bins', 'labels'), prepare=_bucket_settings))
+
+
+def describe_functions(registry: FunctionRegistry = FUNCTION_REGISTRY) -> List[Tuple[str, str]]:
+    """Returns a (name, description) pair per registered function, plugins included."""
+    if not registry.plugins_loaded:
+        registry.load_plugins()
+    rows = []
+    for name, func in sorted(registry.items()):
+        if isinstance(func, TransformFunction):
+            types = ', '.join(sorted(t.__name__ for t in func.input_types)) if func.input_types else 'any'
+            flags = [types, 'pure' if func.pure else 'impure']
+            if func.batch:
+                flags.append('batch')
+            if func.params:
+                flags.append('settings: ' + ', '.join(func.params))
+            rows.append((name, f"{func.description} [{'; '.join(flags)}]"))
+        else:
+            rows.append((name, "(plain callable) [any; impure]"))
+    return rows
+
+
+def apply_function(name: Any, values: Iterable[Any]) -> List[Any]:
+    """Applies a registered function, given as in a rule, to values."""
+    func = FUNCTION_REGISTRY.resolve(name)
+    if func is None:
+        raise ValueError(f"Function {name!r} is not registered")
+    if isinstance(func, TransformFunction):
+        return func.apply_many(list(values))
+    return [func(value) for value in values]
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="List the registered transformation functions, or try one.")
+    parser.add_argument("function", nargs="?",
+                        help="A function name, or a JSON object of the name and its settings.")
+    parser.add_argument("values", nargs="*", help="Values to apply the function to (JSON, else strings).")
+    args = parser.parse_args()
+
+    if not args.function:
+        for name, description in describe_functions():
+            print(f"{name}: {description}")
+        sys.exit(0)
+
+    def parse(text):
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
+
+    for value, result in zip(map(parse, args.values), apply_function(parse(args.function), map(parse, args.values))):
+        print(f"{json.dumps(value, ensure_ascii=False)} -> {json.dumps(result, ensure_ascii=False)}")
@@ -1,6 +1,13 @@
 import json
 import os
-from typing import Any, Dict, List
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataprocessing.recordio import iter_records, open_record_writer
 
 def group_fields(normalized_data: List[Dict[str, Any]], grouping_config: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
@@ -13,11 +20,8 @@ def group_fields(normalized_data: List[Dict[str, Any]], grouping_config: Dict[st
     Returns:
         List[Dict[str, Any]]: The list of data records with fields grouped.
     """
-    grouped_data = []
-    for record in normalized_data:
-        grouped_record = _process_grouping_level(record, grouping_config)
-        grouped_data.append(grouped_record)
-    return grouped_data
+    project = compile_grouping(grouping_config)
+    return [project(record) for record in normalized_data]
 
 def _process_grouping_level(record: Dict[str, Any], config: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -45,10 +49,187 @@ def _process_grouping_level(record: Dict[str, Any], config: Dict[str, Any]) -> D
             grouped_part[key] = _process_grouping_level(record, value)
     return grouped_part
 
+def grouping_ops(grouping_config: Dict[str, Any], prefix: Tuple[str, ...] = ()) -> List[Tuple[Tuple[str, ...], Optional[str]]]:
+    """
+    Flattens the grouping configuration into projection ops, in output order.
+
+    Args:
+        grouping_config (Dict[str, Any]): The grouping configuration, or one level of it.
+        prefix (Tuple[str, ...]): The output path of that level.
+
+    Returns:
+        List[Tuple[Tuple[str, ...], Optional[str]]]: One (output path, source field) op
+        per copied field, and one (output path, None) op per nested object, placed
+        before the ops of its fields. As in `_process_grouping_level`, a level copies
+        the record's `id` first when its config maps 'id' to 'id'.
+    """
+    ops = []
+    if grouping_config.get('id') == 'id':
+        ops.append((prefix + ('id',), 'id'))
+    for key, value in grouping_config.items():
+        if key == 'id':
+            continue
+        if isinstance(value, str):
+            ops.append((prefix + (key,), value))
+        elif isinstance(value, dict):
+            ops.append((prefix + (key,), None))
+            ops.extend(grouping_ops(value, prefix + (key,)))
+    return ops
+
+def _literal_source(grouping_config: Dict[str, Any]) -> str:
+    """Python source of one dict display building a level, assuming every field exists."""
+    items = []
+    if grouping_config.get('id') == 'id':
+        items.append("'id': record['id']")
+    for key, value in grouping_config.items():
+        if key == 'id':
+            continue
+        if isinstance(value, str):
+            items.append(f"{key!r}: record[{value!r}]")
+        elif isinstance(value, dict):
+            items.append(f"{key!r}: {_literal_source(value)}")
+    return "{" + ", ".join(items) + "}"
+
+def _guarded_source(grouping_config: Dict[str, Any], lines: List[str], counter: List[int]) -> str:
+    """Appends the statements building a level, skipping missing fields, and returns its variable."""
+    name = f"level{counter[0]}"
+    counter[0] += 1
+    lines.append(f"    {name} = {{}}")
+    if grouping_config.get('id') == 'id':
+        lines.append(f"    if 'id' in record: {name}['id'] = record['id']")
+    for key, value in grouping_config.items():
+        if key == 'id':
+            continue
+        if isinstance(value, str):
+            lines.append(f"    if {value!r} in record: {name}[{key!r}] = record[{value!r}]")
+        elif isinstance(value, dict):
+            nested = _guarded_source(value, lines, counter)
+            lines.append(f"    {name}[{key!r}] = {nested}")
+    return name
+
+def compile_grouping(grouping_config: Dict[str, Any]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Compiles the grouping configuration into a function that groups one record.
+
+    The nested configuration is walked once, here, to generate the source of two
+    specialized functions. The first builds the whole grouped record as a single dict
+    display, which is all a standardized record needs. The second copies each field only
+    if the record has it, and takes over for the records that lack a field. The grouped
+    records are identical to those of `_process_grouping_level`.
+
+    Args:
+        grouping_config (Dict[str, Any]): The configuration for grouping fields.
+
+    Returns:
+        Callable[[Dict[str, Any]], Dict[str, Any]]: A function from a record to its
+        grouped record.
+    """
+    lines = ["def guarded(record):"]
+    result = _guarded_source(grouping_config, lines, [0])
+    lines.append(f"    return {result}")
+    source = "\n".join(lines + [
+        "",
+        "def project(record):",
+        "    try:",
+        f"        return {_literal_source(grouping_config)}",
+        "    except KeyError:",
+        "        return guarded(record)",
+    ])
+    namespace: Dict[str, Any] = {}
+    exec(compile(source, "<grouping.json>", "exec"), namespace)
+    return namespace["project"]
+
+def _schema_level(schema: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Returns the properties of an object schema, or None if it is not an object."""
+    schema_type = schema.get('type')
+    types = schema_type if isinstance(schema_type, list) else [schema_type]
+    if 'object' in types or 'properties' in schema:
+        return schema.get('properties', {})
+    return None
+
+def _check_schema(grouping_config: Dict[str, Any], schema: Dict[str, Any], prefix: str,
+                  undescribed: List[str], mismatched: List[str], missing_required: List[str]):
+    properties = _schema_level(schema) or {}
+    produced = set()
+    for path, source in grouping_ops(grouping_config):
+        if len(path) != 1:
+            continue
+        key = path[0]
+        produced.add(key)
+        full_path = prefix + key
+        if key not in properties:
+            undescribed.append(full_path)
+            continue
+        nested_properties = _schema_level(properties[key])
+        if source is None and nested_properties is None:
+            mismatched.append(f"{full_path} (grouped as an object)")
+        elif source is not None and nested_properties is not None:
+            mismatched.append(f"{full_path} (copied from '{source}' but an object in the schema)")
+        elif source is None:
+            _check_schema(grouping_config[key], properties[key], full_path + ".",
+                          undescribed, mismatched, missing_required)
+    missing_required.extend(prefix + key for key in schema.get('required', [])
+                            if key not in produced)
+
+def validate_grouping(
+    grouping_config: Dict[str, Any],
+    fields_to_keep: Optional[List[str]] = None,
+    schema: Optional[Dict[str, Any]] = None,
+) -> List[str]:
+    """
+    Checks the grouping configuration against the standardized fields and the output schema.
+
+    Missing fields are skipped record by record when grouping, so this is the one place
+    where they are reported.
+
+    Args:
+        grouping_config (Dict[str, Any]): The configuration for grouping fields.
+        fields_to_keep (Optional[List[str]]): The fields of the standardized records. The
+            'id' field, added after standardization, is always available.
+        schema (Optional[Dict[str, Any]]): The JSON schema of the grouped records
+            (schema.json).
+
+    Returns:
+        List[str]: One message per kind of problem found, empty if none.
+    """
+    messages = []
+    ops = grouping_ops(grouping_config)
+    if fields_to_keep is not None:
+        available = set(fields_to_keep) | {'id'}
+        sources = [source for _, source in ops if source is not None]
+        missing = sorted({source for source in sources if source not in available})
+        if missing:
+            messages.append(
+                f"grouping.json reads {len(missing)} field(s) that are not in fields_to_keep, "
+                f"so they are never in the grouped output: {', '.join(missing)}")
+        unused = [field for field in fields_to_keep if field not in set(sources)]
+        if unused:
+            messages.append(
+                f"{len(unused)} field(s) of fields_to_keep are not in grouping.json and are "
+                f"left out of the grouped output: {', '.join(unused)}")
+    if schema is not None:
+        undescribed, mismatched, missing_required = [], [], []
+        _check_schema(grouping_config, schema, "", undescribed, mismatched, missing_required)
+        if undescribed:
+            messages.append(
+                f"grouping.json produces {len(undescribed)} path(s) that schema.json does not "
+                f"describe: {', '.join(undescribed)}")
+        if mismatched:
+            messages.append(
+                f"grouping.json and schema.json disagree on the type of: {', '.join(mismatched)}")
+        if missing_required:
+            messages.append(
+                f"schema.json requires {len(missing_required)} path(s) that grouping.json "
+                f"does not produce: {', '.join(missing_required)}")
+    return messages
+
 def run_grouping(config: Dict[str, Any]):
     """
     Runs the data grouping process.
 
+    Records are streamed from the normalized data file in any supported format, and the
+    grouped data is written in the format given by its extension.
+
     Args:
         config (Dict[str, Any]): The pipeline configuration.
     """
@@ -66,20 +247,17 @@ def run_grouping(config: Dict[str, Any]):
         print(f"Error: Grouping config file not found at {grouping_config_path}")
         return
 
-    with open(normalized_data_path, 'r', encoding='utf-8') as f:
-        normalized_data = json.load(f)
-
     with open(grouping_config_path, 'r', encoding='utf-8') as f:
         grouping_config = json.load(f)
 
-    grouped_data = group_fields(normalized_data, grouping_config)
-
     output_dir = os.path.dirname(grouped_data_path)
-    if not os.path.exists(output_dir):
+    if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    with open(grouped_data_path, 'w', encoding='utf-8') as f:
-        json.dump(grouped_data, f, indent=2, ensure_ascii=False)
+    project = compile_grouping(grouping_config)
+    with open_record_writer(grouped_data_path) as writer:
+        for record in iter_records(normalized_data_path):
+            writer.write(project(record))
 
     print(f"Data grouping complete. Grouped data saved to {grouped_data_path}")
 
@@ -0,0 +1,179 @@
+import base64
+import hashlib
+import json
+import uuid
+from json.encoder import c_make_encoder, encode_basestring_ascii
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import xxhash
+except ImportError:  # xxhash is only needed for the xxhash128 hash
+    xxhash = None
+
+ID_FORMATS = ("legacy", "uuid5", "compact")
+HASH_NAMES = ("sha256", "blake2b", "xxhash128")
+DEFAULT_ID_FORMAT = "legacy"
+DEFAULT_HASHES = {"legacy": "sha256", "uuid5": "sha1", "compact": "blake2b"}
+# Namespace of the UUIDv5 ids, fixed so that the same record always gets the same id
+ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "eduvisa-insight-cleaned-data/records")
+
+
+def _unserializable(value: Any):
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if c_make_encoder is not None:
+    # json.dumps builds a new encoder on every call: build the C encoder once instead
+    _encode_sorted = c_make_encoder(None, _unserializable, encode_basestring_ascii, None,
+                                    ":", ",", True, False, True)
+
+    def canonical_json(value: Any) -> str:
+        """Returns the same text as json.dumps(value, sort_keys=True, separators=(",", ":"))."""
+        return "".join(_encode_sorted(value, 0))
+else:
+    def canonical_json(value: Any) -> str:
+        """Returns the same text as json.dumps(value, sort_keys=True, separators=(",", ":"))."""
+        return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+# Encoded values kept per field; the fields of standardized records are mostly categorical
+MAX_CACHED_VALUES = 4096
+# Types whose equal values always encode the same way once keyed on their type
+_CACHED_TYPES = (str, int, bool, type(None))
+
+
+class CanonicalEncoder:
+    """
+    Serializes records without their `id` into the text of
+    json.dumps(record, sort_keys=True, separators=(",", ":")), faster.
+
+    Records that share a set of fields, as standardized records do, share one plan: the
+    fields sorted once, each with its encoded '"name":' prefix. The encoded fragment of
+    each string, int, bool and null value is cached per field, up to MAX_CACHED_VALUES
+    values, so a repeated value costs one dictionary lookup instead of being encoded
+    again. Other values are encoded every time.
+    """
+
+    def __init__(self):
+        self._plans: Dict[Tuple[Any, ...], Optional[List[Tuple[str, str, Dict[Any, str]]]]] = {}
+
+    def _plan(self, keys: Tuple[str, ...]) -> Optional[List[Tuple[str, str, Dict[Any, str]]]]:
+        if not all(type(key) is str for key in keys):
+            # json.dumps turns other keys into strings first: leave those records to it
+            plan = None
+        else:
+            plan = [(field, canonical_json(field) + ":", {})
+                    for field in sorted(key for key in keys if key != 'id')]
+        self._plans[keys] = plan
+        return plan
+
+    def encode(self, record: Dict[str, Any]) -> str:
+        """Returns the canonical JSON text of a record, leaving out its `id`."""
+        keys = tuple(record)
+        plan = self._plans[keys] if keys in self._plans else self._plan(keys)
+        if plan is None:
+            record = {key: value for key, value in record.items() if key != 'id'}
+            return json.dumps(record, sort_keys=True, separators=(",", ":"))
+        parts = []
+        append = parts.append
+        for field, prefix, cache in plan:
+            value = record[field]
+            value_type = type(value)
+            if value_type in _CACHED_TYPES:
+                # Keyed on the type too, so that 1 and True stay apart
+                key = value if value_type is str else (value_type, value)
+                fragment = cache.get(key)
+                if fragment is None:
+                    fragment = prefix + canonical_json(value)
+                    if len(cache) < MAX_CACHED_VALUES:
+                        cache[key] = fragment
+            else:
+                fragment = prefix + canonical_json(value)
+            append(fragment)
+        return "{" + ",".join(parts) + "}"
+
+
+_legacy_encoder = CanonicalEncoder()
+
+
+def legacy_id(record: Dict[str, Any]) -> str:
+    """
+    Returns the content-based id that records have always had.
+
+    The record without its `id` is serialized as compact JSON with sorted keys and hashed
+    with SHA-256, and the 64 hex digits are split into a 6-segment, uuid-like string.
+
+    Args:
+        record (Dict[str, Any]): The record; its `id` field, if any, is ignored.
+
+    Returns:
+        str: The 68-character id.
+    """
+    h = hashlib.sha256(_legacy_encoder.encode(record).encode("utf-8")).hexdigest()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}-{h[32:64]}"
+
+
+def _new_hasher(hash_name: str) -> Any:
+    if hash_name == "sha256":
+        return hashlib.sha256()
+    if hash_name == "sha1":
+        return hashlib.sha1()
+    if hash_name == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    if xxhash is None:
+        raise ValueError("The xxhash128 hash requires the xxhash package: pip install xxhash")
+    return xxhash.xxh3_128()
+
+
+class IdGenerator:
+    """
+    Computes content-based record ids in one of ID_FORMATS:
+
+    - "legacy": the 6-segment SHA-256 ids of `legacy_id`, for compatibility with the
+      documents already loaded.
+    - "uuid5": RFC 4122 version 5 UUIDs of the canonical JSON in ID_NAMESPACE, hashed
+      with SHA-1 as the RFC requires: uuid.uuid5(ID_NAMESPACE, canonical_json(record)).
+    - "compact": 128 bits of a `hash_name` hash of the canonical JSON, in URL-safe
+      base64: 22 characters that decode to the 16 bytes of a binary id.
+
+    Every format hashes the same canonical JSON as legacy ids, built by a
+    CanonicalEncoder.
+    """
+
+    def __init__(self, id_format: str = DEFAULT_ID_FORMAT, hash_name: Optional[str] = None,
+                 namespace: uuid.UUID = ID_NAMESPACE):
+        if id_format not in ID_FORMATS:
+            raise ValueError(f"Unknown id format '{id_format}', expected one of {', '.join(ID_FORMATS)}")
+        default_hash = DEFAULT_HASHES[id_format]
+        hash_name = hash_name or default_hash
+        if id_format != "compact" and hash_name != default_hash:
+            raise ValueError(f"The {id_format} id format always hashes with {default_hash}")
+        if id_format == "compact" and hash_name not in HASH_NAMES:
+            raise ValueError(f"Unknown hash '{hash_name}', expected one of {', '.join(HASH_NAMES)}")
+        self._hasher = _new_hasher(hash_name)  # Fails now, not on the first record, without xxhash
+        self.id_format = id_format
+        self.hash_name = hash_name
+        self.namespace = namespace
+        if id_format == "uuid5":
+            self._hasher.update(namespace.bytes)
+        self._encoder = _legacy_encoder if id_format == "legacy" else CanonicalEncoder()
+
+    def __call__(self, record: Dict[str, Any]) -> str:
+        """Returns the id of a record; its `id` field, if any, is ignored."""
+        if self.id_format == "legacy":
+            return legacy_id(record)
+        hasher = self._hasher.copy()
+        hasher.update(self._encoder.encode(record).encode("utf-8"))
+        digest = hasher.digest()
+        if self.id_format == "uuid5":
+            return str(uuid.UUID(bytes=digest[:16], version=5))
+        return base64.urlsafe_b64encode(digest[:16]).rstrip(b"=").decode("ascii")
+
+
+def make_id_generator(settings: Optional[Dict[str, Any]] = None) -> IdGenerator:
+    """
+    Builds an IdGenerator from the "ids" section of config.json, such as
+    {"format": "compact", "hash": "xxhash128"}. Without settings, ids are legacy ids.
+    """
+    settings = settings or {}
+    return IdGenerator(settings.get("format", DEFAULT_ID_FORMAT), settings.get("hash"))
@@ -0,0 +1,359 @@
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from dataprocessing.cube import OlapCube, cube_stage
+from dataprocessing.dedup import Deduplicator, dedup_stage
+from dataprocessing.features import FeatureSet, feature_stage
+from dataprocessing.functions import FUNCTION_REGISTRY
+from dataprocessing.grouping import compile_grouping, validate_grouping
+from dataprocessing.ids import IdGenerator, make_id_generator
+from dataprocessing.normalize import (
+    DEFAULT_CACHE_SIZE,
+    CompiledField,
+    NormalizationCache,
+    compile_normalization_map,
+    normalize_record,
+    standardize_record,
+)
+from dataprocessing.pipeline import tap_stage
+from dataprocessing.recordio import NdjsonWriter, iter_json_array, iter_ndjson, open_record_writer
+from dataprocessing.tags import TagCodec, tag_encoding_stage
+from dataprocessing.validation import RecordValidator, validation_stage
+
+MANIFEST_FILE = "manifest.json"
+
+
+def hash_file(path: str, block_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 hex digest of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_config(value: Any) -> str:
+    """Returns the SHA-256 hex digest of a JSON-serializable config value, order included."""
+    text = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def normalization_hash(field_config: Any) -> str:
+    """
+    Returns the hash of a field's normalization config. For a field whose rules call
+    'apply_function', it also covers the functions they resolve to (see
+    `FunctionRegistry.fingerprint`), so that registering, upgrading or fixing one
+    re-normalizes the field.
+    """
+    functions = []
+    if isinstance(field_config, dict):
+        for rule in field_config.get('dynamic_rules') or []:
+            condition = rule.get('if') if isinstance(rule, dict) else None
+            if isinstance(condition, dict) and 'apply_function' in condition:
+                functions.append(FUNCTION_REGISTRY.fingerprint(condition['apply_function']))
+    if not functions:
+        return hash_config(field_config)
+    return hash_config({"config": field_config, "functions": functions})
+
+
+def load_manifest(cache_dir: str) -> Dict[str, Any]:
+    """Loads the manifest of a cache directory, or an empty one if there is none."""
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(cache_dir: str, manifest: Dict[str, Any]) -> None:
+    with open(os.path.join(cache_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+
+def _cache_path(cache_dir: str, file_hash: str, stage: str) -> str:
+    return os.path.join(cache_dir, f"{file_hash}.{stage}.ndjson")
+
+
+def _invalidate(cache_dir: str, manifest: Dict[str, Any], file_hash: str) -> None:
+    """Forgets a file's cache entry before its caches are modified, so that an
+    interrupted run rebuilds the file from scratch next time."""
+    if manifest["files"].pop(file_hash, None) is not None:
+        _write_manifest(cache_dir, manifest)
+
+
+def _changed_fields(old: Dict[str, str], new: Dict[str, str]) -> Set[str]:
+    """Fields whose normalization config was added, removed or edited."""
+    return {field for field in set(old) | set(new) if old.get(field) != new.get(field)}
+
+
+def _rebuild_file(
+    raw_path: str,
+    file_hash: str,
+    cache_dir: str,
+    fields_to_keep: List[str],
+    plan: List[Any],
+    generate_id: IdGenerator,
+) -> Tuple[int, bool]:
+    """
+    Runs standardize, normalize and add ids on one raw file and caches both outputs.
+
+    Returns the number of records cached and whether the whole file could be read. As
+    in `iter_raw_records`, the records read before a parse error are kept.
+    """
+    count = 0
+    with NdjsonWriter(_cache_path(cache_dir, file_hash, "standardized")) as std_writer, \
+            NdjsonWriter(_cache_path(cache_dir, file_hash, "normalized")) as norm_writer:
+        try:
+            for obj in iter_json_array(raw_path):
+                standardized = standardize_record(obj, fields_to_keep)
+                std_writer.write(standardized)
+                record = normalize_record(standardized, plan)
+                record["id"] = generate_id(record)
+                norm_writer.write(record)
+                count += 1
+        except ValueError as e:
+            print(f"Error reading {raw_path}: {e}")
+            return count, False
+    return count, True
+
+
+def _renormalize_fields(
+    file_hash: str,
+    cache_dir: str,
+    changed: Set[str],
+    compiled_fields: Dict[str, CompiledField],
+    generate_id: IdGenerator,
+) -> None:
+    """
+    Re-normalizes only the `changed` fields of a file's cached records, and recomputes
+    their ids.
+
+    A field's normalized value only depends on its standardized value and on its own
+    config, so the other fields are taken from the normalized cache as they are. With
+    no changed field, only the ids are recomputed.
+    """
+    std_path = _cache_path(cache_dir, file_hash, "standardized")
+    norm_path = _cache_path(cache_dir, file_hash, "normalized")
+    # The writer only replaces the normalized cache once it is fully rewritten
+    with NdjsonWriter(norm_path) as writer:
+        for standardized, record in zip(iter_ndjson(std_path), iter_ndjson(norm_path)):
+            for field in changed:
+                if field not in standardized:
+                    continue
+                compiled = compiled_fields.get(field)
+                if compiled is None:
+                    record[field] = standardized[field]
+                else:
+                    record[field] = compiled.normalize(standardized[field])
+            record["id"] = generate_id(record)
+            writer.write(record)
+
+
+def _regroup_file(file_hash: str, cache_dir: str, project: Callable[[Dict[str, Any]], Dict[str, Any]]) -> None:
+    """Rebuilds a file's grouped cache from its normalized cache (see `compile_grouping`)."""
+    with NdjsonWriter(_cache_path(cache_dir, file_hash, "grouped")) as writer:
+        for record in iter_ndjson(_cache_path(cache_dir, file_hash, "normalized")):
+            writer.write(project(record))
+
+
+def _iter_cached(cache_dir: str, file_hashes: List[str], stage: str) -> Iterator[Dict[str, Any]]:
+    for file_hash in file_hashes:
+        yield from iter_ndjson(_cache_path(cache_dir, file_hash, stage))
+
+
+def run_incremental_pipeline(
+    raw_files: List[str],
+    fields_to_keep: List[str],
+    normalization_map: Dict[str, Any],
+    grouping_config: Dict[str, Any],
+    output_path: str,
+    cache_dir: str,
+    sink: Optional[Callable[[Iterator[Dict[str, Any]]], Any]] = None,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    schema: Optional[Dict[str, Any]] = None,
+    ids: Optional[Dict[str, Any]] = None,
+    dedup: Optional[Deduplicator] = None,
+    validator: Optional[RecordValidator] = None,
+    index: bool = False,
+    tags: Optional[TagCodec] = None,
+    cube: Optional[OlapCube] = None,
+    features: Optional[FeatureSet] = None,
+) -> int:
+    """
+    Produces the grouped output, recomputing only what changed since the last run.
+
+    A manifest in `cache_dir` stores the content hash of each raw file along with the
+    hashes of `fields_to_keep`, of each field's normalization config, of the id settings
+    and of the grouping config that its cached standardized, normalized and grouped
+    records were built with. For each raw file:
+
+    - a new file, or a change to `fields_to_keep`, rebuilds all its stages;
+    - a change to some fields' normalization re-normalizes only those fields, then
+      recomputes ids and grouping;
+    - a change to the id settings recomputes ids and grouping;
+    - a change to the grouping config only regroups the cached normalized records;
+    - otherwise the cached grouped records are reused as they are.
+
+    The output is identical to `run_streaming_pipeline` on the same inputs.
+
+    Args:
+        raw_files (List[str]): Paths of the raw JSON files.
+        fields_to_keep (List[str]): Fields every record is standardized to.
+        normalization_map (Dict[str, Any]): The normalization map from config.json.
+        grouping_config (Dict[str, Any]): The grouping configuration.
+        output_path (str): Path of the grouped output file.
+        cache_dir (str): Directory holding the manifest and the per-file caches.
+        sink (Optional[Callable]): Optional consumer of the grouped record stream, as in
+            `run_streaming_pipeline`.
+        cache_size (int): Distinct values memoized per field when records are
+            (re-)normalized (see `NormalizationCache`); 0 disables the cache.
+        schema (Optional[Dict[str, Any]]): The JSON schema of the grouped records, as in
+            `run_streaming_pipeline`.
+        ids (Optional[Dict[str, Any]]): The "ids" settings of config.json, as in
+            `run_streaming_pipeline`.
+        dedup (Optional[Deduplicator]): If given, duplicates are dropped from the
+            output, as in `run_streaming_pipeline`. The caches keep every record, so
+            deduplication runs over the whole output on every run.
+        validator (Optional[RecordValidator]): If given, the output records are
+            validated, as in `run_streaming_pipeline`. Validation also runs over the
+            whole output, so that the quarantine file and the counts cover every record.
+        index (bool): Write an offset index next to the output, as in
+            `run_streaming_pipeline`.
+        tags (Optional[TagCodec]): If given, the tag fields of the output records are
+            encoded, as in `run_streaming_pipeline`. The caches keep the tags as strings.
+        cube (Optional[OlapCube]): If given, the output records are added to the cube,
+            as in `run_streaming_pipeline`. The cube is recomputed over the whole output.
+        features (Optional[FeatureSet]): If given, the derived features are added to the
+            output records, as in `run_streaming_pipeline`.
+
+    Returns:
+        int: The number of records written to `output_path`.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = load_manifest(cache_dir)
+    fields_hash = hash_config(fields_to_keep)
+    normalization_hashes = {field: normalization_hash(field_config)
+                            for field, field_config in normalization_map.items()}
+    grouping_hash = hash_config(grouping_config)
+    generate_id = make_id_generator(ids)
+    ids_hash = hash_config({"format": generate_id.id_format, "hash": generate_id.hash_name})
+    # Entries written before ids could be configured hold legacy ids
+    legacy_ids_hash = hash_config({"format": "legacy", "hash": "sha256"})
+    for message in validate_grouping(grouping_config, fields_to_keep, schema):
+        print(f"Warning: {message}")
+    project = compile_grouping(grouping_config)
+
+    cache = NormalizationCache(cache_size) if cache_size else None
+    plan = None
+    compiled_fields = None
+    files = {}
+    order = []
+    for raw_path in raw_files:
+        abs_path = os.path.abspath(raw_path)
+        if not os.path.isfile(abs_path):
+            print(f"File not found: {abs_path}")
+            continue
+        file_hash = hash_file(abs_path)
+        entry = manifest["files"].get(file_hash)
+        order.append(file_hash)
+
+        if entry is None or entry["fields_to_keep"] != fields_hash:
+            print(f"Rebuilding {abs_path}")
+            _invalidate(cache_dir, manifest, file_hash)
+            if plan is None:
+                plan = compile_normalization_map(normalization_map)
+                if cache is not None:
+                    plan = cache.memoize(plan)
+            count, complete = _rebuild_file(
+                abs_path, file_hash, cache_dir, fields_to_keep, plan, generate_id)
+            _regroup_file(file_hash, cache_dir, project)
+            if not complete:
+                # Keep the partial records in this run's output but never trust them later
+                continue
+        else:
+            count = entry["count"]
+            changed = _changed_fields(entry["normalization"], normalization_hashes)
+            reid = entry.get("ids", legacy_ids_hash) != ids_hash
+            regroup = bool(changed) or reid or entry["grouping"] != grouping_hash
+            if regroup:
+                _invalidate(cache_dir, manifest, file_hash)
+            if changed:
+                print(f"Re-normalizing {len(changed)} field(s) of {abs_path}")
+                if compiled_fields is None:
+                    compiled_fields = compile_normalization_map(normalization_map)
+                    if cache is not None:
+                        compiled_fields = cache.memoize(compiled_fields)
+                    compiled_fields = dict(compiled_fields)
+            elif reid:
+                print(f"Recomputing the ids of {abs_path}")
+            if changed or reid:
+                _renormalize_fields(file_hash, cache_dir, changed, compiled_fields or {}, generate_id)
+            if regroup:
+                print(f"Regrouping {abs_path}")
+                _regroup_file(file_hash, cache_dir, project)
+            else:
+                print(f"Reusing cached records for {abs_path}")
+
+        files[file_hash] = {
+            "path": raw_path,
+            "count": count,
+            "fields_to_keep": fields_hash,
+            "normalization": normalization_hashes,
+            "ids": ids_hash,
+            "grouping": grouping_hash,
+        }
+
+    # Drop the caches of raw files that are gone or whose content changed
+    for file_hash in set(manifest["files"]) - set(order):
+        for stage in ("standardized", "normalized", "grouped"):
+            path = _cache_path(cache_dir, file_hash, stage)
+            if os.path.exists(path):
+                os.remove(path)
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open_record_writer(output_path, index=index) as writer:
+        records = _iter_cached(cache_dir, order, "grouped")
+        if dedup is not None:
+            keys = (dedup.key(record) for record in _iter_cached(cache_dir, order, "normalized"))
+            records = dedup_stage(zip(records, keys), dedup, keyed=True)
+        if validator is not None:
+            records = validation_stage(records, validator)
+        if features is not None:
+            records = feature_stage(records, features)
+        if cube is not None:
+            records = cube_stage(records, cube)
+        if tags is not None:
+            records = tag_encoding_stage(records, tags)
+        records = tap_stage(records, writer)
+        if sink is not None:
+            sink(records)
+        for _ in records:
+            pass
+
+    # The manifest is completed last so an interrupted run never trusts a partial cache
+    _write_manifest(cache_dir, {"files": files})
+
+    print(f"Processed {writer.count} records. Output written to {output_path}")
+    if dedup is not None:
+        print(dedup.summary())
+    if validator is not None:
+        print("\n".join(validator.summary()))
+    if cube is not None:
+        print("\n".join(cube.summary()))
+    if cache is not None and (plan is not None or compiled_fields is not None):
+        print("\n".join(cache.summary()))
+    return writer.count
+
+
+def iter_cached_records(cache_dir: str, stage: str) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the cached records of one stage ("standardized", "normalized" or "grouped")
+    for every file in the manifest, in manifest order.
+    """
+    manifest = load_manifest(cache_dir)
+    for file_hash in manifest["files"]:
+        yield from iter_ndjson(_cache_path(cache_dir, file_hash, stage))
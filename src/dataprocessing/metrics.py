@@ -0,0 +1,367 @@
+import contextlib
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dataprocessing.normalize import (
+    _MISSING,
+    FUNCTION_REGISTRY,
+    CompiledField,
+    _run_compiled_rule,
+)
+
+
+class StageMetrics:
+    """
+    Counters of one pipeline stage or step: wall and CPU time, records and bytes.
+
+    Streaming stages run interleaved, each pulling records from the one before it, so
+    their times are measured inclusive of their upstream stage and reported both ways.
+    """
+
+    def __init__(self, name: str, upstream: Optional[str] = None):
+        self.name = name
+        self.upstream = upstream
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.records_out = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.extra: Dict[str, Any] = {}
+
+
+class InstrumentedField:
+    """
+    A CompiledField that counts which value mapping, dynamic rule or default produced
+    each normalized value, and times the FUNCTION_REGISTRY functions it calls.
+    """
+
+    __slots__ = ('compiled', 'uses_item', 'pure', 'batched', 'counts', '_rules')
+
+    def __init__(self, compiled: CompiledField, counts: Dict[str, Any], timed_functions: Dict[Any, Any]):
+        self.compiled = compiled
+        self.uses_item = compiled.uses_item
+        self.pure = compiled.pure
+        # Values are counted one by one, so batch variants are not used
+        self.batched = False
+        self.counts = counts
+        self._rules = [([(op, timed_functions.get(operand, operand) if op == 'apply_function' else operand)
+                         for op, operand in ops], action)
+                       for ops, action in compiled.rules]
+
+    def normalize(self, value: Any, item: Optional[Dict[str, Any]] = None) -> Any:
+        """Normalizes one value like CompiledField.normalize, counting the outcome."""
+        compiled = self.compiled
+        counts = self.counts
+        mapped = compiled.lookup(value)
+        if mapped is not _MISSING:
+            key = value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+            mappings = counts["value_mappings"]
+            mappings[key] = mappings.get(key, 0) + 1
+            return mapped
+        for index, (ops, action) in enumerate(self._rules):
+            result = _run_compiled_rule(value, ops, action, item)
+            if result is not None:
+                counts["rules"][index] += 1
+                return result
+        if compiled.has_default:
+            counts["default"] += 1
+            return compiled.default
+        counts["unchanged"] += 1
+        return value
+
+
+class NormalizationMetrics:
+    """
+    Per-field counters of the normalization outcomes and per-function timings.
+
+    `instrument` returns a copy of a compiled plan that updates these counters. Every
+    value must go through the rules for the counts to be per record, so instrumented
+    plans are not memoized (see `NormalizationCache`).
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Dict[str, Any]] = {}
+        self.functions: Dict[str, List[float]] = {}
+
+    def _timed_function(self, name: str, func: Any) -> Any:
+        timing = self.functions.setdefault(name, [0, 0.0])
+
+        def timed(value, item=None):
+            start = time.perf_counter()
+            try:
+                return func(value, item=item)
+            finally:
+                timing[0] += 1
+                timing[1] += time.perf_counter() - start
+        return timed
+
+    def instrument(self, plan: List[Tuple[str, CompiledField]]) -> List[Tuple[str, InstrumentedField]]:
+        """Returns a copy of a compiled plan whose fields update these counters."""
+        names = {func: name for name, func in FUNCTION_REGISTRY.items()}
+        # Functions given with settings in the map are bound copies, timed under their name
+        timed_functions = {func: self._timed_function(getattr(func, 'name', None) or names.get(func, repr(func)), func)
+                           for _, compiled in plan for ops, _ in compiled.rules
+                           for op, func in ops if op == 'apply_function'}
+        instrumented = []
+        for field, compiled in plan:
+            counts = self.fields.setdefault(field, {
+                "value_mappings": {},
+                "rules": [0] * len(compiled.rules),
+                "default": 0,
+                "unchanged": 0,
+            })
+            instrumented.append((field, InstrumentedField(compiled, counts, timed_functions)))
+        return instrumented
+
+    def take_counts(self) -> Dict[str, Any]:
+        """Returns the counters gathered since the last call and resets them."""
+        counts = {"fields": {}, "functions": {}}
+        for field, field_counts in self.fields.items():
+            counts["fields"][field] = {
+                "value_mappings": dict(field_counts["value_mappings"]),
+                "rules": list(field_counts["rules"]),
+                "default": field_counts["default"],
+                "unchanged": field_counts["unchanged"],
+            }
+            # Reset in place: the instrumented fields hold these very objects
+            field_counts["value_mappings"].clear()
+            field_counts["rules"][:] = [0] * len(field_counts["rules"])
+            field_counts["default"] = 0
+            field_counts["unchanged"] = 0
+        for name, timing in self.functions.items():
+            counts["functions"][name] = list(timing)
+            timing[:] = [0, 0.0]
+        return counts
+
+    def add_counts(self, counts: Dict[str, Any]):
+        """Adds counters taken from another process (see `take_counts`)."""
+        for field, field_counts in counts["fields"].items():
+            total = self.fields.setdefault(field, {
+                "value_mappings": {},
+                "rules": [0] * len(field_counts["rules"]),
+                "default": 0,
+                "unchanged": 0,
+            })
+            for key, count in field_counts["value_mappings"].items():
+                total["value_mappings"][key] = total["value_mappings"].get(key, 0) + count
+            for index, count in enumerate(field_counts["rules"]):
+                total["rules"][index] += count
+            total["default"] += field_counts["default"]
+            total["unchanged"] += field_counts["unchanged"]
+        for name, (calls, seconds) in counts["functions"].items():
+            timing = self.functions.setdefault(name, [0, 0.0])
+            timing[0] += calls
+            timing[1] += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the counters as a JSON-serializable dictionary."""
+        fields = {}
+        for field, counts in self.fields.items():
+            fields[field] = {
+                "value_mappings": dict(sorted(counts["value_mappings"].items(),
+                                              key=lambda item: -item[1])),
+                "rules": list(counts["rules"]),
+                "default": counts["default"],
+                "unchanged": counts["unchanged"],
+            }
+        functions = {name: {"calls": calls, "seconds": round(seconds, 6)}
+                     for name, (calls, seconds) in self.functions.items() if calls}
+        return {"fields": fields, "functions": functions}
+
+
+def _label(value: Any) -> str:
+    text = str(value)
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PipelineMetrics:
+    """
+    Instrumentation of a pipeline run: time, records and bytes per step and per
+    streaming stage, normalization counters, validation counts, and optional profiles.
+
+    Steps are timed with the `step` context manager. Streaming stages are timed by
+    wrapping their generators with `timed`; as each stage pulls its records from the
+    one before it, a stage's own time is its inclusive time minus its upstream's.
+
+    With `profile_dir`, each step runs under cProfile and its stats are dumped to
+    '<profile_dir>/<step>.prof'. With `trace_memory`, each step's peak traced memory
+    and its top allocation sites are added to the report.
+    """
+
+    def __init__(self, profile_dir: Optional[str] = None, trace_memory: bool = False):
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.steps: Dict[str, StageMetrics] = {}
+        self.stages: Dict[str, StageMetrics] = {}
+        self.normalization = NormalizationMetrics()
+        # Set by the pipeline when records are validated (see `validation.ValidationStats.to_dict`)
+        self.validation: Optional[Dict[str, Any]] = None
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def step(self, name: str) -> Iterator[StageMetrics]:
+        """Measures the wall and CPU time of a step, optionally profiling it."""
+        metrics = self.steps.setdefault(name, StageMetrics(name))
+        profiler = None
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler = cProfile.Profile()
+        if self.trace_memory:
+            tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield metrics
+        finally:
+            if profiler:
+                profiler.disable()
+            metrics.wall += time.perf_counter() - wall
+            metrics.cpu += time.process_time() - cpu
+            if self.trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                metrics.extra["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                metrics.extra["top_allocations"] = [
+                    {"site": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+                    for stat in snapshot.statistics("lineno")[:10]]
+            if profiler:
+                path = os.path.join(self.profile_dir, f"{name}.prof")
+                profiler.dump_stats(path)
+                metrics.extra["profile"] = path
+
+    def timed(self, records: Iterable[Any], name: str, upstream: Optional[str] = None) -> Iterator[Any]:
+        """Wraps the records of a stage in a generator that times every pull and counts them."""
+        # Registered now rather than on the first pull, so stages are listed in pipeline order
+        metrics = self.stages.setdefault(name, StageMetrics(name, upstream))
+        return self._timed(records, metrics)
+
+    @staticmethod
+    def _timed(records: Iterable[Any], metrics: StageMetrics) -> Iterator[Any]:
+        iterator = iter(records)
+        perf_counter, process_time = time.perf_counter, time.process_time
+        while True:
+            wall, cpu = perf_counter(), process_time()
+            try:
+                record = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                metrics.wall += perf_counter() - wall
+                metrics.cpu += process_time() - cpu
+            metrics.records_out += 1
+            yield record
+
+    def add_bytes(self, name: str, read: int = 0, written: int = 0):
+        """Adds bytes read or written to a stage, creating it if needed."""
+        metrics = self.stages.setdefault(name, StageMetrics(name))
+        metrics.bytes_read += read
+        metrics.bytes_written += written
+
+    def _stage_dict(self, metrics: StageMetrics, stages: Dict[str, StageMetrics]) -> Dict[str, Any]:
+        upstream = stages.get(metrics.upstream) if metrics.upstream else None
+        result = {
+            "wall_seconds": round(metrics.wall, 6),
+            "cpu_seconds": round(metrics.cpu, 6),
+        }
+        if upstream is not None:
+            result["self_wall_seconds"] = round(metrics.wall - upstream.wall, 6)
+            result["self_cpu_seconds"] = round(metrics.cpu - upstream.cpu, 6)
+            result["records_in"] = upstream.records_out
+        result["records_out"] = metrics.records_out
+        result["bytes_read"] = metrics.bytes_read
+        result["bytes_written"] = metrics.bytes_written
+        result.update(metrics.extra)
+        return result
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the whole report as a JSON-serializable dictionary."""
+        report = {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "steps": {name: {"wall_seconds": round(m.wall, 6), "cpu_seconds": round(m.cpu, 6), **m.extra}
+                      for name, m in self.steps.items()},
+            "stages": {name: self._stage_dict(m, self.stages) for name, m in self.stages.items()},
+            "normalization": self.normalization.to_dict(),
+        }
+        if self.validation is not None:
+            report["validation"] = self.validation
+        return report
+
+    def to_prometheus(self) -> str:
+        """Returns the report in the Prometheus text exposition format."""
+        report = self.to_dict()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_label(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        steps = report["steps"]
+        metric("pipeline_step_wall_seconds", "gauge", "Wall-clock time of a pipeline step.",
+               [({"step": name}, m["wall_seconds"]) for name, m in steps.items()])
+        metric("pipeline_step_cpu_seconds", "gauge", "CPU time of a pipeline step.",
+               [({"step": name}, m["cpu_seconds"]) for name, m in steps.items()])
+        stages = report["stages"]
+        metric("pipeline_stage_wall_seconds", "gauge",
+               "Wall-clock time of a streaming stage, excluding its upstream stage.",
+               [({"stage": name}, m.get("self_wall_seconds", m["wall_seconds"]))
+                for name, m in stages.items()])
+        metric("pipeline_stage_cpu_seconds", "gauge",
+               "CPU time of a streaming stage, excluding its upstream stage.",
+               [({"stage": name}, m.get("self_cpu_seconds", m["cpu_seconds"]))
+                for name, m in stages.items()])
+        metric("pipeline_stage_records_total", "counter", "Records produced by a streaming stage.",
+               [({"stage": name}, m.get("records_out", 0)) for name, m in stages.items()])
+        metric("pipeline_stage_bytes_read_total", "counter", "Bytes read by a streaming stage.",
+               [({"stage": name}, m["bytes_read"]) for name, m in stages.items()])
+        metric("pipeline_stage_bytes_written_total", "counter", "Bytes written by a streaming stage.",
+               [({"stage": name}, m["bytes_written"]) for name, m in stages.items()])
+
+        fields = report["normalization"]["fields"]
+        metric("normalization_value_mapping_total", "counter",
+               "Values normalized by a value mapping.",
+               [({"field": field, "value": key}, count)
+                for field, counts in fields.items()
+                for key, count in counts["value_mappings"].items()])
+        metric("normalization_rule_total", "counter", "Values normalized by a dynamic rule.",
+               [({"field": field, "rule": index}, count)
+                for field, counts in fields.items()
+                for index, count in enumerate(counts["rules"])])
+        metric("normalization_default_total", "counter", "Values replaced by the field default.",
+               [({"field": field}, counts["default"]) for field, counts in fields.items()])
+        metric("normalization_unchanged_total", "counter", "Values left unchanged.",
+               [({"field": field}, counts["unchanged"]) for field, counts in fields.items()])
+        functions = report["normalization"]["functions"]
+        metric("normalization_function_calls_total", "counter",
+               "Calls of a FUNCTION_REGISTRY function.",
+               [({"function": name}, timing["calls"]) for name, timing in functions.items()])
+        metric("normalization_function_seconds_total", "counter",
+               "Time spent in a FUNCTION_REGISTRY function.",
+               [({"function": name}, timing["seconds"]) for name, timing in functions.items()])
+        validation = report.get("validation")
+        if validation is not None:
+            metric("validation_records_total", "counter", "Grouped records by validation result.",
+                   [({"result": result}, validation[result]) for result in ("valid", "invalid")])
+            metric("validation_errors_total", "counter", "Invalid records with an error at a path.",
+                   [({"path": path}, count) for path, count in validation["errors_by_path"].items()])
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        """Writes the JSON report and/or the Prometheus text file."""
+        for path, text in ((json_path, lambda: json.dumps(self.to_dict(), indent=2, ensure_ascii=False)),
+                           (prometheus_path, self.to_prometheus)):
+            if not path:
+                continue
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text())
+            print(f"Metrics written to {path}")
@@ -1,36 +1,85 @@
 import os
 import sys
 import json
-import hashlib
 import re
-
-
-def concatenate_json_files(input_files, output_file):
+import copy
+from collections import OrderedDict
+
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataprocessing.functions import FUNCTION_REGISTRY, has_batch, is_pure
+from dataprocessing.ids import DEFAULT_ID_FORMAT, HASH_NAMES, ID_FORMATS, IdGenerator, legacy_id
+from dataprocessing.profiling import (
+    DEFAULT_EXACT_THRESHOLD,
+    DEFAULT_TOP_K,
+    profile_field_values,
+    profile_values,
+)
+from dataprocessing.recordio import (
+    FORMATS,
+    IndexedRecordFile,
+    build_index,
+    detect_format,
+    iter_json_array,
+    iter_records,
+    open_record_writer,
+)
+from dataprocessing.tags import TagCollector, load_vocabularies, save_vocabularies
+
+
+def concatenate_json_files(input_files, output_file, fmt=None, fields_output=None):
     """
-    Concatenate JSON arrays from multiple files into a single JSON array file.
+    Concatenate JSON arrays from multiple files into a single record file.
+    The output format is given by fmt, or inferred from the output file extension.
+    Records are streamed from each file to the output, so memory is bounded by one
+    record. If fields_output is given, the set of fields found in the records is
+    collected in the same pass and written there, as by collect_fields_from_json_files.
     """
-    all_items = []
-    for file_path in input_files:
-        abs_path = os.path.abspath(file_path)
-        print(f"Processing file: {abs_path}")
-        if not os.path.isfile(abs_path):
-            print(f"File not found: {abs_path}")
-            continue
-        with open(abs_path, 'r', encoding='utf-8') as f:
+    all_fields = set()
+    total_files = 0
+    total_objects = 0
+    with open_record_writer(output_file, fmt) as writer:
+        for file_path in input_files:
+            abs_path = os.path.abspath(file_path)
+            print(f"Processing file: {abs_path}")
+            if not os.path.isfile(abs_path):
+                print(f"File not found: {abs_path}")
+                continue
+            file_count = writer.count
             try:
-                data = json.load(f)
-                if not isinstance(data, list):
-                    print(
-                        f"File {abs_path} does not contain a JSON array. Skipping.")
-                    continue
-                all_items.extend(data)
-            except Exception as e:
+                for item in iter_json_array(abs_path):
+                    writer.write(item)
+                    if isinstance(item, dict):
+                        all_fields.update(item)
+                        total_objects += 1
+            except ValueError as e:
+                # Records read before the error are kept, as in the streaming pipeline
                 print(f"Error reading {abs_path}: {e}")
                 continue
-    with open(output_file, 'w', encoding='utf-8') as out_f:
-        json.dump(all_items, out_f, indent=2, ensure_ascii=False)
-    print(f"Wrote {len(all_items)} items to {output_file}")
-    return len(all_items)
+            total_files += 1
+            print(f"Read {writer.count - file_count} items from {abs_path}")
+    print(f"Wrote {writer.count} items to {output_file}")
+    if fields_output:
+        print(f"\nProcessed {total_files} files and {total_objects} objects.")
+        write_field_list(all_fields, fields_output)
+    return writer.count
+
+
+def write_field_list(fields, output_path):
+    """
+    Write a set of field names to output_path as a sorted JSON list, and return the list.
+    """
+    result = sorted(fields)
+    print(f"Total unique fields found: {len(result)}")
+    try:
+        with open(output_path, 'w', encoding='utf-8') as out_f:
+            json.dump(result, out_f, indent=2, ensure_ascii=False)
+        print(f"Fields written to {output_path}")
+    except Exception as e:
+        print(f"Failed to write to {output_path}: {e}")
+    return result
 
 
 def collect_fields_from_json_files(relative_paths, output_path):
@@ -45,78 +94,52 @@ def collect_fields_from_json_files(relative_paths, output_path):
             print(f"File not found: {abs_path}")
             continue
 
-        with open(abs_path, 'r', encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-                if not isinstance(data, list):
-                    print(f"File {abs_path} does not contain a JSON array.")
-                    continue
-            except Exception as e:
-                print(f"Error reading {abs_path}: {e}")
-                continue
-
-            total_files += 1
-            for obj in data:
+        try:
+            for obj in iter_records(abs_path):
                 if isinstance(obj, dict):
                     all_fields.update(obj.keys())
                     total_objects += 1
+        except Exception as e:
+            print(f"Error reading {abs_path}: {e}")
+            continue
+        total_files += 1
 
-    result = sorted(list(all_fields))
     print(f"\nProcessed {total_files} files and {total_objects} objects.")
-    print(f"Total unique fields found: {len(result)}")
+    return write_field_list(all_fields, output_path)
 
-    try:
-        with open(output_path, 'w', encoding='utf-8') as out_f:
-            json.dump(result, out_f, indent=2, ensure_ascii=False)
-        print(f"Fields written to {output_path}")
-    except Exception as e:
-        print(f"Failed to write to {output_path}: {e}")
 
-    return result
+def standardize_record(obj, fields):
+    """
+    Return a copy of a single object holding exactly the given fields, in order.
+    Non-dict values are passed through unchanged.
+    """
+    if isinstance(obj, dict):
+        return {field: obj.get(field, None) for field in fields}
+    return obj
 
 
-def standardize_fields(fields, data_path, output_path):
+def standardize_fields(fields, data_path, output_path, fmt=None):
     """
     Add missing fields and remove non-existing ones from each object in the data file, using the fields from fields_path.
+    Records are streamed; the output format is given by fmt or inferred from output_path.
     """
     if not isinstance(fields, list):
         raise ValueError(f"fields must be a list of field names.")
 
-    with open(data_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    if not isinstance(data, list):
-        raise ValueError(
-            f"{data_path} does not contain a JSON array of objects.")
-
-    new_data = []
-    for obj in data:
-        if isinstance(obj, dict):
-            new_obj = {field: obj.get(field, None) for field in fields}
-            new_data.append(new_obj)
-        else:
-            new_data.append(obj)
-
-    with open(output_path, 'w', encoding='utf-8') as out_f:
-        json.dump(new_data, out_f, indent=2, ensure_ascii=False)
+    with open_record_writer(output_path, fmt) as writer:
+        for obj in iter_records(data_path):
+            writer.write(standardize_record(obj, fields))
     print(
-        f"Wrote {len(new_data)} objects with only specified fields to {output_path}")
+        f"Wrote {writer.count} objects with only specified fields to {output_path}")
 
 
-def collect_field_values(input_file, output_file):
+def summarize_field_values(records):
     """
-    Reads a JSON array file, collects all unique values for each field across all objects,
-    and writes the result as a dictionary to the output file.
+    Collect all unique values for each field across an iterable of objects.
+    Returns a dictionary mapping each field to its sorted list of unique values.
     """
-    if not os.path.isfile(input_file):
-        print(f"File not found: {input_file}")
-        return
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    if not isinstance(data, list):
-        print(f"Input file does not contain a JSON array.")
-        return
     field_values = {}
-    for obj in data:
+    for obj in records:
         if isinstance(obj, dict):
             for k, v in obj.items():
                 if k not in field_values:
@@ -128,14 +151,52 @@ def collect_field_values(input_file, output_file):
         if x is None:
             return (0, '')
         return (1, str(x))
-    result = {k: sorted([json.loads(val) for val in vals], key=safe_sort_key)
-              for k, vals in field_values.items()}
+    return {k: sorted([json.loads(val) for val in vals], key=safe_sort_key)
+            for k, vals in field_values.items()}
+
+
+def collect_field_values(input_file, output_file, profile=False,
+                         exact_threshold=DEFAULT_EXACT_THRESHOLD, top_k=DEFAULT_TOP_K,
+                         tag_fields=None, vocabulary_path=None):
+    """
+    Reads a record file, collects all unique values for each field across all objects,
+    and writes the result as a dictionary to the output file.
+    With profile=True, each field gets a frequency profile instead of a plain list of
+    values (see profiling.profile_field_values), with bounded memory per field.
+    With tag_fields and vocabulary_path, the tags of those fields are added to the tag
+    vocabularies in the same pass (see tags.TagCollector).
+    """
+    if not os.path.isfile(input_file):
+        print(f"File not found: {input_file}")
+        return
+    records = iter_records(input_file)
+    collector = None
+    if tag_fields and vocabulary_path:
+        collector = TagCollector(tag_fields)
+        records = collector.observe(records)
+    try:
+        if profile:
+            result = profile_field_values(records, exact_threshold, top_k)
+        else:
+            result = summarize_field_values(records)
+    except ValueError as e:
+        print(f"Error reading {input_file}: {e}")
+        return
     with open(output_file, 'w', encoding='utf-8') as out_f:
         json.dump(result, out_f, indent=2, ensure_ascii=False)
     print(f"Extracted field values for {len(result)} fields to {output_file}")
+    if collector is not None:
+        vocabularies = load_vocabularies(vocabulary_path)
+        added = collector.update(vocabularies)
+        save_vocabularies(vocabulary_path, vocabularies)
+        print(f"Added {added} new tags to the vocabularies in {vocabulary_path}")
 
 
 def generate_normalization_map(input_path, fields_to_keep):
+    """
+    Build a blank normalization map from a field values file, either plain value lists
+    or the field profiles written by collect_field_values(profile=True).
+    """
     if not os.path.isfile(input_path):
         print(f"File not found: {input_path}")
         sys.exit(1)
@@ -145,6 +206,9 @@ def generate_normalization_map(input_path, fields_to_keep):
     normalization_map = {}
     for field, values in data.items():
         if field in fields_to_keep:
+            if isinstance(values, dict):
+                # A field profile: its values come most frequent first
+                values = profile_values(values)
             value_map = {}
             for value in values:
                 # Handle strings directly, dump others to handle all value types as keys
@@ -164,23 +228,6 @@ def generate_normalization_map(input_path, fields_to_keep):
 # =============================================================================
 
 
-def transform_to_uppercase(value, item=None):
-    """Converts a string value to uppercase."""
-    if isinstance(value, str):
-        return value.upper()
-    return value
-
-# =============================================================================
-#  --- Function Registry ---
-# =============================================================================
-
-
-FUNCTION_REGISTRY = {
-    'to_uppercase': transform_to_uppercase,
-    'split_comma': lambda v, item=None: v.split(',') if isinstance(v, str) else v,
-}
-
-
 def apply_dynamic_rule(value, rule, item=None):
     """
     Applies a dynamic rule to a value, with access to the full item.
@@ -195,7 +242,7 @@ def apply_dynamic_rule(value, rule, item=None):
             if isinstance(value, str) and re.search(op_val, value):
                 return action
         elif op == 'apply_function':
-            func = FUNCTION_REGISTRY.get(op_val)
+            func = FUNCTION_REGISTRY.resolve(op_val)
             if func:
                 return func(value, item=item)
         elif op == '$condition' and item:
@@ -212,71 +259,479 @@ def apply_dynamic_rule(value, rule, item=None):
     return None
 
 
-def normalize_field_value(normalization_map, data_path, output_path):
+# =============================================================================
+#  --- Compiled Normalization Plan ---
+# =============================================================================
+
+_MISSING = object()
+
+# Types whose JSON lookup key can be replaced by a (type, value) dictionary key
+_TYPED_KEY_TYPES = (type(None), bool, int)
+
+# Results of these types are immutable, so one object can be shared by every record
+_SHAREABLE_TYPES = (type(None), bool, int, float, str)
+
+
+def _compile_condition(condition):
     """
-    Normalize field values in a JSON array using a normalization map.
-    The map can contain direct value mappings and dynamic rules.
+    Turn the 'if' block of a dynamic rule into a list of (operator, operand) ops.
+    Operators that can never fire (unknown names, unregistered functions) are dropped.
     """
-    with open(data_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    ops = []
+    for op, op_val in condition.items():
+        if op == '$in':
+            members = None
+            if isinstance(op_val, list):
+                try:
+                    members = frozenset(op_val)
+                except TypeError:
+                    members = None
+            ops.append(('$in', (members, op_val)))
+        elif op == '$regex':
+            ops.append(('$regex', re.compile(op_val)))
+        elif op == 'apply_function':
+            func = FUNCTION_REGISTRY.resolve(op_val)
+            if func:
+                ops.append(('apply_function', func))
+        elif op == '$condition':
+            ops.append(('$condition', (op_val.get('field'),
+                        op_val.get('op'), op_val.get('value'))))
+    return ops
+
 
-    normalized_data = []
-    for item in data:
-        new_item = item.copy()
-        for field, value in item.items():
-            if field in normalization_map:
-                field_config = normalization_map[field]
+class CompiledField:
+    """
+    The normalization config of one field, compiled once for the per-record loop.
+
+    String values are looked up directly in the value mappings, None/bool/int values
+    through (type, value) keys, and only the remaining types pay for a JSON dump.
+    A field is pure when its normalized value only depends on the value, so that it
+    can be memoized: its rules call pure functions only and do not look at the item.
+    """
 
-                # 1. Try direct value mapping first
-                value_mappings = field_config.get('value_mappings', {})
+    __slots__ = ('str_mappings', 'typed_mappings', 'json_mappings',
+                 'rules', 'has_default', 'default', 'uses_item', 'pure', 'batched')
 
-                # Handle different types for lookup
-                if isinstance(value, str):
-                    lookup_key = value
+    def __init__(self, field_config):
+        value_mappings = field_config.get('value_mappings', {})
+        self.json_mappings = value_mappings
+        self.str_mappings = value_mappings
+        self.typed_mappings = {}
+        for key, mapped in value_mappings.items():
+            try:
+                parsed = json.loads(key)
+            except ValueError:
+                continue
+            if type(parsed) in _TYPED_KEY_TYPES and json.dumps(parsed, sort_keys=True) == key:
+                self.typed_mappings[(type(parsed), parsed)] = mapped
+
+        self.rules = [(_compile_condition(rule.get('if', {})), rule.get('then'))
+                      for rule in field_config.get('dynamic_rules', [])]
+        self.has_default = 'default' in field_config
+        self.default = field_config.get('default')
+        # '$condition' rules look at other fields of the item, not only at the value
+        self.uses_item = any(op == '$condition'
+                             for ops, _ in self.rules for op, _ in ops)
+        functions = [operand for ops, _ in self.rules for op, operand in ops if op == 'apply_function']
+        self.pure = not self.uses_item and all(map(is_pure, functions))
+        # Batch variants are worth calling on many values at once (see normalize_many)
+        self.batched = self.pure and any(map(has_batch, functions))
+
+    def lookup(self, value):
+        """Return the mapped value for `value`, or _MISSING if it is not mapped."""
+        if isinstance(value, str):
+            return self.str_mappings.get(value, _MISSING)
+        if type(value) in _TYPED_KEY_TYPES:
+            return self.typed_mappings.get((type(value), value), _MISSING)
+        return self.json_mappings.get(json.dumps(value, sort_keys=True), _MISSING)
+
+    def apply_rules(self, value, item=None):
+        """Return the result of the first matching dynamic rule, or None."""
+        for ops, action in self.rules:
+            result = _run_compiled_rule(value, ops, action, item)
+            if result is not None:
+                return result
+        return None
+
+    def normalize(self, value, item=None):
+        """Normalize one value: value mappings, then dynamic rules, then default."""
+        mapped = self.lookup(value)
+        if mapped is not _MISSING:
+            return mapped
+        result = self.apply_rules(value, item)
+        if result is not None:
+            return result
+        if self.has_default:
+            return self.default
+        return value
+
+    def normalize_many(self, values):
+        """
+        Normalize a list of values, as `normalize` does each of them, rule by rule:
+        the functions of a rule are called once on all the values that reach them,
+        through their batch variant if they have one.
+        """
+        results = [_MISSING] * len(values)
+        pending = []
+        for i, value in enumerate(values):
+            mapped = self.lookup(value)
+            if mapped is _MISSING:
+                pending.append(i)
+            else:
+                results[i] = mapped
+        for ops, action in self.rules:
+            if not pending:
+                break
+            rule_results = _run_compiled_rule_many([values[i] for i in pending], ops, action)
+            remaining = []
+            for i, result in zip(pending, rule_results):
+                if result is None:
+                    remaining.append(i)
                 else:
-                    lookup_key = json.dumps(value, sort_keys=True)
+                    results[i] = result
+            pending = remaining
+        for i in pending:
+            results[i] = self.default if self.has_default else values[i]
+        return results
 
-                if lookup_key in value_mappings:
-                    new_item[field] = value_mappings[lookup_key]
-                    continue
 
-                # 2. Apply dynamic rules
-                rules = field_config.get('dynamic_rules', [])
-                rule_applied = False
-                for rule in rules:
-                    result = apply_dynamic_rule(value, rule)
-                    if result is not None:
-                        new_item[field] = result
-                        rule_applied = True
-                        break
+def _run_compiled_rule(value, ops, action, item=None):
+    """
+    Compiled counterpart of apply_dynamic_rule.
+    """
+    for op, operand in ops:
+        if op == '$in':
+            members, op_val = operand
+            if members is not None:
+                try:
+                    hit = value in members
+                except TypeError:
+                    hit = value in op_val
+            else:
+                hit = value in op_val
+            if hit:
+                return action
+        elif op == '$regex':
+            if isinstance(value, str) and operand.search(value):
+                return action
+        elif op == 'apply_function':
+            return operand(value, item=item)
+        elif op == '$condition' and item:
+            field_to_check, operator, check_value = operand
+            if field_to_check in item:
+                item_value = item[field_to_check]
+                if operator == '$in' and item_value in check_value:
+                    return action
+                elif operator == '$eq' and item_value == check_value:
+                    return action
+    return None
+
+
+_HIT = object()
+
+
+def _run_compiled_rule_many(values, ops, action):
+    """
+    Counterpart of _run_compiled_rule over a list of values, without the item: the
+    value-only operators are tested value by value, in order, and the values that reach
+    an 'apply_function' operator go through its function at once.
+    """
+    results = [None] * len(values)
+    pending = list(range(len(values)))
+    for op, operand in ops:
+        if not pending:
+            break
+        if op == 'apply_function':
+            pending_values = [values[i] for i in pending]
+            if hasattr(operand, 'apply_many'):
+                function_results = operand.apply_many(pending_values)
+            else:
+                function_results = [operand(value) for value in pending_values]
+            for i, result in zip(pending, function_results):
+                results[i] = result
+            break
+        remaining = []
+        for i in pending:
+            if _run_compiled_rule(values[i], [(op, operand)], _HIT) is _HIT:
+                results[i] = action
+            else:
+                remaining.append(i)
+        pending = remaining
+    return results
+
+
+def compile_normalization_map(normalization_map):
+    """
+    Compile a normalization map into a plan: a list of (field, CompiledField) pairs.
+    Regexes are precompiled, '$in' operands become frozensets and functions are
+    resolved against FUNCTION_REGISTRY once (loading its plugins on first use).
+    """
+    return [(field, CompiledField(field_config))
+            for field, field_config in normalization_map.items()]
+
 
-                if rule_applied:
-                    continue
+def normalize_record(item, plan):
+    """
+    Normalize the field values of a single object using a compiled plan.
+    Returns a new object; the input is left untouched.
+    """
+    new_item = item.copy()
+    for field, compiled in plan:
+        value = item.get(field, _MISSING)
+        if value is not _MISSING:
+            # Rules are evaluated without the item, as the map has always been applied
+            new_item[field] = compiled.normalize(value)
+    return new_item
+
+
+# =============================================================================
+#  --- Normalization Cache ---
+# =============================================================================
+
+DEFAULT_CACHE_SIZE = 4096
 
-                # 3. Apply default value if no mapping or rule matched
-                if 'default' in field_config:
-                    new_item[field] = field_config['default']
 
-        normalized_data.append(new_item)
+def _memo_key(value):
+    """
+    Return a cache key for a scalar `value`, or None for lists, dicts and other values
+    that are not cached. Non-string keys carry their type so that 1, 1.0 and True stay
+    apart, and floats are keyed on their exact bits so that 0.0 and -0.0 do too.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return value
+    if value_type is float:
+        return (float, value.hex())
+    if value_type in _TYPED_KEY_TYPES:
+        return (value_type, value)
+    return None
 
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(normalized_data, f, indent=2, ensure_ascii=False)
+
+class _CopyOnRead:
+    """A memoized list or dict result, copied for every record that receives it."""
+
+    __slots__ = ('value', 'flat')
+
+    def __init__(self, value):
+        self.value = value
+        # split_comma and the like return flat lists of strings: a slice copies them
+        self.flat = type(value) is list and all(type(v) in _SHAREABLE_TYPES for v in value)
+
+    def copy(self):
+        return self.value[:] if self.flat else copy.deepcopy(self.value)
+
+
+class MemoizedField:
+    """
+    A CompiledField behind a bounded (value -> normalized value) memo with LRU
+    eviction, so a repeated value costs one dictionary lookup.
+    """
+
+    __slots__ = ('field', 'compiled', 'max_entries', 'uses_item', 'pure', 'batched',
+                 '_entries', 'hits', 'misses', 'evictions')
+
+    def __init__(self, field, compiled, max_entries=DEFAULT_CACHE_SIZE):
+        self.field = field
+        self.compiled = compiled
+        self.max_entries = max_entries
+        self.uses_item = compiled.uses_item
+        self.pure = compiled.pure
+        self.batched = compiled.batched
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def normalize(self, value, item=None):
+        """Normalize one value, from the memo when it was seen before."""
+        key = value if type(value) is str else _memo_key(value)
+        if key is None:
+            self.misses += 1
+            return self.compiled.normalize(value, item)
+        entries = self._entries
+        result = entries.get(key, _MISSING)
+        if result is _MISSING:
+            self.misses += 1
+            result = self.compiled.normalize(value, item)
+            if type(result) not in _SHAREABLE_TYPES:
+                # Lists and dicts must not be shared between records
+                result = _CopyOnRead(result)
+            entries[key] = result
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            entries.move_to_end(key)
+        if type(result) is _CopyOnRead:
+            return result.copy()
+        return result
+
+    def normalize_many(self, values):
+        """Normalize a list of values, the ones not in the memo through `normalize_many`."""
+        entries = self._entries
+        results = [_MISSING] * len(values)
+        missed = []
+        for i, value in enumerate(values):
+            key = _memo_key(value)
+            result = entries.get(key, _MISSING) if key is not None else _MISSING
+            if result is _MISSING:
+                missed.append(i)
+                continue
+            self.hits += 1
+            entries.move_to_end(key)
+            results[i] = result.copy() if type(result) is _CopyOnRead else result
+        self.misses += len(missed)
+        computed = self.compiled.normalize_many([values[i] for i in missed])
+        for i, result in zip(missed, computed):
+            results[i] = result
+            key = _memo_key(values[i])
+            if key is None:
+                continue
+            # The memo keeps its own copy of lists and dicts, as in `normalize`
+            entries[key] = _CopyOnRead(copy.deepcopy(result)) if type(result) not in _SHAREABLE_TYPES else result
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.evictions += 1
+        return results
+
+    def take_counts(self):
+        """Return (hits, misses, evictions) since the last call and reset them."""
+        counts = (self.hits, self.misses, self.evictions)
+        self.hits = self.misses = self.evictions = 0
+        return counts
+
+
+class NormalizationCache:
+    """
+    Memoizes the normalization of (field, value) pairs across records.
+
+    Each field gets its own LRU memo of at most `max_entries` values, so a
+    high-cardinality field only evicts its own entries. Only fields with dynamic rules
+    are memoized: a field with value mappings alone already costs one dictionary
+    lookup. Fields with '$condition' rules depend on other fields of the item, and
+    fields whose rules call impure functions may not give the same result twice: both
+    are left uncached.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.counts = {}
+        self.bypassed = []
+        self._fields = []
+
+    def memoize(self, plan):
+        """Return a copy of a compiled plan whose fields go through the cache."""
+        memoized_plan = []
+        for field, compiled in plan:
+            if not compiled.rules:
+                memoized_plan.append((field, compiled))
+                continue
+            if not compiled.pure:
+                if field not in self.bypassed:
+                    self.bypassed.append(field)
+                memoized_plan.append((field, compiled))
+                continue
+            memo = MemoizedField(field, compiled, self.max_entries)
+            self._fields.append(memo)
+            memoized_plan.append((field, memo))
+        return memoized_plan
+
+    def take_counts(self):
+        """Return the per-field [hits, misses, evictions] since the last call."""
+        counts = {}
+        for memo in self._fields:
+            hits, misses, evictions = memo.take_counts()
+            if hits or misses:
+                counts[memo.field] = [hits, misses, evictions]
+        return counts
+
+    def add_counts(self, counts):
+        """Add per-field counts, e.g. those reported by worker processes."""
+        for field, field_counts in counts.items():
+            total = self.counts.setdefault(field, [0, 0, 0])
+            for i, count in enumerate(field_counts):
+                total[i] += count
+
+    def stats(self):
+        """Return the per-field and total hits, misses and evictions so far."""
+        self.add_counts(self.take_counts())
+        fields = {field: dict(zip(('hits', 'misses', 'evictions'), field_counts))
+                  for field, field_counts in self.counts.items()}
+        totals = {name: sum(counts[name] for counts in fields.values())
+                  for name in ('hits', 'misses', 'evictions')}
+        return {"fields": fields, "totals": totals, "bypassed": list(self.bypassed)}
+
+    def summary(self):
+        """Return a few human-readable lines describing the cache's effectiveness."""
+        stats = self.stats()
+        totals = stats["totals"]
+        lookups = totals["hits"] + totals["misses"]
+        rate = f"{100 * totals['hits'] / lookups:.1f}%" if lookups else "n/a"
+        lines = [f"Normalization cache: {totals['hits']} hits, {totals['misses']} misses "
+                 f"({rate} hit rate), {totals['evictions']} evictions."]
+        for field, counts in stats["fields"].items():
+            if counts["evictions"]:
+                lines.append(f"  {field}: {counts['hits']} hits, {counts['misses']} misses, "
+                             f"{counts['evictions']} evictions (high cardinality)")
+        if stats["bypassed"]:
+            lines.append("  Not cached (rules depend on other fields or call impure functions): "
+                         + ", ".join(stats["bypassed"]))
+        return lines
+
+
+def normalize_field_value(normalization_map, data_path, output_path, fmt=None, engine="row",
+                          cache_size=DEFAULT_CACHE_SIZE):
+    """
+    Normalize field values in a record file using a normalization map.
+    The map can contain direct value mappings and dynamic rules.
+    Records are streamed; the output format is given by fmt or inferred from output_path.
+    engine="columnar" normalizes chunks of records column by column, with the same output.
+    Repeated values are served from a NormalizationCache of cache_size entries per field
+    (0 disables it).
+    """
+    cache = NormalizationCache(cache_size) if cache_size else None
+    if engine == "columnar":
+        from dataprocessing.columnar import normalize_columnar_stage
+        normalized = normalize_columnar_stage(
+            iter_records(data_path), normalization_map, cache=cache)
+    else:
+        plan = compile_normalization_map(normalization_map)
+        if cache is not None:
+            plan = cache.memoize(plan)
+        normalized = (normalize_record(item, plan) for item in iter_records(data_path))
+    with open_record_writer(output_path, fmt) as writer:
+        for item in normalized:
+            writer.write(item)
 
     print(
-        f"Normalized {len(normalized_data)} items. Output written to {output_path}")
+        f"Normalized {writer.count} items. Output written to {output_path}")
+    if cache is not None:
+        print("\n".join(cache.summary()))
 
 
 def generate_id(obj):
-    obj_copy = dict(obj)
-    obj_copy.pop('id', None)
-    obj_str = json.dumps(obj_copy, sort_keys=True, separators=(",", ":"))
-    hash_hex = hashlib.sha256(obj_str.encode("utf-8")).hexdigest()
-    uuid_like = f"{hash_hex[:8]}-{hash_hex[8:12]}-{hash_hex[12:16]}-{hash_hex[16:20]}-{hash_hex[20:32]}-{hash_hex[32:64]}"
-    return uuid_like
+    """Returns the legacy content-based id of a record (see ids.legacy_id)."""
+    return legacy_id(obj)
 
 
-def add_ids_to_data(input_path, output_path):
+def add_ids_to_data(input_path, output_path, fmt=None, id_format=DEFAULT_ID_FORMAT, id_hash=None):
+    """Adds an id to each record, in one of ids.ID_FORMATS."""
+    generate_id = IdGenerator(id_format, id_hash)
     print(f"Reading input file: {input_path}")
+    try:
+        with open_record_writer(output_path, fmt) as writer:
+            for obj in iter_records(input_path):
+                obj["id"] = generate_id(obj)
+                writer.write(obj)
+        print(f"Processed {writer.count} objects. Output written to: {output_path}")
+        print("Done.")
+        return
+    except ValueError:
+        # Not a record stream: fall back to a JSON object of lists of records
+        if detect_format(input_path) != 'json':
+            raise
+
     with open(input_path, "r", encoding="utf-8") as f:
         data = json.load(f)
     count = 0
@@ -314,6 +769,10 @@ if __name__ == "__main__":
         "input_files", nargs="+", help="List of input JSON file paths.")
     parser_concat.add_argument(
         "--output", required=True, help="Output file path.")
+    parser_concat.add_argument(
+        "--format", choices=FORMATS, help="Output format (default: from the output extension).")
+    parser_concat.add_argument(
+        "--fields-output", help="Also write the list of fields found in the records to this file.")
 
     # --- Sub-parser for collect_fields ---
     parser_collect = subparsers.add_parser(
@@ -332,6 +791,8 @@ if __name__ == "__main__":
         "--data-file", required=True, help="Path to the data file to standardize.")
     parser_standardize.add_argument(
         "--output", required=True, help="Path for the output standardized data file.")
+    parser_standardize.add_argument(
+        "--format", choices=FORMATS, help="Output format (default: from the output extension).")
 
     # --- Sub-parser for collect_field_values ---
     parser_values = subparsers.add_parser(
@@ -340,6 +801,20 @@ if __name__ == "__main__":
         "--input-file", required=True, help="Path to the input data file.")
     parser_values.add_argument(
         "--output", required=True, help="Path for the output file with field values.")
+    parser_values.add_argument(
+        "--profile", action="store_true",
+        help="Write value frequencies and sketches per field instead of plain value lists.")
+    parser_values.add_argument(
+        "--exact-threshold", type=int, default=DEFAULT_EXACT_THRESHOLD,
+        help="Distinct values counted exactly per field before switching to sketches.")
+    parser_values.add_argument(
+        "--top-k", type=int, default=DEFAULT_TOP_K,
+        help="Most frequent values kept per field once it uses sketches.")
+    parser_values.add_argument(
+        "--tag-fields", nargs="+", metavar="FIELD",
+        help="Also add the tags of these fields to the tag vocabularies.")
+    parser_values.add_argument(
+        "--vocabulary", help="Path of the tag vocabularies file, for --tag-fields.")
 
     # --- Sub-parser for generate_normalization_map ---
     parser_map = subparsers.add_parser(
@@ -348,6 +823,8 @@ if __name__ == "__main__":
                             help="Path to the field values file.")
     parser_map.add_argument("--output", required=True,
                             help="Path for the output normalization map.")
+    parser_map.add_argument("--fields-file",
+                            help="Path to JSON file with the list of fields to keep (default: all fields).")
 
     # --- Sub-parser for normalize_field_value ---
     parser_normalize = subparsers.add_parser(
@@ -358,6 +835,14 @@ if __name__ == "__main__":
         "--data-file", required=True, help="Path to the data file to normalize.")
     parser_normalize.add_argument(
         "--output", required=True, help="Path for the output normalized data file.")
+    parser_normalize.add_argument(
+        "--format", choices=FORMATS, help="Output format (default: from the output extension).")
+    parser_normalize.add_argument(
+        "--engine", choices=["row", "columnar"], default="row",
+        help="Normalize record by record, or column by column in chunks.")
+    parser_normalize.add_argument(
+        "--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+        help="Distinct values memoized per field (0 disables the cache).")
 
     # --- Sub-parser for add_ids ---
     parser_ids = subparsers.add_parser(
@@ -366,20 +851,83 @@ if __name__ == "__main__":
                             help="Path to the input data file.")
     parser_ids.add_argument("--output", required=True,
                             help="Path for the output data file with IDs.")
+    parser_ids.add_argument("--format", choices=FORMATS,
+                            help="Output format (default: from the output extension).")
+    parser_ids.add_argument("--id-format", choices=ID_FORMATS, default=DEFAULT_ID_FORMAT,
+                            help="Format of the ids; legacy ids match the ones already loaded.")
+    parser_ids.add_argument("--id-hash", choices=HASH_NAMES,
+                            help="Hash of compact ids (default: blake2b).")
+
+    # --- Sub-parser for build_index ---
+    parser_index = subparsers.add_parser(
+        "index", help="Write the offset index of an NDJSON or MessagePack file.")
+    parser_index.add_argument("input_file", help="Path to the record file.")
+
+    # --- Sub-parser for lookup ---
+    parser_lookup = subparsers.add_parser(
+        "lookup", help="Print records of an indexed file by id, position or id range.")
+    parser_lookup.add_argument("input_file", help="Path to the indexed record file.")
+    lookup_by = parser_lookup.add_mutually_exclusive_group(required=True)
+    lookup_by.add_argument("--id", nargs="+", help="Ids of the records to print.")
+    lookup_by.add_argument("--position", type=int, nargs="+",
+                           help="Positions of the records to print (0 for the first).")
+    lookup_by.add_argument("--range", nargs=2, metavar=("START", "STOP"),
+                           help="Print the records with START <= id < STOP, in id order.")
 
     args = parser.parse_args()
 
+    def load_config_section(path, key):
+        """Load a JSON file holding either a config.json-style object or the section itself."""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and key in data:
+            return data[key]
+        return data
+
     if args.command == "concatenate":
-        concatenate_json_files(args.input_files, args.output)
+        concatenate_json_files(args.input_files, args.output,
+                               args.format, args.fields_output)
     elif args.command == "collect_fields":
         collect_fields_from_json_files(args.input_files, args.output)
     elif args.command == "standardize":
-        standardize_fields(args.fields_file, args.data_file, args.output)
+        fields = load_config_section(args.fields_file, "fields_to_keep")
+        standardize_fields(fields, args.data_file, args.output, args.format)
     elif args.command == "collect_values":
-        collect_field_values(args.input_file, args.output)
+        if args.tag_fields and not args.vocabulary:
+            parser.error("--tag-fields needs --vocabulary")
+        collect_field_values(args.input_file, args.output, args.profile,
+                             args.exact_threshold, args.top_k,
+                             args.tag_fields, args.vocabulary)
     elif args.command == "generate_map":
-        generate_normalization_map(args.input_file, args.output)
+        if args.fields_file:
+            fields = load_config_section(args.fields_file, "fields_to_keep")
+        else:
+            with open(args.input_file, 'r', encoding='utf-8') as f:
+                fields = list(json.load(f))
+        normalization_map = generate_normalization_map(args.input_file, fields)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(normalization_map, f, indent=2, ensure_ascii=False)
+        print(f"Normalization map written to {args.output}")
     elif args.command == "normalize":
-        normalize_field_value(args.map_file, args.data_file, args.output)
+        normalization_map = load_config_section(args.map_file, "normalization_map")
+        normalize_field_value(normalization_map, args.data_file,
+                              args.output, args.format, args.engine, args.cache_size)
     elif args.command == "add_ids":
-        add_ids_to_data(args.input_file, args.output)
+        add_ids_to_data(args.input_file, args.output, args.format, args.id_format, args.id_hash)
+    elif args.command == "index":
+        count = build_index(args.input_file)
+        print(f"Indexed {count} records of {args.input_file}")
+    elif args.command == "lookup":
+        with IndexedRecordFile(args.input_file) as records:
+            if args.id:
+                found = [records.get(record_id) for record_id in args.id]
+                missing = [record_id for record_id, record in zip(args.id, found) if record is None]
+                if missing:
+                    print(f"Warning: no record with id {', '.join(missing)}", file=sys.stderr)
+                found = [record for record in found if record is not None]
+            elif args.position:
+                found = [records.record(position) for position in args.position]
+            else:
+                found = list(records.range(*args.range))
+        for record in found:
+            print(json.dumps(record, indent=2, ensure_ascii=False))
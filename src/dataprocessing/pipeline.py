@@ -0,0 +1,462 @@
+import multiprocessing
+import os
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dataprocessing.columnar import normalize_chunk_columnar, normalize_columnar_stage
+from dataprocessing.cube import OlapCube, cube_stage
+from dataprocessing.dedup import Deduplicator, MinHasher, dedup_key, dedup_stage
+from dataprocessing.features import FeatureSet, feature_stage
+from dataprocessing.grouping import compile_grouping, validate_grouping
+from dataprocessing.ids import IdGenerator, make_id_generator
+from dataprocessing.metrics import NormalizationMetrics, PipelineMetrics
+from dataprocessing.normalize import (
+    DEFAULT_CACHE_SIZE,
+    NormalizationCache,
+    compile_normalization_map,
+    normalize_record,
+    standardize_record,
+)
+from dataprocessing.recordio import iter_records, open_record_writer
+from dataprocessing.tags import TagCodec, tag_encoding_stage
+from dataprocessing.validation import RecordValidator, compile_schema, validation_stage
+
+
+def iter_raw_records(input_files: List[str]) -> Iterator[Any]:
+    """
+    Streams the records of several raw JSON array files, one file after the other.
+
+    Missing files and files that do not contain a JSON array are reported and skipped,
+    mirroring `concatenate_json_files`. A concatenated file in any record format (see
+    `recordio.detect_format`) can be read in place of the raw files.
+
+    Args:
+        input_files (List[str]): Paths of the raw JSON files.
+
+    Yields:
+        Any: Each raw record, in file order.
+    """
+    for file_path in input_files:
+        abs_path = os.path.abspath(file_path)
+        print(f"Processing file: {abs_path}")
+        if not os.path.isfile(abs_path):
+            print(f"File not found: {abs_path}")
+            continue
+        try:
+            yield from iter_records(abs_path)
+        except ValueError as e:
+            print(f"Error reading {abs_path}: {e}")
+
+
+def standardize_stage(records: Iterable[Any], fields: List[str]) -> Iterator[Any]:
+    """Keeps exactly `fields` on every record (see `standardize_record`)."""
+    for obj in records:
+        yield standardize_record(obj, fields)
+
+
+def normalize_stage(
+    records: Iterable[Dict[str, Any]],
+    normalization_map: Dict[str, Any],
+    engine: str = "row",
+    cache: Optional[NormalizationCache] = None,
+    instrument: Optional[NormalizationMetrics] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Applies the normalization map, compiled once, to every record (see `normalize_record`).
+    With engine="columnar", records are normalized column by column in chunks instead
+    (see `columnar.normalize_columnar_stage`); the output is the same. With a `cache`,
+    repeated (field, value) pairs are served from it. With `instrument`, every value is
+    normalized row by row, without the cache, and counted (see `NormalizationMetrics`).
+    """
+    if instrument is not None:
+        plan = instrument.instrument(compile_normalization_map(normalization_map))
+        for item in records:
+            yield normalize_record(item, plan)
+        return
+    if engine == "columnar":
+        yield from normalize_columnar_stage(records, normalization_map, cache=cache)
+        return
+    plan = compile_normalization_map(normalization_map)
+    if cache is not None:
+        plan = cache.memoize(plan)
+    for item in records:
+        yield normalize_record(item, plan)
+
+
+def add_ids_stage(records: Iterable[Dict[str, Any]],
+                  id_generator: Optional[IdGenerator] = None) -> Iterator[Dict[str, Any]]:
+    """Sets the content-based `id` of every record, legacy ids by default (see `ids.IdGenerator`)."""
+    generate_id = id_generator or IdGenerator()
+    for obj in records:
+        obj["id"] = generate_id(obj)
+        yield obj
+
+
+def grouping_stage(records: Iterable[Dict[str, Any]], grouping_config: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Nests the fields of every record according to the grouping configuration, compiled once."""
+    project = compile_grouping(grouping_config)
+    for record in records:
+        yield project(record)
+
+
+def tap_stage(records: Iterable[Any], writer: Any) -> Iterator[Any]:
+    """Writes every record passing through to `writer` and yields it unchanged."""
+    for record in records:
+        writer.write(record)
+        yield record
+
+
+# Per-process state of the pool workers, filled once by _init_worker
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_worker(normalization_map: Dict[str, Any], grouping_config: Dict[str, Any], engine: str = "row",
+                 cache_size: int = 0, instrument: bool = False, ids: Optional[Dict[str, Any]] = None,
+                 dedup: bool = False, dedup_hasher: Optional[MinHasher] = None,
+                 validation: Optional[Tuple[Dict[str, Any], List[str]]] = None):
+    """Compiles the normalization map, grouping, id generator and schema, and sets up the cache or metrics, once in each worker process."""
+    plan = compile_normalization_map(normalization_map)
+    cache = NormalizationCache(cache_size) if cache_size and not instrument else None
+    metrics = NormalizationMetrics() if instrument else None
+    if metrics is not None:
+        plan = metrics.instrument(plan)
+        engine = "row"
+    elif cache is not None:
+        plan = cache.memoize(plan)
+    _worker_state["plan"] = plan
+    _worker_state["cache"] = cache
+    _worker_state["metrics"] = metrics
+    _worker_state["project"] = compile_grouping(grouping_config)
+    _worker_state["generate_id"] = make_id_generator(ids)
+    _worker_state["dedup"] = dedup
+    _worker_state["dedup_hasher"] = dedup_hasher
+    _worker_state["validate"] = compile_schema(*validation) if validation is not None else None
+    _worker_state["engine"] = engine
+
+
+def _process_chunk(
+    chunk: List[Dict[str, Any]],
+    keep_normalized: bool,
+    keep_with_ids: bool,
+) -> Tuple[List[Tuple[Any, Any, Any, Any]], Dict[str, List[int]], Optional[Dict[str, Any]]]:
+    """
+    Normalizes, adds ids to and groups a chunk of standardized records in a worker.
+
+    Returns one (normalized, with_ids, grouped, dedup key) tuple per record, where the
+    first two are None unless the caller asked for them, the key is None unless
+    deduplication is on (see `dedup.dedup_key`) and, when validation is on, grouped is a
+    (grouped, validation errors) pair; the worker's cache counts for the chunk
+    (see `NormalizationCache.take_counts`) and its normalization metrics, if any (see
+    `NormalizationMetrics.take_counts`).
+    """
+    plan = _worker_state["plan"]
+    project = _worker_state["project"]
+    generate_id = _worker_state["generate_id"]
+    dedup = _worker_state["dedup"]
+    dedup_hasher = _worker_state["dedup_hasher"]
+    validate = _worker_state["validate"]
+    if _worker_state["engine"] == "columnar":
+        normalized_chunk = normalize_chunk_columnar(chunk, plan)
+    else:
+        normalized_chunk = [normalize_record(item, plan) for item in chunk]
+    results = []
+    for record in normalized_chunk:
+        normalized = record.copy() if keep_normalized else None
+        record["id"] = generate_id(record)
+        grouped = project(record)
+        if validate is not None:
+            grouped = (grouped, validate(grouped))
+        results.append((normalized, record if keep_with_ids else None,
+                        grouped, dedup_key(record, dedup_hasher) if dedup else None))
+    cache = _worker_state["cache"]
+    metrics = _worker_state["metrics"]
+    return (results, cache.take_counts() if cache is not None else {},
+            metrics.take_counts() if metrics is not None else None)
+
+
+def _chunked(records: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    """Groups a record stream into lists of at most `chunk_size` records."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parallel_process_stage(
+    records: Iterable[Dict[str, Any]],
+    normalization_map: Dict[str, Any],
+    grouping_config: Dict[str, Any],
+    workers: int,
+    chunk_size: int = 1000,
+    writers: Optional[Dict[str, Any]] = None,
+    engine: str = "row",
+    cache: Optional[NormalizationCache] = None,
+    instrument: Optional[NormalizationMetrics] = None,
+    ids: Optional[Dict[str, Any]] = None,
+    dedup: Optional[Deduplicator] = None,
+    validator: Optional[RecordValidator] = None,
+) -> Iterator[Any]:
+    """
+    Runs normalize, add ids and grouping on a process pool, preserving record order.
+
+    The stream is sharded into chunks of `chunk_size` records. At most two chunks per
+    worker are in flight, so memory stays bounded however long the stream is. The
+    output is identical to chaining `normalize_stage`, `add_ids_stage` and
+    `grouping_stage`.
+
+    Args:
+        records (Iterable[Dict[str, Any]]): Standardized records.
+        normalization_map (Dict[str, Any]): The normalization map from config.json.
+        grouping_config (Dict[str, Any]): The grouping configuration.
+        workers (int): Number of worker processes.
+        chunk_size (int): Number of records sent to a worker at a time.
+        writers (Optional[Dict[str, Any]]): Optional "normalized" and
+            "with_ids" writers fed in order from the parent process.
+        engine (str): "row" or "columnar" normalization inside the workers.
+        cache (Optional[NormalizationCache]): If given, each worker memoizes values in a
+            cache of the same size, and their hit and miss counts are added to it.
+        instrument (Optional[NormalizationMetrics]): If given, workers normalize row by
+            row without a cache, and their normalization counters are added to it.
+        ids (Optional[Dict[str, Any]]): The "ids" settings of config.json (see
+            `ids.make_id_generator`); legacy ids if None.
+        dedup (Optional[Deduplicator]): If given, the workers also compute the dedup
+            key of each record, near-duplicate signature included, before grouping.
+        validator (Optional[RecordValidator]): If given, the workers also validate each
+            grouped record against its schema.
+
+    Yields:
+        Any: Each grouped record, in input order. With `validator`, each (grouped
+            record, errors) pair for `validation.validation_stage` instead, and with
+            `dedup`, each (record or pair, dedup key) pair for `dedup.dedup_stage`.
+    """
+    writers = writers or {}
+    normalized_writer = writers.get("normalized")
+    with_ids_writer = writers.get("with_ids")
+    max_pending = workers * 2
+
+    with multiprocessing.Pool(workers, initializer=_init_worker,
+                              initargs=(normalization_map, grouping_config, engine,
+                                        cache.max_entries if cache is not None else 0,
+                                        instrument is not None, ids, dedup is not None,
+                                        dedup.hasher if dedup is not None else None,
+                                        (validator.schema, validator.assert_formats)
+                                        if validator is not None else None)) as pool:
+        pending = deque()
+
+        def drain_one():
+            results, cache_counts, metrics_counts = pending.popleft().get()
+            if cache is not None:
+                cache.add_counts(cache_counts)
+            if instrument is not None:
+                instrument.add_counts(metrics_counts)
+            for normalized, with_ids, grouped, key in results:
+                if normalized_writer:
+                    normalized_writer.write(normalized)
+                if with_ids_writer:
+                    with_ids_writer.write(with_ids)
+                yield grouped if dedup is None else (grouped, key)
+
+        for chunk in _chunked(records, chunk_size):
+            pending.append(pool.apply_async(
+                _process_chunk,
+                (chunk, normalized_writer is not None, with_ids_writer is not None)))
+            if len(pending) >= max_pending:
+                yield from drain_one()
+        while pending:
+            yield from drain_one()
+
+
+def run_streaming_pipeline(
+    raw_files: List[str],
+    fields_to_keep: List[str],
+    normalization_map: Dict[str, Any],
+    grouping_config: Dict[str, Any],
+    output_path: str,
+    intermediate_paths: Optional[Dict[str, str]] = None,
+    workers: int = 1,
+    chunk_size: int = 1000,
+    sink: Optional[Callable[[Iterator[Dict[str, Any]]], Any]] = None,
+    engine: str = "row",
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    metrics: Optional[PipelineMetrics] = None,
+    schema: Optional[Dict[str, Any]] = None,
+    ids: Optional[Dict[str, Any]] = None,
+    dedup: Optional[Deduplicator] = None,
+    validator: Optional[RecordValidator] = None,
+    index: bool = False,
+    tags: Optional[TagCodec] = None,
+    cube: Optional[OlapCube] = None,
+    features: Optional[FeatureSet] = None,
+) -> int:
+    """
+    Runs standardize, normalize, add ids, grouping, validation, derived features, the
+    aggregate cube and tag encoding as one generator pipeline.
+
+    Each raw record is parsed once, flows through every stage and is written once to
+    `output_path`. No intermediate file is written unless its stage is listed in
+    `intermediate_paths`. Every file is written in the format given by its extension
+    (see `recordio.detect_format`).
+
+    Args:
+        raw_files (List[str]): Paths of the raw JSON files.
+        fields_to_keep (List[str]): Fields every record is standardized to.
+        normalization_map (Dict[str, Any]): The normalization map from config.json.
+        grouping_config (Dict[str, Any]): The grouping configuration.
+        output_path (str): Path of the grouped output file.
+        intermediate_paths (Optional[Dict[str, str]]): Optional output paths keyed by
+            stage name: "concatenated", "standardized", "normalized" and "with_ids".
+        workers (int): Number of processes for normalize, add ids and grouping. With
+            more than one, records are processed in chunks on a process pool.
+        chunk_size (int): Number of records per chunk when `workers` > 1.
+        sink (Optional[Callable]): Optional consumer of the grouped record stream, such
+            as a database loader. Records reach it as they are written to `output_path`,
+            without the file being read back.
+        engine (str): "row" to normalize record by record, or "columnar" to normalize
+            chunks column by column. Both give the same output.
+        cache_size (int): Distinct values memoized per field during normalization
+            (see `NormalizationCache`); 0 disables the cache.
+        metrics (Optional[PipelineMetrics]): If given, the time, records and bytes of
+            every stage and the normalization counters are recorded in it. Values are
+            then normalized row by row, without the cache, so that every one is counted.
+        schema (Optional[Dict[str, Any]]): The JSON schema of the grouped records. The
+            grouping configuration is checked against it and against `fields_to_keep`
+            before the run (see `grouping.validate_grouping`).
+        ids (Optional[Dict[str, Any]]): The "ids" settings of config.json, choosing the
+            format and hash of the record ids (see `ids.make_id_generator`); legacy ids
+            if None.
+        dedup (Optional[Deduplicator]): If given, exact and near duplicates are dropped
+            after ids are added and before grouping, and the dedup report is left in
+            `dedup.report` (see `dedup.Deduplicator`).
+        validator (Optional[RecordValidator]): If given, grouped records are validated
+            against its schema, and the invalid ones are quarantined or reported, with
+            the counts left in `validator.stats` (see `validation.validation_stage`).
+        index (bool): Write an offset index next to the output and intermediate files,
+            for random access by position or id (see `recordio.IndexedRecordFile`).
+        tags (Optional[TagCodec]): If given, the tag fields of grouped records are
+            written as ids or bitsets in its vocabularies, which gain any new tag and
+            must be saved after the run (see `tags.TagCodec`).
+        cube (Optional[OlapCube]): If given, every grouped record that is written is
+            also added to the cube, to be written after the run (see `cube.write_cube`).
+        features (Optional[FeatureSet]): If given, the derived features are added to
+            each grouped record, computed column by column over chunks of `chunk_size`
+            records (see `features.FeatureSet`).
+
+    Returns:
+        int: The number of records written to `output_path`.
+    """
+    intermediate_paths = intermediate_paths or {}
+    # Built up front so that bad settings fail before any file is written
+    id_generator = make_id_generator(ids)
+    for message in validate_grouping(grouping_config, fields_to_keep, schema):
+        print(f"Warning: {message}")
+    instrument = metrics.normalization if metrics is not None else None
+    cache = NormalizationCache(cache_size) if cache_size and instrument is None else None
+    writers = {name: open_record_writer(path, index=index)
+               for name, path in intermediate_paths.items()}
+
+    def tapped(records, name):
+        if name in writers:
+            return tap_stage(records, writers[name])
+        return records
+
+    def timed(records, name, upstream=None):
+        if metrics is None:
+            return records
+        return metrics.timed(records, name, upstream)
+
+    try:
+        records = timed(tapped(iter_raw_records(raw_files), "concatenated"), "read")
+        records = timed(tapped(standardize_stage(records, fields_to_keep), "standardized"),
+                        "standardize", "read")
+        if workers > 1:
+            records = timed(parallel_process_stage(
+                records, normalization_map, grouping_config, workers, chunk_size, writers,
+                engine, cache, instrument, ids, dedup, validator), "process", "standardize")
+            last_stage = "process"
+            if dedup is not None:
+                # The index lives in this process: workers only compute the keys
+                records = timed(dedup_stage(records, dedup, keyed=True), "dedup", "process")
+                last_stage = "dedup"
+            if validator is not None:
+                # Workers validated the records: only the outcome is handled here
+                records = timed(validation_stage(records, validator, prevalidated=True),
+                                "validate", last_stage)
+                last_stage = "validate"
+        else:
+            records = timed(tapped(normalize_stage(
+                records, normalization_map, engine, cache, instrument), "normalized"),
+                "normalize", "standardize")
+            records = timed(tapped(add_ids_stage(records, id_generator), "with_ids"), "ids", "normalize")
+            upstream = "ids"
+            if dedup is not None:
+                records = timed(dedup_stage(records, dedup), "dedup", "ids")
+                upstream = "dedup"
+            records = timed(grouping_stage(records, grouping_config), "group", upstream)
+            last_stage = "group"
+            if validator is not None:
+                records = timed(validation_stage(records, validator), "validate", "group")
+                last_stage = "validate"
+        if features is not None:
+            records = timed(feature_stage(records, features, chunk_size), "features", last_stage)
+            last_stage = "features"
+        if cube is not None:
+            records = timed(cube_stage(records, cube), "cube", last_stage)
+            last_stage = "cube"
+        if tags is not None:
+            # Encoded in this process, so that new tags get the same ids whatever the workers
+            records = timed(tag_encoding_stage(records, tags), "tags", last_stage)
+            last_stage = "tags"
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open_record_writer(output_path, index=index) as output_writer:
+            records = timed(tap_stage(records, output_writer), "write", last_stage)
+            if sink is not None:
+                sink(records)
+            # Write whatever the sink did not consume
+            for _ in records:
+                pass
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    for name, writer in writers.items():
+        writer.close()
+        print(f"Wrote {writer.count} {name} items to {writer.path}")
+
+    print(
+        f"Processed {output_writer.count} records. Output written to {output_path}")
+    if dedup is not None:
+        print(dedup.summary())
+    if validator is not None:
+        print("\n".join(validator.summary()))
+        if metrics is not None:
+            metrics.validation = validator.stats.to_dict()
+    if cube is not None:
+        print("\n".join(cube.summary()))
+    if cache is not None:
+        print("\n".join(cache.summary()))
+    if metrics is not None:
+        _record_bytes(metrics, raw_files, writers, output_path)
+    return output_writer.count
+
+
+def _record_bytes(metrics: PipelineMetrics, raw_files: List[str], writers: Dict[str, Any],
+                  output_path: str):
+    """Adds the size of the files read and written to the stages that handled them."""
+    metrics.add_bytes("read", read=sum(os.path.getsize(path) for path in raw_files
+                                       if os.path.isfile(path)))
+    stage_of_file = {"concatenated": "read", "standardized": "standardize",
+                     "normalized": "normalize", "with_ids": "ids"}
+    for name, writer in writers.items():
+        stage = stage_of_file[name]
+        if stage not in metrics.stages:
+            # Normalize and add ids run inside the "process" stage on a process pool
+            stage = "process"
+        metrics.add_bytes(stage, written=os.path.getsize(writer.path))
+    metrics.add_bytes("write", written=os.path.getsize(output_path))
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import math
+import random
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_EXACT_THRESHOLD = 1000
+DEFAULT_TOP_K = 100
+DEFAULT_SAMPLE_SIZE = 2048
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter: estimates the number of distinct keys added with a
+    relative error of about 1.04 / sqrt(2 ** precision), in 2 ** precision bytes.
+    """
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self._value_bits = 64 - precision
+
+    def add(self, key: str):
+        """Adds one key, given as the JSON text of a value."""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        x = int.from_bytes(digest, 'big')
+        index = x >> self._value_bits
+        rank = self._value_bits - (x & ((1 << self._value_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> int:
+        """Returns the estimated number of distinct keys added so far."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small cardinalities are estimated more accurately by linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class TopK:
+    """
+    Misra-Gries heavy hitters: keeps at most 2 * `k` counters, so that every value whose
+    frequency exceeds n / (2 * k + 1) is kept. Counts are lower bounds, short of the
+    true frequency by at most `error`.
+    """
+
+    def __init__(self, k: int = DEFAULT_TOP_K):
+        self.k = k
+        self.capacity = 2 * k
+        self.counts: Dict[str, int] = {}
+        self.error = 0
+
+    def add(self, key: str, count: int = 1):
+        """Counts `count` more occurrences of `key`."""
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+            return
+        counts[key] = count
+        if len(counts) > self.capacity:
+            # Decrement every counter by the smallest one in a single sweep, so the
+            # sweep runs at most once per `capacity` new keys
+            floor = min(counts.values())
+            self.error += floor
+            self.counts = {key: c - floor for key, c in counts.items() if c > floor}
+
+    def items(self) -> List[Tuple[str, int]]:
+        """Returns the `k` most frequent (key, count) pairs, most frequent first."""
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:self.k]
+
+
+class NumericSummary:
+    """
+    Count, min, max and mean of a numeric field, with quantiles estimated from a
+    uniform reservoir sample of at most `sample_size` values. The quantiles are exact
+    as long as no more than `sample_size` values were seen.
+    """
+
+    def __init__(self, sample_size: int = DEFAULT_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.sample: List[float] = []
+        # Seeded so that profiling the same data twice gives the same digest
+        self._random = random.Random(0)
+
+    def add(self, value: float):
+        """Adds one numeric value."""
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self.sample) < self.sample_size:
+            self.sample.append(value)
+        else:
+            slot = self._random.randrange(self.count)
+            if slot < self.sample_size:
+                self.sample[slot] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the summary as a JSON-serializable dictionary."""
+        ordered = sorted(self.sample)
+        quantiles = {}
+        for q in QUANTILES:
+            quantiles[f"p{round(q * 100):02d}"] = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.total / self.count,
+            "quantiles": quantiles,
+            "exact_quantiles": self.count <= self.sample_size,
+        }
+
+
+def _value_sort_key(item: Tuple[Any, int]) -> Tuple[int, int, str]:
+    """Most frequent values first, ties broken like `summarize_field_values`."""
+    value, count = item
+    if value is None:
+        return (-count, 0, '')
+    return (-count, 1, str(value))
+
+
+class FieldProfile:
+    """
+    Profile of the values of one field.
+
+    Value frequencies are counted exactly until the field has more than
+    `exact_threshold` distinct values. The profile then switches to bounded sketches:
+    a HyperLogLog for the number of distinct values and Misra-Gries for the `top_k`
+    most frequent ones, both seeded with the exact counts gathered so far. Numeric
+    values are also summarized in a NumericSummary, whatever the cardinality.
+    """
+
+    def __init__(self, exact_threshold: int = DEFAULT_EXACT_THRESHOLD, top_k: int = DEFAULT_TOP_K):
+        self.exact_threshold = exact_threshold
+        self.top_k = top_k
+        self.count = 0
+        self.null_count = 0
+        self.exact: Optional[Dict[str, int]] = {}
+        self.distinct: Optional[HyperLogLog] = None
+        self.heavy_hitters: Optional[TopK] = None
+        self.numeric: Optional[NumericSummary] = None
+
+    def add(self, value: Any):
+        """Adds one value of the field."""
+        self.count += 1
+        if value is None:
+            self.null_count += 1
+        elif type(value) in (int, float) and not math.isnan(value):
+            if self.numeric is None:
+                self.numeric = NumericSummary()
+            self.numeric.add(value)
+
+        key = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        if self.exact is not None:
+            self.exact[key] = self.exact.get(key, 0) + 1
+            if len(self.exact) > self.exact_threshold:
+                self._switch_to_sketches()
+        else:
+            self.distinct.add(key)
+            self.heavy_hitters.add(key)
+
+    def _switch_to_sketches(self):
+        self.distinct = HyperLogLog()
+        self.heavy_hitters = TopK(self.top_k)
+        for key, count in self.exact.items():
+            self.distinct.add(key)
+            self.heavy_hitters.add(key, count)
+        self.exact = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the profile as a JSON-serializable dictionary: the number of values and
+        nulls, the (estimated) number of distinct values, the values with their counts,
+        most frequent first, and the numeric summary if the field had numbers.
+        """
+        profile = {"count": self.count, "null_count": self.null_count}
+        if self.exact is not None:
+            values = sorted(((json.loads(key), count) for key, count in self.exact.items()),
+                            key=_value_sort_key)
+            profile["distinct"] = len(values)
+            profile["exact"] = True
+            profile["values"] = [{"value": value, "count": count} for value, count in values]
+        else:
+            profile["distinct"] = self.distinct.estimate()
+            profile["exact"] = False
+            # Misra-Gries counts are lower bounds, short by at most "count_error"
+            profile["count_error"] = self.heavy_hitters.error
+            profile["values"] = [{"value": json.loads(key), "count": count}
+                                 for key, count in self.heavy_hitters.items()]
+        if self.numeric is not None:
+            profile["numeric"] = self.numeric.to_dict()
+        return profile
+
+
+def profile_field_values(
+    records: Iterable[Any],
+    exact_threshold: int = DEFAULT_EXACT_THRESHOLD,
+    top_k: int = DEFAULT_TOP_K,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Profiles the values of every field across a stream of records.
+
+    Memory is bounded per field by `exact_threshold` exact values, or by the sketches
+    once a field has more distinct values than that, however many records there are.
+
+    Args:
+        records (Iterable[Any]): Records to profile; non-dict records are ignored.
+        exact_threshold (int): Distinct values counted exactly per field before
+            switching to sketches.
+        top_k (int): Number of most frequent values kept once a field uses sketches.
+
+    Returns:
+        Dict[str, Dict[str, Any]]: The profile of each field (see `FieldProfile.to_dict`),
+        in the order the fields were first seen.
+    """
+    profiles: Dict[str, FieldProfile] = {}
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        for field, value in record.items():
+            profile = profiles.get(field)
+            if profile is None:
+                profile = profiles[field] = FieldProfile(exact_threshold, top_k)
+            profile.add(value)
+    return {field: profile.to_dict() for field, profile in profiles.items()}
+
+
+def profile_values(profile: Dict[str, Any]) -> List[Any]:
+    """Returns the values listed in a field profile, most frequent first."""
+    return [entry["value"] for entry in profile.get("values", [])]
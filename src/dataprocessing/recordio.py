@@ -0,0 +1,600 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from typing import Any, Iterator, List, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:  # msgpack is only needed for the msgpack format
+    msgpack = None
+
+_WHITESPACE = " \t\n\r"
+# Characters that may continue a number, e.g. after "1" or "1." at the end of a chunk
+_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Streams the elements of a top-level JSON array file one at a time.
+
+    The file is read in chunks and decoded incrementally, so memory is bounded by
+    the size of a single element rather than by the size of the whole file.
+
+    Args:
+        path (str): Path to a file containing a JSON array.
+        chunk_size (int): Number of characters to read from the file at a time.
+
+    Yields:
+        Any: Each decoded element of the array, in file order.
+
+    Raises:
+        ValueError: If the file does not contain a JSON array or is malformed.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        pos = 0
+        eof = False
+
+        def fill(min_size=chunk_size):
+            nonlocal buf, pos, eof
+            chunk = f.read(max(min_size, chunk_size))
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        skip_whitespace()
+        if pos >= len(buf) or buf[pos] != '[':
+            raise ValueError(f"{path} does not contain a JSON array.")
+        pos += 1
+
+        skip_whitespace()
+        if pos < len(buf) and buf[pos] == ']':
+            return
+
+        while True:
+            skip_whitespace()
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # A value followed by nothing but number characters up to the end of the
+                # buffer may be a truncated number: "3." decodes as 3, "1e" as 1.
+                if not eof:
+                    tail = end
+                    while tail < len(buf) and buf[tail] in _NUMBER_CHARS:
+                        tail += 1
+                    if tail >= len(buf):
+                        raise json.JSONDecodeError("Incomplete value", buf, end)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError(f"{path} contains malformed JSON.")
+                fill(len(buf) - pos)
+                continue
+            pos = end
+            yield value
+
+            skip_whitespace()
+            if pos >= len(buf):
+                raise ValueError(f"{path} ends before the JSON array is closed.")
+            if buf[pos] == ',':
+                pos += 1
+            elif buf[pos] == ']':
+                return
+            else:
+                raise ValueError(
+                    f"{path} contains malformed JSON near offset {pos}.")
+            if pos > chunk_size:
+                buf = buf[pos:]
+                pos = 0
+
+
+class _RecordWriter:
+    """
+    Base class of the streaming record writers.
+
+    Records are written to a temporary file next to `path`, which replaces `path` only
+    when the writer is closed successfully. Reading a file while rewriting it, as when a
+    step's input and output paths are the same, is therefore safe, and a failed run
+    never leaves a truncated output behind.
+
+    With `index`, the byte range of every record is recorded, and an offset index is
+    written next to the file when it is closed (see `RecordIndexBuilder`).
+    """
+
+    binary = False
+    fmt = ''
+
+    def __init__(self, path: str, index: bool = False):
+        self.path = path
+        self.count = 0
+        self._tmp_path = path + '.tmp'
+        self._index = RecordIndexBuilder(self.fmt) if index else None
+        self._offset = 0
+        if self.binary:
+            self._file = open(self._tmp_path, 'wb')
+        else:
+            # Untranslated newlines when indexing, so that offsets count the bytes written
+            self._file = open(self._tmp_path, 'w', encoding='utf-8', newline='' if index else None)
+
+    def write(self, record: Any):
+        raise NotImplementedError
+
+    def _finish(self):
+        """Writes whatever must follow the last record."""
+
+    def _add_to_index(self, record: Any, body: Any, before: int = 0, after: int = 0):
+        """Records the byte range of a record written as `before` bytes, `body`, then `after` bytes."""
+        if isinstance(body, bytes) or body.isascii():
+            size = len(body)
+        else:
+            size = len(body.encode('utf-8'))
+        start = self._offset + before
+        self._index.add(record, start, size)
+        self._offset = start + size + after
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._finish()
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        if self._index is not None:
+            self._index.write(self.path)
+
+    def abort(self):
+        """Discards everything written so far and leaves `path` untouched."""
+        if self._file.closed:
+            return
+        self._file.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonArrayWriter(_RecordWriter):
+    """
+    Writes records to a JSON array file one at a time.
+
+    The output is byte-identical to `json.dump(records, f, indent=2, ensure_ascii=False)`
+    but never holds more than one record in memory.
+    """
+
+    fmt = 'json'
+
+    def __init__(self, path: str, indent: int = 2, index: bool = False):
+        super().__init__(path, index)
+        self._pad = ' ' * indent
+        self._indent = indent
+
+    def write(self, record: Any):
+        text = json.dumps(record, indent=self._indent, ensure_ascii=False)
+        body = self._pad + text.replace('\n', '\n' + self._pad)
+        self._file.write((',\n' if self.count else '[\n') + body)
+        if self._index is not None:
+            self._add_to_index(record, body, before=2)
+        self.count += 1
+
+    def _finish(self):
+        self._file.write('[]' if self.count == 0 else '\n]')
+
+
+def iter_ndjson(path: str) -> Iterator[Any]:
+    """
+    Streams the records of a newline-delimited JSON file, one line at a time.
+
+    Args:
+        path (str): Path to a file with one JSON document per line.
+
+    Yields:
+        Any: Each decoded record, in file order.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class NdjsonWriter(_RecordWriter):
+    """
+    Writes records to a newline-delimited JSON file, one compact document per line.
+    """
+
+    fmt = 'ndjson'
+
+    def write(self, record: Any):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        self._file.write(line + '\n')
+        if self._index is not None:
+            self._add_to_index(record, line, after=1)
+        self.count += 1
+
+
+def _require_msgpack():
+    if msgpack is None:
+        raise ImportError(
+            "The msgpack format requires the 'msgpack' package: pip install msgpack")
+
+
+def iter_msgpack(path: str) -> Iterator[Any]:
+    """
+    Streams the records of a file of concatenated MessagePack documents.
+
+    Args:
+        path (str): Path to a file written by `MsgpackWriter`.
+
+    Yields:
+        Any: Each decoded record, in file order.
+    """
+    _require_msgpack()
+    with open(path, 'rb') as f:
+        yield from msgpack.Unpacker(f, raw=False, strict_map_key=False)
+
+
+class MsgpackWriter(_RecordWriter):
+    """
+    Writes records as a stream of MessagePack documents, one after the other.
+    """
+
+    binary = True
+    fmt = 'msgpack'
+
+    def __init__(self, path: str, index: bool = False):
+        _require_msgpack()
+        super().__init__(path, index)
+        self._packer = msgpack.Packer(use_bin_type=True)
+
+    def write(self, record: Any):
+        packed = self._packer.pack(record)
+        self._file.write(packed)
+        if self._index is not None:
+            self._add_to_index(record, packed)
+        self.count += 1
+
+
+# =============================================================================
+#  --- Format Selection ---
+# =============================================================================
+
+FORMATS = ('json', 'ndjson', 'msgpack')
+
+_EXTENSION_FORMATS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.msgpack': 'msgpack',
+    '.mpk': 'msgpack',
+}
+
+
+def detect_format(path: str) -> str:
+    """
+    Infers a record file's format from its extension: '.ndjson'/'.jsonl' for
+    newline-delimited JSON, '.msgpack'/'.mpk' for MessagePack and JSON otherwise.
+    """
+    return _EXTENSION_FORMATS.get(os.path.splitext(path)[1].lower(), 'json')
+
+
+def iter_records(path: str, fmt: Optional[str] = None) -> Iterator[Any]:
+    """
+    Streams the records of a file in any supported format.
+
+    Args:
+        path (str): Path to the record file.
+        fmt (Optional[str]): One of FORMATS; inferred from the extension if omitted.
+
+    Yields:
+        Any: Each record, in file order.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt == 'ndjson':
+        return iter_ndjson(path)
+    if fmt == 'msgpack':
+        return iter_msgpack(path)
+    if fmt == 'json':
+        return iter_json_array(path)
+    raise ValueError(f"Unknown record format: {fmt}")
+
+
+def open_record_writer(path: str, fmt: Optional[str] = None, index: bool = False) -> _RecordWriter:
+    """
+    Opens a streaming writer for a file in any supported format. Indented JSON is only
+    produced for the 'json' format, for exports meant to be read by people.
+
+    Args:
+        path (str): Path of the file to write.
+        fmt (Optional[str]): One of FORMATS; inferred from the extension if omitted.
+        index (bool): Also write an offset index to `path + INDEX_SUFFIX`, for
+            `IndexedRecordFile`.
+
+    Returns:
+        A writer with `write(record)`, `close()` and context manager support.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt == 'ndjson':
+        return NdjsonWriter(path, index=index)
+    if fmt == 'msgpack':
+        return MsgpackWriter(path, index=index)
+    if fmt == 'json':
+        return JsonArrayWriter(path, index=index)
+    raise ValueError(f"Unknown record format: {fmt}")
+
+
+
+# =============================================================================
+#  --- Offset Indexes ---
+# =============================================================================
+
+INDEX_SUFFIX = '.idx'
+_INDEX_MAGIC = b'RECIDX01'
+# Magic, format, record count, indexed id count, data file size and data file checksum
+_INDEX_HEADER = struct.Struct('<8s8sQQQQ')
+# Bytes at each end of the data file covered by the checksum in the index header
+_CHECKSUM_SPAN = 1 << 12
+
+
+def _data_checksum(data: Any, size: int) -> int:
+    """CRC-32 of the first and last bytes of a data file: cheap, and changes with a rewrite."""
+    return zlib.crc32(data[max(0, size - _CHECKSUM_SPAN):size], zlib.crc32(data[:_CHECKSUM_SPAN]))
+
+
+def _to_little_endian(values: array) -> bytes:
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class RecordIndexBuilder:
+    """
+    Collects the byte range and id of every record of a file, and writes its offset
+    index.
+
+    The index holds, in native arrays that a reader maps without parsing:
+
+    - the start and size of every record, in file order;
+    - the ids of the records, as UTF-8, sorted, each with the position of its record.
+
+    Records without a string `id` are only reachable by position. The ids are kept in
+    memory until the index is written, a few dozen bytes per record.
+    """
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.starts = array('Q')
+        self.sizes = array('I')
+        self.keys: List[Tuple[bytes, int]] = []
+
+    def add(self, record: Any, start: int, size: int):
+        if isinstance(record, dict):
+            record_id = record.get('id')
+            if isinstance(record_id, str):
+                self.keys.append((record_id.encode('utf-8'), len(self.starts)))
+        self.starts.append(start)
+        self.sizes.append(size)
+
+    def write(self, data_path: str, index_path: Optional[str] = None):
+        """Writes the index of `data_path`, once that file is complete."""
+        index_path = index_path or data_path + INDEX_SUFFIX
+        # Sorted by id, then by position, so the first of equal ids comes first
+        self.keys.sort()
+        key_starts = array('Q', [0])
+        ordinals = array('I')
+        total = 0
+        for key, ordinal in self.keys:
+            total += len(key)
+            key_starts.append(total)
+            ordinals.append(ordinal)
+        size = os.path.getsize(data_path)
+        with open(data_path, 'rb') as f:
+            if size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    checksum = _data_checksum(data, size)
+            else:
+                checksum = _data_checksum(b'', 0)
+        header = _INDEX_HEADER.pack(_INDEX_MAGIC, self.fmt.encode('ascii'), len(self.starts),
+                                    len(self.keys), size, checksum)
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            # The 8-byte arrays come first, so that every array is aligned on its item size
+            for part in (header, _to_little_endian(self.starts), _to_little_endian(key_starts),
+                         _to_little_endian(self.sizes), _to_little_endian(ordinals)):
+                f.write(part)
+            f.write(b''.join(key for key, _ in self.keys))
+        os.replace(tmp_path, index_path)
+
+
+class IndexedRecordFile:
+    """
+    Random access to the records of a file written with an offset index (see
+    `open_record_writer`): by position, by id, or by range of ids.
+
+    The data file and its index are memory-mapped. A lookup by id is a binary search
+    over the sorted ids of the index, then a decode of that one record, so its cost
+    does not depend on the size of the file and nothing else is read. `raw` returns the
+    bytes of a record as a view into the mapped file, without copying or decoding them.
+
+    Raises:
+        ValueError: If the index is not an offset index, or does not match the data
+            file, e.g. because the file was rewritten without it; see `build_index`.
+    """
+
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        self.path = path
+        self.index_path = index_path or path + INDEX_SUFFIX
+        with open(self.index_path, 'rb') as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, count, n_keys, size, checksum = _INDEX_HEADER.unpack_from(self._index)
+        if magic != _INDEX_MAGIC:
+            self._index.close()
+            raise ValueError(f"{self.index_path} is not a record offset index.")
+        self.fmt = fmt.rstrip(b'\0').decode('ascii')
+        if self.fmt == 'msgpack':
+            _require_msgpack()
+        with open(path, 'rb') as f:
+            actual_size = os.fstat(f.fileno()).st_size
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if actual_size else b''
+        if actual_size != size or _data_checksum(self._data, actual_size) != checksum:
+            self.close()
+            raise ValueError(f"{self.index_path} does not match {path}: rebuild it with build_index.")
+
+        self._count = count
+        self._n_keys = n_keys
+        view = memoryview(self._index)
+        position = _INDEX_HEADER.size
+        arrays = []
+        for typecode, length in (('Q', count), ('Q', n_keys + 1), ('I', count), ('I', n_keys)):
+            end = position + length * struct.calcsize(typecode)
+            if sys.byteorder == 'little':
+                arrays.append(view[position:end].cast(typecode))
+            else:
+                values = array(typecode, view[position:end])
+                values.byteswap()
+                arrays.append(values)
+            position = end
+        self._starts, self._key_starts, self._sizes, self._ordinals = arrays
+        self._keys_offset = position
+        view.release()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _span(self, position: int) -> Tuple[int, int]:
+        """Returns the start and end offsets of the record at a position, counting from the end if negative."""
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError(f"record position out of range for {self._count} records")
+        start = self._starts[position]
+        return start, start + self._sizes[position]
+
+    def raw(self, position: int) -> memoryview:
+        """Returns the encoded record at a position in the file, as a view into the mapped file."""
+        start, end = self._span(position)
+        return memoryview(self._data)[start:end]
+
+    def record(self, position: int) -> Any:
+        """Returns the decoded record at a position in the file (0 for the first record)."""
+        start, end = self._span(position)
+        encoded = self._data[start:end]
+        if self.fmt == 'msgpack':
+            return msgpack.unpackb(encoded, raw=False, strict_map_key=False)
+        return json.loads(encoded)
+
+    def __iter__(self) -> Iterator[Any]:
+        for position in range(self._count):
+            yield self.record(position)
+
+    def _key(self, i: int) -> bytes:
+        offset = self._keys_offset
+        return self._index[offset + self._key_starts[i]:offset + self._key_starts[i + 1]]
+
+    def _lower_bound(self, key: bytes) -> int:
+        """Returns the first place among the sorted ids whose id is not below `key`."""
+        lo, hi = 0, self._n_keys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def position(self, record_id: str) -> Optional[int]:
+        """Returns the position of the first record with an id, or None if there is none."""
+        key = record_id.encode('utf-8')
+        i = self._lower_bound(key)
+        if i < self._n_keys and self._key(i) == key:
+            return self._ordinals[i]
+        return None
+
+    def get(self, record_id: str, default: Any = None) -> Any:
+        """Returns the first record with an id, or `default` if there is none."""
+        position = self.position(record_id)
+        return default if position is None else self.record(position)
+
+    def __contains__(self, record_id: str) -> bool:
+        return self.position(record_id) is not None
+
+    def range(self, start: Optional[str] = None, stop: Optional[str] = None) -> Iterator[Any]:
+        """
+        Yields the records whose id is at least `start` and below `stop`, in id order.
+        Either bound may be omitted.
+        """
+        lo = self._lower_bound(start.encode('utf-8')) if start is not None else 0
+        hi = self._lower_bound(stop.encode('utf-8')) if stop is not None else self._n_keys
+        for i in range(lo, hi):
+            yield self.record(self._ordinals[i])
+
+    def close(self):
+        """Unmaps the files. Views returned by `raw` must be released first."""
+        for name in ('_starts', '_key_starts', '_sizes', '_ordinals'):
+            values = getattr(self, name, None)
+            if isinstance(values, memoryview):
+                values.release()
+        for mapped in (self._index, getattr(self, '_data', None)):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def build_index(path: str, fmt: Optional[str] = None) -> int:
+    """
+    Writes the offset index of an existing NDJSON or MessagePack file, e.g. one written
+    before indexes were turned on. JSON array files can only be indexed as they are
+    written.
+
+    Args:
+        path (str): Path of the record file.
+        fmt (Optional[str]): 'ndjson' or 'msgpack'; inferred from the extension if omitted.
+
+    Returns:
+        int: The number of records indexed.
+    """
+    fmt = fmt or detect_format(path)
+    builder = RecordIndexBuilder(fmt)
+    if fmt == 'ndjson':
+        with open(path, 'rb') as f:
+            offset = 0
+            for line in f:
+                body = line.rstrip(b'\r\n')
+                if body.strip():
+                    builder.add(json.loads(body), offset, len(body))
+                offset += len(line)
+    elif fmt == 'msgpack':
+        _require_msgpack()
+        with open(path, 'rb') as f:
+            unpacker = msgpack.Unpacker(f, raw=False, strict_map_key=False)
+            offset = 0
+            for record in unpacker:
+                end = unpacker.tell()
+                builder.add(record, offset, end - offset)
+                offset = end
+    else:
+        raise ValueError(f"Only NDJSON and MessagePack files can be indexed after they are "
+                         f"written, not {fmt}: rewrite {path} with an index instead.")
+    builder.write(path)
+    return len(builder.starts)
@@ -0,0 +1,411 @@
+import json
+import os
+import sys
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataprocessing.grouping import grouping_ops
+
+TAG_ENCODINGS = ("ids", "bitset")
+DEFAULT_TAG_ENCODING = "ids"
+DEFAULT_TAG_SEPARATOR = ","
+
+if hasattr(int, "bit_count"):
+    _popcount = int.bit_count
+else:  # Python < 3.10
+    def _popcount(bits: int) -> int:
+        return bin(bits).count("1")
+
+
+def split_tags(value: Any, separator: str = DEFAULT_TAG_SEPARATOR) -> Optional[List[str]]:
+    """
+    Returns the tags of a field value: a joined string such as "a,b,c", or a list already
+    split by the normalization map. Tags are stripped either way, and blank ones dropped;
+    None stays None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return [tag for tag in (part.strip() for part in value.split(separator)) if tag]
+    if isinstance(value, list):
+        return [tag for tag in (item.strip() for item in value if isinstance(item, str)) if tag]
+    raise ValueError(f"Expected a string or a list of tags, got {type(value).__name__}")
+
+
+class TagVocabulary:
+    """
+    The interned tags of one field, each with a small integer id: its position.
+
+    The vocabulary only ever grows, so the id of a tag, and the bit it sets in a
+    bitset, stays the same from run to run and in every document already loaded.
+    """
+
+    def __init__(self, tags: Iterable[str] = ()):
+        self.tags: List[str] = []
+        self.ids: Dict[str, int] = {}
+        for tag in tags:
+            self.add(tag)
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.ids
+
+    def add(self, tag: str) -> int:
+        """Returns the id of a tag, giving it the next id if it is new."""
+        tag_id = self.ids.get(tag)
+        if tag_id is None:
+            tag = sys.intern(tag)
+            tag_id = self.ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return tag_id
+
+    def encode_ids(self, tags: Iterable[str]) -> List[int]:
+        """Returns the sorted ids of a set of tags; repeated tags count once."""
+        return sorted({self.add(tag) for tag in tags})
+
+    def encode_bitset(self, tags: Iterable[str]) -> int:
+        """Returns a set of tags as an integer whose bit `id` is set for each tag."""
+        bits = 0
+        for tag in tags:
+            bits |= 1 << self.add(tag)
+        return bits
+
+    def decode_ids(self, ids: Iterable[int]) -> List[str]:
+        tags = self.tags
+        return [tags[tag_id] for tag_id in ids]
+
+    def decode_bitset(self, bits: int) -> List[str]:
+        """Returns the tags of a bitset, in id order."""
+        return self.decode_ids(bit_positions(bits))
+
+
+def bit_positions(bits: int) -> List[int]:
+    """Returns the positions of the set bits of a non-negative integer, lowest first."""
+    positions = []
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            positions.append(byte_index * 8 + low.bit_length() - 1)
+            byte ^= low
+    return positions
+
+
+def load_vocabularies(path: str) -> Dict[str, TagVocabulary]:
+    """Loads the vocabularies saved by `save_vocabularies`, or none if the file does not exist."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return {field: TagVocabulary(tags) for field, tags in data.get("fields", {}).items()}
+
+
+def save_vocabularies(path: str, vocabularies: Dict[str, TagVocabulary]):
+    """Writes the vocabularies as {"fields": {field: [tag of id 0, tag of id 1, ...]}}."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"fields": {field: vocabulary.tags for field, vocabulary in vocabularies.items()}},
+                  f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class TagCollector:
+    """
+    Counts the tags of some fields while records stream past, e.g. during field value
+    collection, then adds the new ones to vocabularies, most frequent first, so that the
+    most common tags get the lowest ids and the smallest bitsets.
+    """
+
+    def __init__(self, fields: Iterable[str], separator: str = DEFAULT_TAG_SEPARATOR):
+        self.separator = separator
+        self.counts: Dict[str, Counter] = {field: Counter() for field in fields}
+
+    def observe(self, records: Iterable[Any]) -> Iterator[Any]:
+        """Yields the records unchanged, counting their tags."""
+        counts = self.counts
+        separator = self.separator
+        for record in records:
+            if isinstance(record, dict):
+                for field, counter in counts.items():
+                    tags = split_tags(record.get(field), separator)
+                    if tags:
+                        counter.update(set(tags))
+            yield record
+
+    def update(self, vocabularies: Dict[str, TagVocabulary]) -> int:
+        """Adds the tags seen to `vocabularies`, and returns how many were new."""
+        added = 0
+        for field, counter in self.counts.items():
+            vocabulary = vocabularies.setdefault(field, TagVocabulary())
+            before = len(vocabulary)
+            for tag, _ in sorted(counter.items(), key=lambda item: (-item[1], item[0])):
+                vocabulary.add(tag)
+            added += len(vocabulary) - before
+        return added
+
+
+class TagCodec:
+    """
+    Encodes the tag fields of grouped records, and decodes them back to string lists.
+
+    Each tag field, found at its path in the grouped record (see
+    `grouping.grouping_ops`), becomes either the sorted ids of its tags ("ids") or
+    a bitset integer ("bitset") in the field's vocabulary. Tags not in the vocabulary
+    yet are added to it, so the vocabulary must be saved after encoding. Decoding
+    returns the tags in id order: the order of the original string is not kept.
+    """
+
+    def __init__(
+        self,
+        fields: List[str],
+        grouping_config: Dict[str, Any],
+        vocabularies: Optional[Dict[str, TagVocabulary]] = None,
+        encoding: str = DEFAULT_TAG_ENCODING,
+        separator: str = DEFAULT_TAG_SEPARATOR,
+    ):
+        if encoding not in TAG_ENCODINGS:
+            raise ValueError(f"Unknown tag encoding '{encoding}', expected one of {', '.join(TAG_ENCODINGS)}")
+        sources = {source: path for path, source in grouping_ops(grouping_config) if source is not None}
+        missing = [field for field in fields if field not in sources]
+        if missing:
+            raise ValueError(f"Tag field(s) {', '.join(missing)} are not in the grouping configuration")
+        self.paths: List[Tuple[str, Tuple[str, ...]]] = [(field, sources[field]) for field in fields]
+        self.vocabularies = vocabularies if vocabularies is not None else {}
+        for field in fields:
+            self.vocabularies.setdefault(field, TagVocabulary())
+        self.encoding = encoding
+        self.separator = separator
+
+    @staticmethod
+    def _parent(record: Dict[str, Any], path: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        for key in path[:-1]:
+            record = record.get(key)
+            if not isinstance(record, dict):
+                return None
+        return record
+
+    def encode(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Encodes the tag fields of a grouped record in place, and returns it."""
+        for field, path in self.paths:
+            parent = self._parent(record, path)
+            if parent is None or path[-1] not in parent:
+                continue
+            tags = split_tags(parent[path[-1]], self.separator)
+            if tags is None:
+                continue
+            vocabulary = self.vocabularies[field]
+            if self.encoding == "ids":
+                parent[path[-1]] = vocabulary.encode_ids(tags)
+            else:
+                parent[path[-1]] = vocabulary.encode_bitset(tags)
+        return record
+
+    def decode(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Turns the encoded tag fields of a grouped record back into string lists, in place."""
+        for field, path in self.paths:
+            parent = self._parent(record, path)
+            if parent is None or parent.get(path[-1]) is None:
+                continue
+            value = parent[path[-1]]
+            vocabulary = self.vocabularies[field]
+            if isinstance(value, int):
+                parent[path[-1]] = vocabulary.decode_bitset(value)
+            else:
+                parent[path[-1]] = vocabulary.decode_ids(value)
+        return record
+
+    def tag_ids(self, record: Dict[str, Any], field: str) -> List[int]:
+        """Returns the tag ids of one field of an encoded record, whichever the encoding."""
+        path = dict(self.paths)[field]
+        parent = self._parent(record, path)
+        value = parent.get(path[-1]) if parent is not None else None
+        if value is None:
+            return []
+        return bit_positions(value) if isinstance(value, int) else list(value)
+
+
+def tag_encoding_stage(records: Iterable[Dict[str, Any]], codec: TagCodec) -> Iterator[Dict[str, Any]]:
+    """Encodes the tag fields of each grouped record (see `TagCodec`)."""
+    encode = codec.encode
+    for record in records:
+        yield encode(record)
+
+
+def make_tag_codec(settings: Optional[Dict[str, Any]], grouping_config: Dict[str, Any],
+                   vocabulary_path: Optional[str] = None) -> Optional[TagCodec]:
+    """
+    Builds a TagCodec from the "tags" section of config.json, with the vocabularies saved
+    at `vocabulary_path`, or returns None if the section is missing or not enabled.
+    """
+    if not settings or not settings.get("enabled", False):
+        return None
+    vocabularies = load_vocabularies(vocabulary_path) if vocabulary_path else {}
+    return TagCodec(settings.get("fields", []), grouping_config, vocabularies,
+                    settings.get("encoding", DEFAULT_TAG_ENCODING),
+                    settings.get("separator", DEFAULT_TAG_SEPARATOR))
+
+
+def load_tag_codec(config_path: str) -> Optional[TagCodec]:
+    """
+    Builds the TagCodec of a config.json file, with its grouping configuration and saved
+    vocabularies, or returns None if tag encoding is not enabled there.
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    data_paths = config["dataPaths"]
+    with open(data_paths["groupingConfigPath"], 'r', encoding='utf-8') as f:
+        grouping_config = json.load(f)
+    return make_tag_codec(config.get("tags"), grouping_config, data_paths.get("tagVocabularyPath"))
+
+
+class TagIndex:
+    """
+    One bitmap per tag over the records of a dataset: bit i of a tag's bitmap is set
+    when record i has the tag. Membership, co-occurrence and counting queries over the
+    whole dataset are then ANDs, ORs and popcounts of a few integers.
+    """
+
+    def __init__(self, vocabulary: TagVocabulary):
+        self.vocabulary = vocabulary
+        self.count = 0
+        self.record_ids: List[Any] = []
+        self._positions: List[List[int]] = []
+        self._bitmaps: Optional[List[int]] = None
+
+    def add(self, tag_ids: Iterable[int], record_id: Any = None):
+        """Adds the next record, by the ids of its tags."""
+        for tag_id in tag_ids:
+            while tag_id >= len(self._positions):
+                self._positions.append([])
+            self._positions[tag_id].append(self.count)
+        self.record_ids.append(record_id)
+        self.count += 1
+        self._bitmaps = None
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]], codec: TagCodec, field: str) -> "TagIndex":
+        """Builds the index of one tag field over a stream of encoded grouped records."""
+        index = cls(codec.vocabularies[field])
+        for record in records:
+            index.add(codec.tag_ids(record, field), record.get("id"))
+        return index
+
+    @property
+    def bitmaps(self) -> List[int]:
+        if self._bitmaps is None:
+            size = (self.count + 7) // 8
+            bitmaps = []
+            # Set bits in a buffer, then convert once: OR-ing bits into an integer one
+            # at a time would copy it for every record
+            for positions in self._positions:
+                buffer = bytearray(size)
+                for position in positions:
+                    buffer[position >> 3] |= 1 << (position & 7)
+                bitmaps.append(int.from_bytes(buffer, "little"))
+            self._bitmaps = bitmaps
+        return self._bitmaps
+
+    def bitmap(self, tag: str) -> int:
+        """Returns the bitmap of the records with a tag; 0 for an unknown tag."""
+        tag_id = self.vocabulary.ids.get(tag)
+        bitmaps = self.bitmaps
+        return bitmaps[tag_id] if tag_id is not None and tag_id < len(bitmaps) else 0
+
+    def select(self, all_of: Iterable[str] = (), any_of: Iterable[str] = (),
+               none_of: Iterable[str] = ()) -> int:
+        """Returns the bitmap of the records with every tag of `all_of`, at least one of
+        `any_of` (if given) and none of `none_of`."""
+        selected = (1 << self.count) - 1
+        for tag in all_of:
+            selected &= self.bitmap(tag)
+        any_of = list(any_of)
+        if any_of:
+            matches = 0
+            for tag in any_of:
+                matches |= self.bitmap(tag)
+            selected &= matches
+        for tag in none_of:
+            selected &= ~self.bitmap(tag)
+        return selected
+
+    @staticmethod
+    def size(bitmap: int) -> int:
+        """Returns the number of records in a bitmap."""
+        return _popcount(bitmap)
+
+    def records(self, bitmap: int) -> List[Any]:
+        """Returns the ids of the records in a bitmap, in dataset order."""
+        return [self.record_ids[position] for position in bit_positions(bitmap)]
+
+    def cooccurrence(self, tag: str, other: str) -> int:
+        """Returns the number of records with both tags."""
+        return _popcount(self.bitmap(tag) & self.bitmap(other))
+
+    def top_cooccurring(self, tag: str, k: int = 10) -> List[Tuple[str, int]]:
+        """Returns the `k` tags found most often with `tag`, with their counts."""
+        base = self.bitmap(tag)
+        counts = []
+        for tag_id, bitmap in enumerate(self.bitmaps):
+            other = self.vocabulary.tags[tag_id]
+            if other != tag:
+                count = _popcount(base & bitmap)
+                if count:
+                    counts.append((other, count))
+        counts.sort(key=lambda item: (-item[1], item[0]))
+        return counts[:k]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from dataprocessing.recordio import iter_records, open_record_writer
+
+    parser = argparse.ArgumentParser(description="Decode or query the encoded tag fields of grouped records.")
+    parser.add_argument("--config", default="pipeline-setup/config.json", help="Path to config.json.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_decode = subparsers.add_parser("decode", help="Write a copy of a grouped file with tags as string lists.")
+    parser_decode.add_argument("input_file", help="Grouped records with encoded tags.")
+    parser_decode.add_argument("--output", required=True, help="Path of the decoded copy.")
+    parser_query = subparsers.add_parser("query", help="Count the records with some tags.")
+    parser_query.add_argument("input_file", help="Grouped records with encoded tags.")
+    parser_query.add_argument("--field", help="Tag field (default: the first configured one).")
+    parser_query.add_argument("--all", default="", help="Comma-separated tags every record must have.")
+    parser_query.add_argument("--any", default="", help="Comma-separated tags of which a record needs one.")
+    parser_query.add_argument("--none", default="", help="Comma-separated tags no record may have.")
+    parser_query.add_argument("--ids", action="store_true", help="Also print the ids of the records.")
+    parser_query.add_argument("--cooccurring", type=int, default=0, metavar="K",
+                              help="Also print the K tags most often found with the first --all tag.")
+    args = parser.parse_args()
+
+    codec = load_tag_codec(args.config)
+    if codec is None:
+        parser.error(f"Tag encoding is not enabled in {args.config}")
+
+    if args.command == "decode":
+        with open_record_writer(args.output) as writer:
+            for record in iter_records(args.input_file):
+                writer.write(codec.decode(record))
+        print(f"Wrote {writer.count} decoded records to {args.output}")
+    else:
+        field = args.field or codec.paths[0][0]
+        index = TagIndex.from_records(iter_records(args.input_file), codec, field)
+
+        def tag_list(text):
+            return [tag for tag in text.split(",") if tag]
+        selected = index.select(tag_list(args.all), tag_list(args.any), tag_list(args.none))
+        print(f"{index.size(selected)} of {index.count} records match.")
+        if args.ids:
+            print("\n".join(str(record_id) for record_id in index.records(selected)))
+        if args.cooccurring and tag_list(args.all):
+            tag = tag_list(args.all)[0]
+            for other, count in index.top_cooccurring(tag, args.cooccurring):
+                print(f"  {other}: {count}")
@@ -0,0 +1,591 @@
+import datetime
+import json
+import os
+import re
+import sys
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataprocessing.recordio import NdjsonWriter, iter_records
+
+# Formats asserted unless told otherwise; "uuid" is left out because legacy ids are not
+# RFC 4122 UUIDs (see ids.ID_FORMATS)
+DEFAULT_ASSERT_FORMATS = ("date", "date-time")
+VALIDATION_ACTIONS = ("quarantine", "report")
+# Distinct error paths kept in the summary of a run
+MAX_REPORTED_PATHS = 20
+
+# (JSON pointer of the invalid value, message) of one validation error
+ValidationError = Tuple[str, str]
+
+# Keywords that never fail validation
+_ANNOTATIONS = {"$schema", "$id", "$comment", "title", "description", "default", "examples",
+                "definitions", "readOnly", "writeOnly", "contentMediaType", "contentEncoding"}
+_TYPE_CHECKS = {
+    "string": "isinstance({v}, str)",
+    "integer": "(type({v}) is int or (type({v}) is float and {v}.is_integer()))",
+    "number": "type({v}) in (int, float)",
+    "boolean": "({v} is True or {v} is False)",
+    "null": "{v} is None",
+    "array": "isinstance({v}, list)",
+    "object": "isinstance({v}, dict)",
+}
+# The keywords of each group only apply to values of the listed types
+_NUMBER_KEYWORDS = ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum", "multipleOf")
+_STRING_KEYWORDS = ("minLength", "maxLength", "pattern", "format")
+_ARRAY_KEYWORDS = ("items", "additionalItems", "minItems", "maxItems", "uniqueItems", "contains")
+_OBJECT_KEYWORDS = ("properties", "required", "additionalProperties", "patternProperties",
+                    "minProperties", "maxProperties", "propertyNames", "dependencies")
+_COMBINATORS = ("allOf", "anyOf", "oneOf", "not", "if", "then", "else")
+_KNOWN = (set(_NUMBER_KEYWORDS) | set(_STRING_KEYWORDS) | set(_ARRAY_KEYWORDS) | set(_OBJECT_KEYWORDS)
+          | set(_COMBINATORS) | {"type", "enum", "const", "$ref"} | _ANNOTATIONS)
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_DATE_TIME = re.compile(r"\d{4}-\d{2}-\d{2}[Tt ]\d{2}:\d{2}:\d{2}(\.\d+)?([Zz]|[+-]\d{2}:\d{2})")
+_UUID = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+_EMAIL = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+
+
+def _is_date(value: str) -> bool:
+    # fromisoformat also takes "20240101" and week dates such as "2024-W01-1"
+    if _DATE.fullmatch(value) is None:
+        return False
+    try:
+        datetime.date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+FORMAT_CHECKS: Dict[str, Callable[[str], bool]] = {
+    "date": _is_date,
+    "date-time": lambda value: _DATE_TIME.fullmatch(value) is not None,
+    "uuid": lambda value: _UUID.fullmatch(value) is not None,
+    "email": lambda value: _EMAIL.fullmatch(value) is not None,
+}
+
+
+def json_pointer(path: Sequence[Any]) -> str:
+    """Returns the JSON pointer of a path of keys and indexes, "" for the document itself."""
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in path)
+
+
+def _json_key(value: Any) -> Any:
+    """
+    A hashable key equal for JSON-equal values: in Python True == 1, while JSON numbers
+    are equal by value at any depth, so 1 and 1.0 are, and true and 1 are not.
+    """
+    if isinstance(value, bool):
+        return ("bool", value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        return ("array", tuple(map(_json_key, value)))
+    if isinstance(value, dict):
+        return ("object", tuple(sorted((key, _json_key(item)) for key, item in value.items())))
+    return value
+
+
+def _json_equal(a: Any, b: Any) -> bool:
+    return _json_key(a) == _json_key(b)
+
+
+def _matches(func: Callable[..., None], value: Any) -> bool:
+    errors: List[ValidationError] = []
+    func(value, (), errors)
+    return not errors
+
+
+def _unique(items: List[Any]) -> bool:
+    seen = set()
+    for item in items:
+        key = _json_key(item)
+        if key in seen:
+            return False
+        seen.add(key)
+    return True
+
+
+class _SchemaCompiler:
+    """Generates the Python source of a validator, one schema node at a time."""
+
+    def __init__(self, root: Any, assert_formats: Iterable[str]):
+        self.root = root
+        self.assert_formats = set(assert_formats)
+        unknown = self.assert_formats - set(FORMAT_CHECKS)
+        if unknown:
+            raise ValueError(f"Unknown format(s) {', '.join(sorted(unknown))}; "
+                             f"the known formats are: {', '.join(FORMAT_CHECKS)}")
+        self.namespace: Dict[str, Any] = {
+            "_MISSING": object(), "_json_equal": _json_equal, "_matches": _matches,
+            "_unique": _unique,
+        }
+        self.functions: List[List[str]] = []
+        self.refs: Dict[str, str] = {}
+        self.counter = 0
+
+    def _name(self, prefix: str) -> str:
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def constant(self, value: Any, prefix: str = "_c") -> str:
+        name = self._name(prefix)
+        self.namespace[name] = value
+        return name
+
+    def function(self, schema: Any, location: str, name: Optional[str] = None) -> str:
+        """Generates a function validating `data` against a schema node, and returns its name."""
+        name = name or self._name("_node")
+        lines = [f"def {name}(data, path, errors):"]
+        self.functions.append(lines)
+        body = self.node(schema, "data", [("var", "path")], 1, location)
+        lines.extend(body or ["    pass"])
+        return name
+
+    def ref_function(self, ref: str) -> str:
+        if ref not in self.refs:
+            if not ref.startswith("#"):
+                raise ValueError(f"Only local $ref are supported, got '{ref}'")
+            target = self.root
+            for part in ref[1:].split("/")[1:]:
+                part = part.replace("~1", "/").replace("~0", "~")
+                try:
+                    target = target[int(part)] if isinstance(target, list) else target[part]
+                except (KeyError, IndexError, ValueError):
+                    raise ValueError(f"$ref '{ref}' does not resolve in the schema") from None
+            # Named before its body is generated, so that a recursive $ref finds it
+            self.refs[ref] = self._name("_ref")
+            self.function(target, ref, self.refs[ref])
+        return self.refs[ref]
+
+    @staticmethod
+    def path_source(path: List[Tuple[str, Any]]) -> str:
+        """Python source of a path tuple, built only when an error is reported."""
+        parts = []
+        for kind, value in path:
+            if kind == "var" and value == "path":
+                continue
+            parts.append(value if kind == "var" else repr(value))
+        literal = "(" + "".join(part + ", " for part in parts) + ")"
+        return f"path + {literal}" if parts else "path"
+
+    def error(self, path: List[Tuple[str, Any]], message: str, pad: str, detail: str = "") -> str:
+        text = repr(message) if not detail else f"{message!r} + {detail}"
+        return f"{pad}errors.append(({self.path_source(path)}, {text}))"
+
+    def node(self, schema: Any, v: str, path: List[Tuple[str, Any]], depth: int, location: str) -> List[str]:
+        """Returns the statements validating the value in variable `v` against a schema node."""
+        pad = "    " * depth
+        if schema is True or schema == {}:
+            return []
+        if schema is False:
+            return [self.error(path, "is not allowed", pad)]
+        if not isinstance(schema, dict):
+            raise ValueError(f"{location or '#'}: a schema must be an object or a boolean")
+        unknown = set(schema) - _KNOWN
+        if unknown:
+            raise ValueError(f"{location or '#'}: unsupported keyword(s) {', '.join(sorted(unknown))}")
+
+        lines: List[str] = []
+        if "$ref" in schema:
+            # As in draft-07, the keywords next to a $ref are ignored
+            return [f"{pad}{self.ref_function(schema['$ref'])}({v}, {self.path_source(path)}, errors)"]
+
+        types = schema.get("type")
+        if isinstance(types, str):
+            types = [types]
+        body_depth = depth
+        if types is not None:
+            unknown_types = set(types) - set(_TYPE_CHECKS)
+            if unknown_types:
+                raise ValueError(f"{location or '#'}: unknown type(s) {', '.join(sorted(unknown_types))}")
+            check = " or ".join(_TYPE_CHECKS[t].format(v=v) for t in types)
+            lines.append(f"{pad}if not ({check}):")
+            lines.append(self.error(path, f"must be of type {' or '.join(types)}", pad + "    "))
+            lines.append(f"{pad}else:")
+            body_depth = depth + 1
+        body = self.keywords(schema, types, v, path, body_depth, location)
+        if types is not None:
+            lines.extend(body or [f"{pad}    pass"])
+            return lines
+        return body
+
+    def _guard(self, allowed: Sequence[str], types: Optional[List[str]], check: str,
+               body: List[str], depth: int) -> List[str]:
+        """Runs type-specific checks only on values of that type, unless `type` implies it."""
+        if not body:
+            return []
+        if types is not None and set(types) <= set(allowed):
+            return body
+        pad = "    " * depth
+        return [f"{pad}if {check}:"] + ["    " + line for line in body]
+
+    def keywords(self, schema: Dict[str, Any], types: Optional[List[str]], v: str,
+                 path: List[Tuple[str, Any]], depth: int, location: str) -> List[str]:
+        pad = "    " * depth
+        lines: List[str] = []
+        if "enum" in schema:
+            values = schema["enum"]
+            if all(isinstance(value, str) for value in values):
+                name = self.constant(frozenset(values))
+                lines.append(f"{pad}if not isinstance({v}, str) or {v} not in {name}:")
+            else:
+                name = self.constant(list(values))
+                lines.append(f"{pad}if not any(_json_equal({v}, value) for value in {name}):")
+            lines.append(self.error(path, f"must be one of {values!r}", pad + "    "))
+        if "const" in schema:
+            name = self.constant(schema["const"])
+            lines.append(f"{pad}if not _json_equal({v}, {name}):")
+            lines.append(self.error(path, f"must be {schema['const']!r}", pad + "    "))
+
+        number = []
+        for keyword, op, text in (("minimum", "<", "must be >= "), ("maximum", ">", "must be <= "),
+                                  ("exclusiveMinimum", "<=", "must be > "),
+                                  ("exclusiveMaximum", ">=", "must be < ")):
+            if keyword in schema:
+                number.append(f"{pad}if {v} {op} {schema[keyword]!r}:")
+                number.append(self.error(path, f"{text}{schema[keyword]}", pad + "    "))
+        if "multipleOf" in schema:
+            number.append(f"{pad}if ({v} / {schema['multipleOf']!r}) % 1:")
+            number.append(self.error(path, f"must be a multiple of {schema['multipleOf']}", pad + "    "))
+        lines += self._guard(("integer", "number"), types, f"type({v}) in (int, float)", number, depth)
+
+        string = []
+        if "minLength" in schema:
+            string.append(f"{pad}if len({v}) < {schema['minLength']}:")
+            string.append(self.error(path, f"must be at least {schema['minLength']} characters", pad + "    "))
+        if "maxLength" in schema:
+            string.append(f"{pad}if len({v}) > {schema['maxLength']}:")
+            string.append(self.error(path, f"must be at most {schema['maxLength']} characters", pad + "    "))
+        if "pattern" in schema:
+            name = self.constant(re.compile(schema["pattern"]), "_re")
+            string.append(f"{pad}if {name}.search({v}) is None:")
+            string.append(self.error(path, f"must match {schema['pattern']!r}", pad + "    "))
+        if schema.get("format") in self.assert_formats:
+            name = self.constant(FORMAT_CHECKS[schema["format"]], "_format")
+            string.append(f"{pad}if not {name}({v}):")
+            string.append(self.error(path, f"must be a valid {schema['format']}", pad + "    "))
+        lines += self._guard(("string",), types, f"isinstance({v}, str)", string, depth)
+
+        lines += self._guard(("array",), types, f"isinstance({v}, list)",
+                             self.array_keywords(schema, v, path, depth, location), depth)
+        lines += self._guard(("object",), types, f"isinstance({v}, dict)",
+                             self.object_keywords(schema, v, path, depth, location), depth)
+        lines += self.combinators(schema, v, path, depth, location)
+        return lines
+
+    def array_keywords(self, schema: Dict[str, Any], v: str, path: List[Tuple[str, Any]],
+                       depth: int, location: str) -> List[str]:
+        pad = "    " * depth
+        lines: List[str] = []
+        if "minItems" in schema:
+            lines.append(f"{pad}if len({v}) < {schema['minItems']}:")
+            lines.append(self.error(path, f"must have at least {schema['minItems']} items", pad + "    "))
+        if "maxItems" in schema:
+            lines.append(f"{pad}if len({v}) > {schema['maxItems']}:")
+            lines.append(self.error(path, f"must have at most {schema['maxItems']} items", pad + "    "))
+        if schema.get("uniqueItems"):
+            lines.append(f"{pad}if not _unique({v}):")
+            lines.append(self.error(path, "must have unique items", pad + "    "))
+        items = schema.get("items")
+        if isinstance(items, list):
+            for index, item_schema in enumerate(items):
+                item = self._name("item")
+                body = self.node(item_schema, item, path + [("lit", index)], depth + 1,
+                                 f"{location}/items/{index}")
+                if body:
+                    lines.append(f"{pad}if len({v}) > {index}:")
+                    lines.append(f"{pad}    {item} = {v}[{index}]")
+                    lines.extend(body)
+            extra = schema.get("additionalItems", True)
+            if extra is not True:
+                index, item = self._name("i"), self._name("item")
+                body = self.node(extra, item, path + [("var", index)], depth + 1,
+                                 f"{location}/additionalItems")
+                if body:
+                    lines.append(f"{pad}for {index}, {item} in enumerate({v}[{len(items)}:], {len(items)}):")
+                    lines.extend(body)
+        elif items is not None:
+            index, item = self._name("i"), self._name("item")
+            body = self.node(items, item, path + [("var", index)], depth + 1, f"{location}/items")
+            if body:
+                lines.append(f"{pad}for {index}, {item} in enumerate({v}):")
+                lines.extend(body)
+        if "contains" in schema:
+            name = self.function(schema["contains"], f"{location}/contains")
+            lines.append(f"{pad}if not any(_matches({name}, item) for item in {v}):")
+            lines.append(self.error(path, "must contain a matching item", pad + "    "))
+        return lines
+
+    def object_keywords(self, schema: Dict[str, Any], v: str, path: List[Tuple[str, Any]],
+                        depth: int, location: str) -> List[str]:
+        pad = "    " * depth
+        lines: List[str] = []
+        for name in schema.get("required", []):
+            lines.append(f"{pad}if {name!r} not in {v}:")
+            lines.append(self.error(path, f"is missing required property '{name}'", pad + "    "))
+        if "minProperties" in schema:
+            lines.append(f"{pad}if len({v}) < {schema['minProperties']}:")
+            lines.append(self.error(path, f"must have at least {schema['minProperties']} properties", pad + "    "))
+        if "maxProperties" in schema:
+            lines.append(f"{pad}if len({v}) > {schema['maxProperties']}:")
+            lines.append(self.error(path, f"must have at most {schema['maxProperties']} properties", pad + "    "))
+        properties = schema.get("properties", {})
+        for name, property_schema in properties.items():
+            value = self._name("value")
+            body = self.node(property_schema, value, path + [("lit", name)], depth + 1,
+                             f"{location}/properties/{name}")
+            if body:
+                lines.append(f"{pad}{value} = {v}.get({name!r}, _MISSING)")
+                lines.append(f"{pad}if {value} is not _MISSING:")
+                lines.extend(body)
+        patterns = [(self.constant(re.compile(pattern), "_re"), pattern, pattern_schema)
+                    for pattern, pattern_schema in schema.get("patternProperties", {}).items()]
+        extra = schema.get("additionalProperties", True)
+        if patterns or extra is not True:
+            key, value = self._name("key"), self._name("value")
+            key_path = path + [("var", key)]
+            loop: List[str] = []
+            matched = []
+            for regex, pattern, pattern_schema in patterns:
+                body = self.node(pattern_schema, value, key_path, depth + 2,
+                                 f"{location}/patternProperties/{pattern}")
+                loop.append(f"{pad}    if {regex}.search({key}) is not None:")
+                loop.extend(body or [f"{pad}        pass"])
+                matched.append(f"{regex}.search({key}) is not None")
+            if extra is not True:
+                conditions = []
+                if properties:
+                    conditions.append(f"{key} not in {self.constant(frozenset(properties))}")
+                conditions += [f"not ({condition})" for condition in matched]
+                body = self.node(extra, value, key_path, depth + 2, f"{location}/additionalProperties")
+                if extra is False:
+                    body = [self.error(path, "has unexpected property ", pad + "        ", f"repr({key})")]
+                if body:
+                    loop.append(f"{pad}    if {' and '.join(conditions) or 'True'}:")
+                    loop.extend(body)
+            if loop:
+                lines.append(f"{pad}for {key}, {value} in {v}.items():")
+                lines.extend(loop)
+        if "propertyNames" in schema:
+            name = self.function(schema["propertyNames"], f"{location}/propertyNames")
+            lines.append(f"{pad}for key in {v}:")
+            lines.append(f"{pad}    if not _matches({name}, key):")
+            lines.append(self.error(path, "has an invalid property name ", pad + "        ", "repr(key)"))
+        for name, dependency in schema.get("dependencies", {}).items():
+            lines.append(f"{pad}if {name!r} in {v}:")
+            if isinstance(dependency, list):
+                for required in dependency:
+                    lines.append(f"{pad}    if {required!r} not in {v}:")
+                    lines.append(self.error(path, f"needs property '{required}' along with '{name}'",
+                                            pad + "        "))
+            else:
+                body = self.node(dependency, v, path, depth + 1, f"{location}/dependencies/{name}")
+                lines.extend(body or [f"{pad}    pass"])
+        return lines
+
+    def combinators(self, schema: Dict[str, Any], v: str, path: List[Tuple[str, Any]],
+                    depth: int, location: str) -> List[str]:
+        pad = "    " * depth
+        lines: List[str] = []
+        for index, subschema in enumerate(schema.get("allOf", [])):
+            lines += self.node(subschema, v, path, depth, f"{location}/allOf/{index}")
+        for keyword in ("anyOf", "oneOf"):
+            if keyword not in schema:
+                continue
+            names = [self.function(subschema, f"{location}/{keyword}/{index}")
+                     for index, subschema in enumerate(schema[keyword])]
+            matches = f"sum(_matches(func, {v}) for func in ({', '.join(names)},))"
+            if keyword == "anyOf":
+                lines.append(f"{pad}if not any(_matches(func, {v}) for func in ({', '.join(names)},)):")
+                lines.append(self.error(path, "must match at least one schema of anyOf", pad + "    "))
+            else:
+                lines.append(f"{pad}if {matches} != 1:")
+                lines.append(self.error(path, "must match exactly one schema of oneOf", pad + "    "))
+        if "not" in schema:
+            name = self.function(schema["not"], f"{location}/not")
+            lines.append(f"{pad}if _matches({name}, {v}):")
+            lines.append(self.error(path, "must not match the schema of not", pad + "    "))
+        if "if" in schema and ("then" in schema or "else" in schema):
+            name = self.function(schema["if"], f"{location}/if")
+            then = self.node(schema.get("then", True), v, path, depth + 1, f"{location}/then")
+            otherwise = self.node(schema.get("else", True), v, path, depth + 1, f"{location}/else")
+            lines.append(f"{pad}if _matches({name}, {v}):")
+            lines.extend(then or [f"{pad}    pass"])
+            if otherwise:
+                lines.append(f"{pad}else:")
+                lines.extend(otherwise)
+        return lines
+
+
+def compile_schema(
+    schema: Dict[str, Any],
+    assert_formats: Iterable[str] = DEFAULT_ASSERT_FORMATS,
+) -> Callable[[Any], List[ValidationError]]:
+    """
+    Compiles a draft-07 JSON schema into a function that validates one record.
+
+    The schema is walked once, here, to generate the source of a specialized function:
+    each keyword becomes an inline check on the value it applies to, and paths are only
+    built for the values that fail. A valid record therefore costs a few type checks,
+    lookups and comparisons per property. `$ref`, `anyOf`, `oneOf`, `not` and `if`
+    become separate functions. Keywords the compiler does not know make it fail, so that
+    no part of the schema is silently ignored.
+
+    Args:
+        schema (Dict[str, Any]): The JSON schema, e.g. schema.json.
+        assert_formats (Iterable[str]): Values of `format` that are checked; the others
+            are annotations, as draft-07 allows. See FORMAT_CHECKS.
+
+    Returns:
+        Callable[[Any], List[ValidationError]]: A function from a record to its errors,
+        each a (JSON pointer, message) pair; an empty list if the record is valid.
+
+    Raises:
+        ValueError: If the schema uses an unsupported keyword or an unresolvable $ref.
+    """
+    compiler = _SchemaCompiler(schema, assert_formats)
+    root = compiler.function(schema, "")
+    source = "\n\n".join("\n".join(lines) for lines in compiler.functions) + "\n\n" + "\n".join([
+        "def validate(record):",
+        "    errors = []",
+        f"    {root}(record, (), errors)",
+        "    return [(_json_pointer(path), message) for path, message in errors]",
+    ])
+    namespace = compiler.namespace
+    namespace["_json_pointer"] = json_pointer
+    exec(compile(source, "<schema.json>", "exec"), namespace)
+    return namespace["validate"]
+
+
+class ValidationStats:
+    """Counts valid and invalid records, and the invalid records of each error path."""
+
+    def __init__(self):
+        self.valid = 0
+        self.invalid = 0
+        self.errors: Counter = Counter()
+
+    def add(self, errors: List[ValidationError]):
+        if errors:
+            self.invalid += 1
+            self.errors.update({path for path, _ in errors})
+        else:
+            self.valid += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"valid": self.valid, "invalid": self.invalid,
+                "errors_by_path": dict(self.errors.most_common())}
+
+    def summary(self, action: str, quarantine_path: Optional[str] = None) -> List[str]:
+        """Lines describing the counts, with the most frequent error paths."""
+        total = self.valid + self.invalid
+        verb = "quarantined" if action == "quarantine" else "kept in the output"
+        lines = [f"Validation: {self.valid} of {total} records valid, {self.invalid} invalid ({verb})"
+                 + (f"; see {quarantine_path}" if quarantine_path and self.invalid else "") + "."]
+        for path, count in self.errors.most_common(MAX_REPORTED_PATHS):
+            lines.append(f"  {path or '/'}: {count} record(s)")
+        return lines
+
+
+class RecordValidator:
+    """
+    Validates grouped records against a schema and handles the invalid ones.
+
+    Invalid records are written, with their errors, to `quarantine_path` as NDJSON, one
+    {"id", "errors", "record"} document per line. With action="quarantine" they are
+    also dropped from the output; with action="report" they are kept in it.
+    """
+
+    def __init__(self, schema: Dict[str, Any], quarantine_path: Optional[str] = None,
+                 action: str = "quarantine", assert_formats: Iterable[str] = DEFAULT_ASSERT_FORMATS):
+        if action not in VALIDATION_ACTIONS:
+            raise ValueError(f"Unknown validation action '{action}', expected one of "
+                             f"{', '.join(VALIDATION_ACTIONS)}")
+        self.schema = schema
+        self.assert_formats = list(assert_formats)
+        self.validate = compile_schema(schema, self.assert_formats)
+        self.quarantine_path = quarantine_path
+        self.action = action
+        self.stats = ValidationStats()
+
+    def summary(self) -> List[str]:
+        return self.stats.summary(self.action, self.quarantine_path)
+
+
+def validation_stage(records: Iterable[Any], validator: RecordValidator,
+                     prevalidated: bool = False) -> Iterator[Any]:
+    """
+    Validates every record (see `RecordValidator`) and yields those that pass, or all of
+    them with action="report".
+
+    Args:
+        records (Iterable[Any]): Grouped records, or with `prevalidated`, (record, errors)
+            pairs whose errors were computed earlier, e.g. by a worker.
+        validator (RecordValidator): The compiled schema, the quarantine file and the
+            counts, which are updated as records flow.
+        prevalidated (bool): Whether `records` holds (record, errors) pairs.
+
+    Yields:
+        Any: The records that stay in the output, in input order.
+    """
+    validate = validator.validate
+    stats = validator.stats
+    keep_invalid = validator.action == "report"
+    quarantine = NdjsonWriter(validator.quarantine_path) if validator.quarantine_path else None
+    try:
+        for item in records:
+            record, errors = item if prevalidated else (item, validate(item))
+            stats.add(errors)
+            if errors:
+                if quarantine is not None:
+                    quarantine.write({
+                        "id": record.get("id") if isinstance(record, dict) else None,
+                        "errors": [{"path": path, "message": message} for path, message in errors],
+                        "record": record,
+                    })
+                if not keep_invalid:
+                    continue
+            yield record
+    except BaseException:
+        if quarantine is not None:
+            quarantine.abort()
+        raise
+    if quarantine is not None:
+        quarantine.close()
+
+
+def make_validator(settings: Optional[Dict[str, Any]], schema: Optional[Dict[str, Any]],
+                   quarantine_path: Optional[str] = None) -> Optional[RecordValidator]:
+    """
+    Builds a RecordValidator from the "validation" section of config.json, or returns
+    None if it is missing or not enabled, or if there is no schema.
+    """
+    if not settings or not settings.get("enabled", False) or schema is None:
+        return None
+    return RecordValidator(schema, quarantine_path, settings.get("action", "quarantine"),
+                           settings.get("assert_formats", DEFAULT_ASSERT_FORMATS))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate grouped records against a JSON schema.")
+    parser.add_argument("--schema", default="schema.json", help="Path to the JSON schema.")
+    parser.add_argument("--input-file", required=True, help="Path to the grouped data file.")
+    parser.add_argument("--quarantine", help="Write the invalid records and their errors to this NDJSON file.")
+    parser.add_argument("--assert-formats", default=",".join(DEFAULT_ASSERT_FORMATS),
+                        help="Comma-separated formats to check.")
+    args = parser.parse_args()
+
+    with open(args.schema, "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    validator = RecordValidator(schema, args.quarantine, "report",
+                                [name for name in args.assert_formats.split(",") if name])
+    for _ in validation_stage(iter_records(args.input_file), validator):
+        pass
+    print("\n".join(validator.summary()))
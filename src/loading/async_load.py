@@ -0,0 +1,183 @@
+import asyncio
+import time
+from pymongo import AsyncMongoClient
+from pymongo.errors import BulkWriteError
+
+from loading.load_to_db import (
+    DEFAULT_BATCH_SIZE,
+    ID_INDEX_NAME,
+    _count_result,
+    _new_stats,
+    _upsert_operations,
+    iter_batches,
+)
+from loading.indexes import create_indexes_async, format_index_report
+
+DEFAULT_CONCURRENCY = 4
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _next_batch(operations, batch_size):
+    """
+    Pulls the next batch of operations from a (possibly CPU-bound) iterator.
+    Runs in a worker thread so the event loop keeps serving in-flight writes.
+    """
+    batch = []
+    for op in operations:
+        batch.append(op)
+        if len(batch) >= batch_size:
+            break
+    return batch
+
+
+async def _ensure_unique_id_index(collection):
+    """Same as `load_to_db.ensure_unique_id_index`, for an asynchronous collection."""
+    info = (await collection.index_information()).get(ID_INDEX_NAME)
+    if info is not None and not info.get("unique", False):
+        await collection.drop_index(ID_INDEX_NAME)
+    await collection.create_index("id", unique=True, name=ID_INDEX_NAME)
+
+
+async def _write_batch(collection, batch, stats):
+    """
+    Sends one batch of upserts. Two batches in flight can upsert the same new id at the
+    same time: the unique index lets one insert it and fails the other with a duplicate
+    key error. The failed upserts are sent again, and then replace that document.
+    """
+    try:
+        result = await collection.bulk_write(batch, ordered=False)
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        if not write_errors or any(error.get("code") != DUPLICATE_KEY_ERROR for error in write_errors):
+            raise
+        stats["documents"] += len(batch) - len(write_errors)
+        stats["inserted"] += e.details.get("nUpserted", 0)
+        stats["replaced"] += e.details.get("nMatched", 0)
+        batch = [batch[error["index"]] for error in write_errors]
+        result = await collection.bulk_write(batch, ordered=False)
+    _count_result(stats, len(batch), result)
+
+
+async def _delete_missing_ids(collection, seen_ids, batch_size):
+    stale_ids = []
+    async for doc in collection.find({}, {"id": 1, "_id": 0}):
+        if doc.get("id") not in seen_ids:
+            stale_ids.append(doc.get("id"))
+    deleted = 0
+    for batch in iter_batches(stale_ids, batch_size):
+        result = await collection.delete_many({"id": {"$in": batch}})
+        deleted += result.deleted_count
+    return deleted
+
+
+async def load_records_async(records, db_name, collection_name, mongo_uri,
+                             batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                             use_staging=False, index_spec=None):
+    """
+    Upserts a stream of documents into MongoDB with concurrent batched writes.
+
+    `concurrency` writer tasks share one client whose connection pool is sized to
+    match, so up to `concurrency` unordered bulk writes are in flight at a time and
+    round-trip latency to a remote replica set is overlapped. Batches wait in a queue
+    bounded to two per writer: when the database falls behind, the producer blocks and
+    memory stays capped at a few batches whatever the size of the stream.
+
+    :param records: An iterable of documents, e.g. the last stage of the pipeline.
+    :param db_name: Name of the MongoDB database.
+    :param collection_name: Name of the MongoDB collection.
+    :param mongo_uri: MongoDB connection string.
+    :param batch_size: Number of documents sent per bulk write.
+    :param concurrency: Number of concurrent bulk writes.
+    :param use_staging: Load into '<collection>_staging' and rename it over the target.
+    :param index_spec: An `indexes.IndexSpec` giving the indexes to build once the
+        documents are written and the date fields to store as BSON dates.
+    :return: A dict with load statistics.
+    """
+    client = AsyncMongoClient(mongo_uri, maxPoolSize=concurrency, minPoolSize=concurrency)
+    try:
+        db = client[db_name]
+        if use_staging:
+            target_name = f"{collection_name}_staging"
+            await db.drop_collection(target_name)
+            print(f"Loading into staging collection: {target_name}...")
+        else:
+            target_name = collection_name
+            print(f"Upserting into collection: {target_name} "
+                  f"with {concurrency} concurrent writers...")
+        collection = db[target_name]
+        # Created before any batch is dispatched, so concurrent upserts cannot duplicate an id
+        await _ensure_unique_id_index(collection)
+
+        stats = _new_stats()
+        queue = asyncio.Queue(maxsize=concurrency * 2)
+        errors = []
+
+        async def writer():
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                if errors:
+                    # Keep draining so the producer never blocks on a dead writer
+                    continue
+                try:
+                    await _write_batch(collection, batch, stats)
+                except Exception as e:
+                    errors.append(e)
+
+        start = time.perf_counter()
+        writers = [asyncio.create_task(writer()) for _ in range(concurrency)]
+        if index_spec is not None and index_spec.date_paths:
+            records = map(index_spec.convert_dates, records)
+        operations = _upsert_operations(records, stats)
+        while not errors:
+            batch = await asyncio.to_thread(_next_batch, operations, batch_size)
+            if not batch:
+                break
+            await queue.put(batch)
+        for _ in writers:
+            await queue.put(None)
+        await asyncio.gather(*writers)
+        if errors:
+            raise errors[0]
+
+        seen_ids = stats.pop("seen_ids")
+        if index_spec is not None:
+            stats["index_build"] = await create_indexes_async(collection, index_spec)
+        if use_staging:
+            stats["deleted"] = 0
+            await collection.rename(collection_name, dropTarget=True)
+            print(f"Swapped staging collection into '{collection_name}'.")
+        else:
+            stats["deleted"] = await _delete_missing_ids(collection, seen_ids, batch_size)
+
+        elapsed = time.perf_counter() - start
+        stats["seconds"] = round(elapsed, 3)
+        stats["docs_per_sec"] = round(stats["documents"] / elapsed, 1) if elapsed > 0 else None
+        if stats["skipped"]:
+            print(f"Skipped {stats['skipped']} documents without an 'id'.")
+        print(f"Loaded {stats['documents']} documents into '{collection_name}' "
+              f"({stats['inserted']} inserted, {stats['replaced']} replaced, "
+              f"{stats['deleted']} deleted) in {stats['seconds']}s "
+              f"({stats['docs_per_sec']} docs/sec).")
+        if "index_build" in stats:
+            print("\n".join(format_index_report(stats["index_build"])))
+        return stats
+    finally:
+        await client.close()
+
+
+def load_records_to_mongodb(records, db_name, collection_name, mongo_uri,
+                            batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                            use_staging=False, index_spec=None):
+    """
+    Synchronous entry point for `load_records_async`. Returns None if the connection
+    settings are missing; errors raised while loading propagate to the caller.
+    """
+    if not all([mongo_uri, db_name, collection_name]):
+        print("Error: MONGO_URI, MONGO_DB_NAME, and MONGO_COLLECTION_NAME environment variables must be set.")
+        return
+    return asyncio.run(load_records_async(
+        records, db_name, collection_name, mongo_uri,
+        batch_size=batch_size, concurrency=concurrency, use_staging=use_staging,
+        index_spec=index_spec))
@@ -0,0 +1,185 @@
+import datetime
+import json
+import time
+
+from pymongo import IndexModel
+
+from dataprocessing.grouping import grouping_ops
+
+# Fields of grouping.json whose "YYYY-MM-DD" strings may be stored as BSON dates
+DEFAULT_DATE_FIELDS = ("departure_date", "deposit_date", "retrieval_date")
+
+
+def _resolve_field(name, paths):
+    """
+    Returns the dotted path of a field in the grouped documents: `name` is either a
+    source field of grouping.json or already a dotted output path.
+    """
+    if name in paths:
+        return paths[name]
+    if name in paths.values():
+        return name
+    raise ValueError(f"Index field '{name}' is not produced by the grouping configuration")
+
+
+class IndexSpec:
+    """
+    The indexes of the grouped collection, and the fields stored as BSON dates, as
+    declared in an index spec file next to grouping.json:
+
+        {"indexes": [{"keys": ["outcome", "-deposit_date"]},
+                     {"keys": ["deposit_date"], "partial": true}],
+         "bson_dates": {"enabled": true, "fields": ["deposit_date"]}}
+
+    Keys name the fields of grouping.json, or dotted paths, and are ascending unless
+    prefixed with '-'. A partial index only covers the documents where its fields are
+    set: `"partial": true` works for date fields, which hold BSON dates or strings, and
+    a dict of conditions, e.g. {"rent_eur": {"$type": "number"}}, works for any field.
+    """
+
+    def __init__(self, spec, grouping_config):
+        paths = {source: ".".join(path) for path, source in grouping_ops(grouping_config)
+                 if source is not None}
+        dates = spec.get("bson_dates", {})
+        date_fields = [_resolve_field(name, paths)
+                       for name in dates.get("fields", DEFAULT_DATE_FIELDS)]
+        self.date_paths = date_fields if dates.get("enabled", False) else []
+        string_dates = set(date_fields) - set(self.date_paths)
+
+        self.indexes = []
+        names = set()
+        for entry in spec.get("indexes", []):
+            keys = []
+            for key in entry["keys"]:
+                direction = -1 if key.startswith("-") else 1
+                keys.append((_resolve_field(key.lstrip("-"), paths), direction))
+            options = {}
+            partial = entry.get("partial")
+            if partial is True:
+                options["partialFilterExpression"] = {}
+                for path, _ in keys:
+                    if path in self.date_paths:
+                        options["partialFilterExpression"][path] = {"$type": "date"}
+                    elif path in string_dates:
+                        options["partialFilterExpression"][path] = {"$type": "string"}
+                    else:
+                        raise ValueError(f"'partial: true' needs date fields, not '{path}': "
+                                         f"give its conditions instead")
+            elif partial:
+                options["partialFilterExpression"] = {
+                    _resolve_field(name, paths): condition for name, condition in partial.items()}
+            name = entry.get("name") or "_".join(f"{path}_{direction}" for path, direction in keys)
+            if partial and not entry.get("name"):
+                name += "_partial"
+            if name in names:
+                raise ValueError(f"Index '{name}' is declared twice in the index spec")
+            names.add(name)
+            self.indexes.append({"name": name, "keys": keys, **options})
+        self._date_parents = [(path.split(".")[:-1], path.split(".")[-1]) for path in self.date_paths]
+
+    def models(self):
+        """Returns one pymongo IndexModel per declared index."""
+        return [IndexModel(index["keys"], **{k: v for k, v in index.items() if k != "keys"})
+                for index in self.indexes]
+
+    def convert_dates(self, doc):
+        """
+        Replaces the date strings of a document with datetimes, stored by MongoDB as
+        BSON dates, in place. Values that are not ISO dates are left as they are.
+        """
+        for parents, key in self._date_parents:
+            parent = doc
+            for name in parents:
+                parent = parent.get(name) if isinstance(parent, dict) else None
+            if isinstance(parent, dict) and isinstance(parent.get(key), str):
+                try:
+                    parent[key] = datetime.datetime.fromisoformat(parent[key])
+                except ValueError:
+                    pass
+        return doc
+
+
+def load_index_spec(spec_path, grouping_config_path):
+    """
+    Reads an index spec file and resolves its fields against grouping.json.
+
+    :param spec_path: Path to the index spec JSON file.
+    :param grouping_config_path: Path to grouping.json.
+    :return: An IndexSpec.
+    """
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    with open(grouping_config_path, 'r', encoding='utf-8') as f:
+        grouping_config = json.load(f)
+    return IndexSpec(spec, grouping_config)
+
+
+def _stale_indexes(existing, spec):
+    """Names of the existing indexes that a declared index of the same name replaces."""
+    stale = []
+    for index in spec.indexes:
+        info = existing.get(index["name"])
+        if info is None:
+            continue
+        if ([tuple(key) for key in info["key"]] != index["keys"]
+                or info.get("partialFilterExpression") != index.get("partialFilterExpression")):
+            stale.append(index["name"])
+    return stale
+
+
+def _index_report(spec, seconds, stats):
+    """Builds the report of an index build from `$collStats` storage stats."""
+    sizes = stats.get("storageStats", {}).get("indexSizes", {}) if stats else {}
+    return {
+        "seconds": round(seconds, 3),
+        "indexes": [{"name": index["name"], "size_bytes": sizes.get(index["name"])}
+                    for index in spec.indexes],
+        "total_index_bytes": sum(sizes.values()),
+    }
+
+
+def create_indexes(collection, spec):
+    """
+    Builds the declared indexes of a collection in one pass over its documents, after
+    the bulk load so that the writes do not maintain them. An existing index of the
+    same name with other keys or options is dropped and rebuilt.
+
+    :param collection: The pymongo collection.
+    :param spec: An IndexSpec.
+    :return: A dict with the build time, the size of each declared index, and the
+        total size of the collection's indexes.
+    """
+    if not spec.indexes:
+        return _index_report(spec, 0.0, None)
+    for name in _stale_indexes(collection.index_information(), spec):
+        collection.drop_index(name)
+    start = time.perf_counter()
+    collection.create_indexes(spec.models())
+    seconds = time.perf_counter() - start
+    stats = next(collection.aggregate([{"$collStats": {"storageStats": {}}}]), None)
+    return _index_report(spec, seconds, stats)
+
+
+async def create_indexes_async(collection, spec):
+    """
+    Same as `create_indexes`, for an asynchronous pymongo collection.
+    """
+    if not spec.indexes:
+        return _index_report(spec, 0.0, None)
+    for name in _stale_indexes(await collection.index_information(), spec):
+        await collection.drop_index(name)
+    start = time.perf_counter()
+    await collection.create_indexes(spec.models())
+    seconds = time.perf_counter() - start
+    cursor = await collection.aggregate([{"$collStats": {"storageStats": {}}}])
+    stats = await cursor.to_list(1)
+    return _index_report(spec, seconds, stats[0] if stats else None)
+
+
+def format_index_report(report):
+    """Returns the lines summing up an index build."""
+    lines = [f"Built {len(report['indexes'])} indexes in {report['seconds']}s "
+             f"({report['total_index_bytes']} bytes of indexes in the collection)."]
+    for index in report["indexes"]:
+        lines.append(f"  {index['name']}: {index['size_bytes']} bytes")
+    return lines
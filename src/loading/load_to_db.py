@@ -1,65 +1,274 @@
 import json
 import os
-from pymongo import MongoClient
+import sys
+import time
+from pymongo import MongoClient, ReplaceOne
 import argparse
 from dotenv import load_dotenv
 
+if __package__ in (None, ''):
+    # Allow running this file directly: make the `src` packages importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataprocessing.recordio import detect_format, iter_records
+from dataprocessing.tags import load_tag_codec
+from loading.indexes import create_indexes, format_index_report, load_index_spec
+
 # Ensure you have pymongo and python-dotenv installed:
 # pip install pymongo python-dotenv
 
-def load_to_mongodb(file_path, db_name, collection_name, mongo_uri):
+DEFAULT_BATCH_SIZE = 1000
+ID_INDEX_NAME = "id_1"
+
+
+def iter_documents(file_path):
+    """
+    Streams the documents of a record file in any supported format. A JSON file may
+    also hold a single object instead of an array.
+    """
+    try:
+        yield from iter_records(file_path)
+    except ValueError:
+        if detect_format(file_path) != 'json':
+            raise
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            raise
+        yield data
+
+
+def iter_batches(documents, batch_size):
+    """
+    Groups a document stream into lists of at most `batch_size` documents.
+    """
+    batch = []
+    for doc in documents:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_documents(collection, documents, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Upserts documents into a collection with unordered bulk writes, keyed on their
+    content-derived `id`. Documents without an `id` cannot be matched and are skipped.
+
+    :param collection: The target pymongo collection.
+    :param documents: An iterable of documents.
+    :param batch_size: Number of operations sent per bulk_write call.
+    :return: A dict of counters, including the set of ids written under 'seen_ids'.
+    """
+    stats = _new_stats()
+    for batch in iter_batches(_upsert_operations(documents, stats), batch_size):
+        result = collection.bulk_write(batch, ordered=False)
+        _count_result(stats, len(batch), result)
+    return stats
+
+
+def _new_stats():
+    return {"documents": 0, "inserted": 0, "replaced": 0, "skipped": 0, "seen_ids": set()}
+
+
+def _upsert_operations(documents, stats):
+    """
+    Yields one upsert per document keyed on its `id`, recording ids in `stats`.
+    """
+    seen_ids = stats["seen_ids"]
+    for doc in documents:
+        doc_id = doc.get("id") if isinstance(doc, dict) else None
+        if doc_id is None:
+            stats["skipped"] += 1
+            continue
+        seen_ids.add(doc_id)
+        yield ReplaceOne({"id": doc_id}, doc, upsert=True)
+
+
+def _count_result(stats, operations, result):
+    stats["documents"] += operations
+    stats["inserted"] += result.upserted_count
+    stats["replaced"] += result.matched_count
+
+
+def ensure_unique_id_index(collection):
+    """
+    Makes `id` a unique index, so that an upsert repeated or run concurrently with
+    another one on the same id cannot insert a second document. A non-unique `id`
+    index left by an earlier version of the loader is replaced.
+    """
+    info = collection.index_information().get(ID_INDEX_NAME)
+    if info is not None and not info.get("unique", False):
+        collection.drop_index(ID_INDEX_NAME)
+    collection.create_index("id", unique=True, name=ID_INDEX_NAME)
+
+
+def delete_missing_ids(collection, seen_ids, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Deletes the documents whose `id` is not in `seen_ids`, in batches.
+
+    :return: The number of deleted documents.
+    """
+    stale_ids = (doc.get("id") for doc in collection.find({}, {"id": 1, "_id": 0})
+                 if doc.get("id") not in seen_ids)
+    deleted = 0
+    for batch in iter_batches(stale_ids, batch_size):
+        deleted += collection.delete_many({"id": {"$in": batch}}).deleted_count
+    return deleted
+
+
+def load_to_mongodb(file_path, db_name, collection_name, mongo_uri,
+                    batch_size=DEFAULT_BATCH_SIZE, use_staging=False, transform=None,
+                    index_spec=None):
     """
     Loads data from a JSON file into a MongoDB collection.
 
+    The file is streamed and written in unordered bulk upserts keyed on each document's
+    content-derived `id`, so the collection stays complete while it is being updated.
+    Documents whose `id` disappeared from the file are deleted afterwards. With
+    `use_staging`, the data is loaded into an empty staging collection that then
+    atomically replaces the target collection through a rename. The indexes of
+    `index_spec` are built once the documents are written, before the rename.
+
     :param file_path: Path to the JSON file.
     :param db_name: Name of the MongoDB database.
     :param collection_name: Name of the MongoDB collection.
     :param mongo_uri: MongoDB connection string.
+    :param batch_size: Number of documents sent per bulk write.
+    :param use_staging: Load into '<collection>_staging' and rename it over the target.
+    :param transform: A function applied to each document before it is written, e.g.
+        `tags.TagCodec.decode` to load tag fields as string lists.
+    :param index_spec: An `indexes.IndexSpec` giving the indexes to build and the date
+        fields to store as BSON dates.
+    :return: A dict with load statistics, or None if the connection settings or the file
+        are missing. Errors raised while loading propagate to the caller.
     """
     if not all([mongo_uri, db_name, collection_name]):
         print("Error: MONGO_URI, MONGO_DB_NAME, and MONGO_COLLECTION_NAME environment variables must be set.")
         return
 
+    # Check if the file exists
+    if not os.path.exists(file_path):
+        print(f"Error: File not found at {file_path}")
+        return
+
+    client = None
     try:
         # Connect to MongoDB
         client = MongoClient(mongo_uri)
         db = client[db_name]
-        collection = db[collection_name]
-
-        # Clean the collection before inserting new data
-        print(f"Cleaning collection: {collection_name}...")
-        collection.delete_many({})
-        print("Collection cleaned.")
 
-        # Check if the file exists
-        if not os.path.exists(file_path):
-            print(f"Error: File not found at {file_path}")
-            return
+        if use_staging:
+            target_name = f"{collection_name}_staging"
+            db.drop_collection(target_name)
+            print(f"Loading into staging collection: {target_name}...")
+        else:
+            target_name = collection_name
+            print(f"Upserting into collection: {target_name}...")
+        collection = db[target_name]
+        ensure_unique_id_index(collection)
 
-        # Read the JSON file
-        with open(file_path, 'r') as f:
-            data = json.load(f)
+        start = time.perf_counter()
+        documents = iter_documents(file_path)
+        if transform is not None:
+            documents = map(transform, documents)
+        if index_spec is not None and index_spec.date_paths:
+            documents = map(index_spec.convert_dates, documents)
+        stats = upsert_documents(collection, documents, batch_size)
+        seen_ids = stats.pop("seen_ids")
+        if index_spec is not None:
+            stats["index_build"] = create_indexes(collection, index_spec)
 
-        # Insert data into the collection
-        if isinstance(data, list):
-            if data:
-                result = collection.insert_many(data)
-                print(f"Successfully inserted {len(result.inserted_ids)} documents into '{collection_name}'.")
-            else:
-                print("JSON file is empty. No data inserted.")
+        if use_staging:
+            stats["deleted"] = 0
+            collection.rename(collection_name, dropTarget=True)
+            print(f"Swapped staging collection into '{collection_name}'.")
         else:
-            result = collection.insert_one(data)
-            print(f"Successfully inserted 1 document with id: {result.inserted_id} into '{collection_name}'.")
+            stats["deleted"] = delete_missing_ids(collection, seen_ids, batch_size)
+
+        elapsed = time.perf_counter() - start
+        stats["seconds"] = round(elapsed, 3)
+        stats["docs_per_sec"] = round(stats["documents"] / elapsed, 1) if elapsed > 0 else None
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        if stats["skipped"]:
+            print(f"Skipped {stats['skipped']} documents without an 'id'.")
+        print(f"Loaded {stats['documents']} documents into '{collection_name}' "
+              f"({stats['inserted']} inserted, {stats['replaced']} replaced, "
+              f"{stats['deleted']} deleted) in {stats['seconds']}s "
+              f"({stats['docs_per_sec']} docs/sec).")
+        if "index_build" in stats:
+            print("\n".join(format_index_report(stats["index_build"])))
+        return stats
+    finally:
+        if client is not None:
+            client.close()
+
+def load_summary_to_mongodb(file_path, db_name, collection_name, mongo_uri,
+                            batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Replaces a summary collection with the cells of an aggregate cube file.
+
+    The cells are inserted into a '<collection>_staging' collection, indexed on their
+    cuboid, which then atomically replaces the summary collection through a rename,
+    so dashboards never read a partial cube.
+
+    :param file_path: Path to the cube cells file (see dataprocessing.cube.write_cube).
+    :param db_name: Name of the MongoDB database.
+    :param collection_name: Name of the summary collection.
+    :param mongo_uri: MongoDB connection string.
+    :param batch_size: Number of cells sent per insert.
+    :return: The number of cells loaded, or None if the connection settings or the file
+        are missing. Errors raised while loading propagate to the caller.
+    """
+    if not all([mongo_uri, db_name, collection_name]):
+        print("Error: MONGO_URI, MONGO_DB_NAME, and the summary collection name must be set.")
+        return
+    if not os.path.exists(file_path):
+        print(f"Error: File not found at {file_path}")
+        return
+
+    client = None
+    try:
+        client = MongoClient(mongo_uri)
+        db = client[db_name]
+        staging_name = f"{collection_name}_staging"
+        db.drop_collection(staging_name)
+        collection = db[staging_name]
+        cells = 0
+        for batch in iter_batches(iter_records(file_path), batch_size):
+            collection.insert_many(batch, ordered=False)
+            cells += len(batch)
+        collection.create_index("cuboid")
+        collection.rename(collection_name, dropTarget=True)
+        print(f"Loaded {cells} cube cells into '{collection_name}'.")
+        return cells
+    finally:
+        if client is not None:
+            client.close()
 
 if __name__ == "__main__":
     load_dotenv()  # Load environment variables from .env file
 
     parser = argparse.ArgumentParser(description="Load a JSON file into a MongoDB collection.")
-    parser.add_argument("file_path", help="The path to the JSON file.")
-    
+    parser.add_argument("file_path", help="The path to the JSON file, or to the cube file with --summary.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of documents per bulk write.")
+    parser.add_argument("--staging", action="store_true",
+                        help="Load into a staging collection and atomically rename it over the target.")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Number of concurrent bulk writes; above 1 the asyncio loader is used.")
+    parser.add_argument("--decode-tags", metavar="CONFIG",
+                        help="Decode the tag fields encoded by the pipeline with the 'tags' "
+                             "settings and vocabularies of this config.json.")
+    parser.add_argument("--index-spec", help="Index spec file of the indexes to build after the load "
+                                             "and the dates to store as BSON dates.")
+    parser.add_argument("--grouping", default="pipeline-setup/grouping.json",
+                        help="grouping.json, to find the fields named in the index spec.")
+    parser.add_argument("--summary", metavar="COLLECTION",
+                        help="Replace this summary collection with the cells of the cube file.")
+
     args = parser.parse_args()
 
     # Get MongoDB connection details from environment variables
@@ -67,9 +276,33 @@ if __name__ == "__main__":
     db_name = os.getenv("MONGO_DB_NAME")
     collection_name = os.getenv("MONGO_COLLECTION_NAME")
 
-    load_to_mongodb(args.file_path, db_name, collection_name, mongo_uri)
+    if args.summary:
+        cells = load_summary_to_mongodb(args.file_path, db_name, args.summary, mongo_uri,
+                                        batch_size=args.batch_size)
+        sys.exit(0 if cells is not None else 1)
+
+    transform = None
+    if args.decode_tags:
+        codec = load_tag_codec(args.decode_tags)
+        transform = codec.decode if codec is not None else None
+    index_spec = load_index_spec(args.index_spec, args.grouping) if args.index_spec else None
+
+    if args.concurrency > 1:
+        from loading.async_load import load_records_to_mongodb
+        documents = iter_documents(args.file_path)
+        if transform is not None:
+            documents = map(transform, documents)
+        stats = load_records_to_mongodb(documents, db_name, collection_name, mongo_uri,
+                                        batch_size=args.batch_size, concurrency=args.concurrency,
+                                        use_staging=args.staging, index_spec=index_spec)
+    else:
+        stats = load_to_mongodb(args.file_path, db_name, collection_name, mongo_uri,
+                                batch_size=args.batch_size, use_staging=args.staging,
+                                transform=transform, index_spec=index_spec)
+    if stats is None:
+        sys.exit(1)
 
     # Example usage from the command line:
     # 1. Create a .env file with your credentials (see .env.example)
     # 2. Run the script:
-    # python loaders/load-to-mongodb.py normalized-data.json
+    # python src/loading/load_to_db.py data/processed/grouped-data.json --staging --index-spec pipeline-setup/indexes.json
@@ -0,0 +1,272 @@
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+from benchmarks.synthetic import build_field_samplers, write_raw_files
+from dataprocessing.grouping import run_grouping
+from dataprocessing.normalize import (
+    add_ids_to_data,
+    collect_field_values,
+    concatenate_json_files,
+    normalize_field_value,
+    standardize_fields,
+)
+from loading.load_to_db import load_to_mongodb
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1M": 1_000_000, "10M": 10_000_000}
+
+
+def parse_scale(text):
+    """
+    Parses a scale such as '10k', '1M' or '2500' into a number of records.
+    """
+    if text in SCALES:
+        return SCALES[text]
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = text[-1:].lower()
+    if suffix in multipliers:
+        return int(float(text[:-1]) * multipliers[suffix])
+    return int(text)
+
+
+def _peak_rss_mb():
+    # ru_maxrss survives exec on Linux, so a spawned child would report its parent's
+    # peak: read the high-water mark of the process's own memory instead
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _run_in_child(conn, func, args, verbose):
+    """
+    Runs one stage in a fresh process and sends back its time and peak RSS.
+    """
+    result = {"start_rss_mb": round(_peak_rss_mb(), 1)}
+    try:
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                devnull = stack.enter_context(open(os.devnull, "w"))
+                stack.enter_context(contextlib.redirect_stdout(devnull))
+            start = time.perf_counter()
+            func(*args)
+            result["seconds"] = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+    conn.send(result)
+    conn.close()
+
+
+def run_stage(name, func, args, records, input_path=None, verbose=False):
+    """
+    Times a pipeline stage in its own process, so that its peak RSS is its own.
+
+    :param name: Name of the stage in the results.
+    :param func: The stage function; it must be importable by a child process.
+    :param args: Positional arguments of the stage function.
+    :param records: Number of records the stage processes.
+    :param input_path: The stage's input file, whose size is reported.
+    :param verbose: Show the stage's own output.
+    :return: A dict with the stage's timing, throughput and peak RSS.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_in_child, args=(sender, func, args, verbose))
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": f"stage process exited with code {process.exitcode}"}
+    process.join()
+
+    result = {"stage": name, "records": records, **result}
+    if input_path and os.path.exists(input_path):
+        result["input_bytes"] = os.path.getsize(input_path)
+    if result.get("seconds"):
+        result["records_per_sec"] = round(records / result["seconds"], 1)
+    status = result.get("error") or (
+        f"{result['seconds']:>8.3f}s {result.get('records_per_sec', 0):>12,.0f} rec/s "
+        f"peak RSS {result['peak_rss_mb']:>8.1f} MB")
+    print(f"  {name:<28} {status}")
+    return result
+
+
+def benchmark_scale(count, samplers, config, work_dir, fmt, mongo, verbose):
+    """
+    Generates `count` synthetic records and times every pipeline stage on them.
+
+    :return: The list of stage results.
+    """
+    ext = {"json": ".json", "ndjson": ".ndjson", "msgpack": ".msgpack"}[fmt]
+    raw_dir = os.path.join(work_dir, "raw")
+    paths = {name: os.path.join(work_dir, name + ext)
+             for name in ("concatenated", "standardized", "normalized", "with_ids", "grouped")}
+    field_values = os.path.join(work_dir, "field-values.json")
+    field_profiles = os.path.join(work_dir, "field-profiles.json")
+
+    start = time.perf_counter()
+    raw_files = write_raw_files(raw_dir, count, samplers)
+    print(f"  {'generate':<28} {time.perf_counter() - start:>8.3f}s")
+
+    stages = [
+        ("concatenate_json_files", concatenate_json_files,
+         (raw_files, paths["concatenated"]), raw_files[0]),
+        ("standardize_fields", standardize_fields,
+         (config["fields_to_keep"], paths["concatenated"], paths["standardized"]),
+         paths["concatenated"]),
+        ("collect_field_values", collect_field_values,
+         (paths["standardized"], field_values), paths["standardized"]),
+        ("collect_field_values_profile", collect_field_values,
+         (paths["standardized"], field_profiles, True), paths["standardized"]),
+        ("normalize_field_value", normalize_field_value,
+         (config["normalization_map"], paths["standardized"], paths["normalized"]),
+         paths["standardized"]),
+        ("add_ids_to_data", add_ids_to_data,
+         (paths["normalized"], paths["with_ids"]), paths["normalized"]),
+        ("group_fields", run_grouping,
+         ({"normalizedDataPath": paths["with_ids"],
+           "groupingConfigPath": config["dataPaths"]["groupingConfigPath"],
+           "groupedDataPath": paths["grouped"]},), paths["with_ids"]),
+    ]
+    if mongo:
+        stages.append(("load_to_mongodb", load_to_mongodb,
+                       (paths["grouped"], mongo["db"], mongo["collection"], mongo["uri"]),
+                       paths["grouped"]))
+
+    results = []
+    for name, func, args, input_path in stages:
+        results.append(run_stage(name, func, args, count, input_path, verbose))
+    if not mongo:
+        print(f"  {'load_to_mongodb':<28} skipped (MONGO_URI is not set)")
+    return results
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare_results(baseline, current):
+    """
+    Prints the change of time and peak RSS of every stage against a baseline run.
+    """
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    previous = {(r["scale"], r["stage"]): r for r in baseline["results"]}
+    for result in current["results"]:
+        before = previous.get((result["scale"], result["stage"]))
+        if not before or not before.get("seconds") or not result.get("seconds"):
+            continue
+        ratio = result["seconds"] / before["seconds"]
+        rss = result["peak_rss_mb"] - before["peak_rss_mb"]
+        print(f"  {result['scale']:>6} {result['stage']:<28} "
+              f"time x{ratio:.2f} ({before['seconds']}s -> {result['seconds']}s), "
+              f"peak RSS {rss:+.1f} MB")
+
+
+def main(scales, output_path=None, work_dir="data/benchmarks", fmt="ndjson",
+         keep_files=False, baseline_path=None, verbose=False):
+    with open("pipeline-setup/config.json", "r", encoding="utf-8") as f:
+        config = json.load(f)
+    value_map = None
+    if os.path.exists("value-map.json"):
+        with open("value-map.json", "r", encoding="utf-8") as f:
+            value_map = json.load(f)
+
+    raw_dir = config["dataPaths"]["rawDir"]
+    raw_files = [os.path.join(raw_dir, name) for name in sorted(os.listdir(raw_dir))
+                 if name.endswith(".json")]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        samplers = build_field_samplers(raw_files, config["fields_to_keep"], value_map)
+
+    mongo = None
+    if os.getenv("MONGO_URI"):
+        mongo = {"uri": os.getenv("MONGO_URI"),
+                 "db": os.getenv("MONGO_DB_NAME", "benchmarks"),
+                 "collection": os.getenv("MONGO_COLLECTION_NAME", "benchmark_records")}
+
+    commit, dirty = _git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "format": fmt,
+        "results": [],
+    }
+    for scale in scales:
+        count = parse_scale(scale)
+        print(f"\n--- {scale}: {count:,} records ---")
+        scale_dir = os.path.join(work_dir, scale)
+        try:
+            for result in benchmark_scale(count, samplers, config, scale_dir, fmt, mongo, verbose):
+                report["results"].append({"scale": scale, **result})
+        finally:
+            if not keep_files:
+                shutil.rmtree(scale_dir, ignore_errors=True)
+
+    if output_path is None:
+        output_path = os.path.join("benchmarks", "results", f"{(commit or 'unknown')[:12]}.json")
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nBenchmark results written to {output_path}")
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            compare_results(json.load(f), report)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark every pipeline stage on synthetic data.")
+    parser.add_argument(
+        "--scales", default="10k,100k",
+        help="Comma-separated numbers of records, e.g. 10k,100k,1M,10M.")
+    parser.add_argument(
+        "--output", help="Results file (default: benchmarks/results/<commit>.json).")
+    parser.add_argument(
+        "--work-dir", default="data/benchmarks", help="Directory for the generated files.")
+    parser.add_argument(
+        "--format", choices=["json", "ndjson", "msgpack"], default="ndjson",
+        help="Format of the intermediate files.")
+    parser.add_argument(
+        "--keep-files", action="store_true", help="Keep the generated files after the run.")
+    parser.add_argument(
+        "--compare", metavar="RESULTS_FILE", help="Compare with the results of an earlier run.")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the output of each stage.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    main(args.scales.split(","), args.output, args.work_dir, args.format,
+         args.keep_files, args.compare, args.verbose)
@@ -1,175 +1,566 @@
+import functools
 import json
 import os
 import shutil
 import datetime
-from dataprocessing.grouping import run_grouping
+from dataprocessing.cube import make_cube, write_cube
+from dataprocessing.dag import KEY_SEPARATOR, PipelineDag, Step
+from dataprocessing.dedup import make_deduplicator
+from dataprocessing.features import make_feature_set
+from dataprocessing.incremental import run_incremental_pipeline
 from dataprocessing.normalize import (
-    add_ids_to_data,
-    collect_field_values,
-    collect_fields_from_json_files,
+    DEFAULT_CACHE_SIZE,
+    concatenate_json_files,
     generate_normalization_map,
-    normalize_field_value,
-    standardize_fields,
-    concatenate_json_files
 )
-from loading.load_to_db import load_to_mongodb
+from dataprocessing.metrics import PipelineMetrics
+from dataprocessing.profiling import profile_field_values
+from dataprocessing.pipeline import (
+    iter_raw_records,
+    run_streaming_pipeline,
+    standardize_stage,
+)
+from dataprocessing.tags import (
+    DEFAULT_TAG_SEPARATOR,
+    TagCollector,
+    load_tag_codec,
+    load_vocabularies,
+    make_tag_codec,
+    save_vocabularies,
+)
+from dataprocessing.validation import make_validator
+from loading.async_load import load_records_to_mongodb
+from loading.indexes import load_index_spec
+from loading.load_to_db import load_summary_to_mongodb, load_to_mongodb
 
+PIPELINE_SETUP_DIR = "pipeline-setup"
+BACKUP_DIR = "backups"
+CONFIG_FILE = os.path.join(PIPELINE_SETUP_DIR, "config.json")
+STEP_NAMES = ("concatenate", "fields", "profile", "map", "process", "load")
+DEFAULT_JOBS = 4
 
-def main():
-    # Define file paths
-    pipeline_setup_dir = "pipeline-setup"
-    backup_dir = "backups"
 
-    config_file = os.path.join(pipeline_setup_dir, "config.json")
+def _load_config(config_file):
+    with open(config_file, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-    # Load config or create a new one if it doesn't exist
+
+def _backup_config(config_file):
+    """
+    Copies the config file to the backup directory before it is overwritten.
+    """
     if os.path.exists(config_file):
-        with open(config_file, "r", encoding="utf-8") as f:
-            config = json.load(f)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        backup_file = os.path.join(BACKUP_DIR, f"config.json.{timestamp}.bak")
+        print(f"Backing up existing config.json to {backup_file}")
+        shutil.copy(config_file, backup_file)
+
+
+def _update_config(config_file, key, value):
+    """
+    Backs up the config file, then sets one of its top-level keys.
+    """
+    _backup_config(config_file)
+    config = _load_config(config_file)
+    config[key] = value
+    with open(config_file, "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2, ensure_ascii=False)
+
+
+def concatenate_step(raw_files, data_paths):
+    """
+    Steps 0 and 1: Concatenates the raw files and collects their fields in one pass.
+    """
+    concatenate_json_files(
+        raw_files, data_paths["concatenatedFile"], fields_output=data_paths["allFieldsFile"])
+
+
+def fields_step(config_file, data_paths):
+    """
+    Overwrites fields_to_keep in config.json with the fields collected from the raw files.
+    """
+    with open(data_paths["allFieldsFile"], "r") as f:
+        all_fields = json.load(f)
+    _update_config(config_file, "fields_to_keep", all_fields)
+    print(f"The 'fields_to_keep' section in '{config_file}' has been regenerated.")
+    print("Review it to curate the fields for the final dataset: stop the run with "
+          "'--to fields', edit the file, then continue with '--from profile'.")
+
+
+def profile_step(config_file, source_files, data_paths):
+    """
+    Step 3: Profiles the values of every field of the standardized records, and adds the
+    tags of the tag fields to the tag vocabularies in the same pass.
+    """
+    config = _load_config(config_file)
+    field_values_file = data_paths["fieldValuesFile"]
+    records = standardize_stage(iter_raw_records(source_files), config["fields_to_keep"])
+    collector = None
+    tags = config.get("tags") or {}
+    if tags.get("enabled", False) and data_paths.get("tagVocabularyPath"):
+        collector = TagCollector(tags.get("fields", []), tags.get("separator", DEFAULT_TAG_SEPARATOR))
+        records = collector.observe(records)
+    field_values = profile_field_values(records)
+    with open(field_values_file, "w", encoding="utf-8") as f:
+        json.dump(field_values, f, indent=2, ensure_ascii=False)
+    print(
+        f"Extracted field values for {len(field_values)} fields to {field_values_file}")
+    if collector is not None:
+        vocabularies = load_vocabularies(data_paths["tagVocabularyPath"])
+        added = collector.update(vocabularies)
+        save_vocabularies(data_paths["tagVocabularyPath"], vocabularies)
+        print(f"Added {added} new tags to the vocabularies in {data_paths['tagVocabularyPath']}")
+
+
+def map_step(config_file, data_paths):
+    """
+    Step 4: Generates the normalization map from the field value profiles.
+    """
+    new_normalization_map = generate_normalization_map(
+        data_paths["fieldValuesFile"], _load_config(config_file)["fields_to_keep"]
+    )
+    _update_config(config_file, "normalization_map", new_normalization_map)
+    print(f"The 'normalization_map' in '{config_file}' has been regenerated.")
+    print("Review it before relying on the output: stop the run with '--to map', "
+          "edit the file, then continue with '--from process'.")
+
+
+def process_step(config_file, source_files, raw_files, data_paths, intermediate_paths,
+                 incremental=False, workers=1, load_concurrency=0, engine="row",
+                 cache_size=DEFAULT_CACHE_SIZE, metrics=None):
+    """
+    Steps 0, 2, 5, 6 and 7: Streams the records through standardize, normalize, add IDs,
+    dedup, grouping, validation, derived features, the aggregate cube and tag encoding,
+    or updates the grouped output incrementally.
+    """
+    config = _load_config(config_file)
+    with open(data_paths["groupingConfigPath"], "r", encoding="utf-8") as f:
+        grouping_config = json.load(f)
+    # The grouping config and the grouped records are checked against the output schema,
+    # when there is one
+    schema = None
+    schema_path = data_paths.get("schemaPath")
+    if schema_path and os.path.exists(schema_path):
+        schema = _load_config(schema_path)
+    dedup = make_deduplicator(config.get("dedup"), data_paths.get(
+        "dedupIndexPath", os.path.join(data_paths["interimDir"], "dedup-index.sqlite")))
+    validator = make_validator(config.get("validation"), schema, data_paths.get("quarantinePath"))
+    vocabulary_path = data_paths.get("tagVocabularyPath")
+    tags = make_tag_codec(config.get("tags"), grouping_config, vocabulary_path)
+    if tags is not None and not vocabulary_path:
+        raise ValueError("Tag encoding needs dataPaths.tagVocabularyPath to save the vocabularies")
+    value_map = None
+    if data_paths.get("valueMapPath") and os.path.exists(data_paths["valueMapPath"]):
+        value_map = _load_config(data_paths["valueMapPath"])
+    cube = make_cube(config.get("cube"), grouping_config, value_map)
+    features = make_feature_set(config.get("derived_features"), grouping_config)
+    if cube is not None and not data_paths.get("cubePath"):
+        raise ValueError("The aggregate cube needs dataPaths.cubePath to be written")
+
+    # With --load-async, grouped records go straight from the last stage to MongoDB
+    sink = None
+    if load_concurrency:
+        def sink(records):
+            print("\n--- Step 8: Loading to MongoDB while streaming ---")
+            if tags is not None and config["tags"].get("decode_on_load", True):
+                # Each record is written to the output before it is decoded here
+                records = map(tags.decode, records)
+            stats = load_records_to_mongodb(
+                records,
+                os.getenv("MONGO_DB_NAME"),
+                os.getenv("MONGO_COLLECTION_NAME"),
+                os.getenv("MONGO_URI"),
+                concurrency=load_concurrency,
+                index_spec=_index_spec(data_paths),
+            )
+            if stats is None:
+                raise RuntimeError("nothing was loaded to MongoDB")
+
+    if incremental:
+        # Recompute only what changed since the last run
+        run_incremental_pipeline(
+            raw_files,
+            config["fields_to_keep"],
+            config["normalization_map"],
+            grouping_config,
+            data_paths["groupedDataPath"],
+            data_paths.get("cacheDir", os.path.join(
+                data_paths["interimDir"], "cache")),
+            sink=sink,
+            cache_size=cache_size,
+            schema=schema,
+            ids=config.get("ids"),
+            dedup=dedup,
+            validator=validator,
+            index=config.get("record_index", {}).get("enabled", False),
+            tags=tags,
+            cube=cube,
+            features=features,
+        )
+    else:
+        if metrics is not None:
+            print("Collecting metrics: values are normalized row by row, without the cache.")
+        run_streaming_pipeline(
+            source_files,
+            config["fields_to_keep"],
+            config["normalization_map"],
+            grouping_config,
+            data_paths["groupedDataPath"],
+            intermediate_paths,
+            workers=workers,
+            sink=sink,
+            engine=engine,
+            cache_size=cache_size,
+            metrics=metrics,
+            schema=schema,
+            ids=config.get("ids"),
+            dedup=dedup,
+            validator=validator,
+            index=config.get("record_index", {}).get("enabled", False),
+            tags=tags,
+            cube=cube,
+            features=features,
+        )
+    if dedup is not None and data_paths.get("dedupReportPath"):
+        dedup.write_report(data_paths["dedupReportPath"])
+        print(f"Dedup report written to {data_paths['dedupReportPath']}")
+    if tags is not None:
+        # Saved even if nothing changed, so that the output always has its vocabularies
+        save_vocabularies(vocabulary_path, tags.vocabularies)
+        print(f"Tag vocabularies written to {vocabulary_path}")
+    if cube is not None:
+        cells = write_cube(cube, data_paths["cubePath"])
+        print(f"Wrote {cells} cube cells to {data_paths['cubePath']}")
+        if load_concurrency:
+            _load_summary(config, data_paths)
+
+
+def _index_spec(data_paths):
+    """
+    The indexes to build after loading to MongoDB, and the dates to store as BSON dates,
+    or None if there is no index spec.
+    """
+    spec_path = data_paths.get("indexSpecPath")
+    if not spec_path or not os.path.exists(spec_path):
+        return None
+    return load_index_spec(spec_path, data_paths["groupingConfigPath"])
+
+
+def _load_summary(config, data_paths):
+    """
+    Replaces the summary collection with the cells of the aggregate cube.
+    """
+    collection = config["cube"].get("collection") or f"{os.getenv('MONGO_COLLECTION_NAME')}_summary"
+    cells = load_summary_to_mongodb(
+        data_paths["cubePath"],
+        os.getenv("MONGO_DB_NAME"),
+        collection,
+        os.getenv("MONGO_URI"),
+    )
+    if cells is None:
+        raise RuntimeError("the aggregate cube was not loaded to MongoDB")
+
+
+def load_step(config_file, data_paths):
+    """
+    Step 8: Loads the grouped output to MongoDB, with tag fields decoded unless the
+    'tags' settings say otherwise, then builds the indexes of the index spec. The
+    aggregate cube, when enabled, replaces the summary collection.
+    """
+    config = _load_config(config_file)
+    transform = None
+    if config.get("tags", {}).get("decode_on_load", True):
+        codec = load_tag_codec(config_file)
+        transform = codec.decode if codec is not None else None
+    stats = load_to_mongodb(
+        data_paths["groupedDataPath"],
+        os.getenv("MONGO_DB_NAME"),
+        os.getenv("MONGO_COLLECTION_NAME"),
+        os.getenv("MONGO_URI"),
+        transform=transform,
+        index_spec=_index_spec(data_paths),
+    )
+    if stats is None:
+        raise RuntimeError("nothing was loaded to MongoDB")
+    if config.get("cube", {}).get("enabled", False):
+        _load_summary(config, data_paths)
+
+
+def _existing(paths):
+    """The given paths that are set and exist."""
+    return [path for path in paths if path and os.path.exists(path)]
+
+
+def build_pipeline_dag(config_file, data_paths, raw_files, regenerate_fields=False,
+                       regenerate_map=False, load=False, concatenating=False,
+                       write_intermediates=False, incremental=False, workers=1,
+                       load_concurrency=0, engine="row", cache_size=DEFAULT_CACHE_SIZE,
+                       metrics=None):
+    """
+    Declares the steps of the pipeline with the files and config keys they read and write.
+
+    :param config_file: Path to config.json.
+    :param data_paths: The dataPaths section of config.json.
+    :param raw_files: Paths of the raw JSON files.
+    :param regenerate_fields: Enable the 'concatenate' and 'fields' steps.
+    :param regenerate_map: Enable the 'profile' and 'map' steps.
+    :param load: Enable the 'load' step.
+    :param concatenating: Whether the 'concatenate' step runs, in which case the later
+        steps read the concatenated file instead of parsing the raw files again.
+    :return: A PipelineDag.
+    """
+    fields_key = f"{config_file}{KEY_SEPARATOR}fields_to_keep"
+    map_key = f"{config_file}{KEY_SEPARATOR}normalization_map"
+    ids_key = f"{config_file}{KEY_SEPARATOR}ids"
+    dedup_key = f"{config_file}{KEY_SEPARATOR}dedup"
+    validation_key = f"{config_file}{KEY_SEPARATOR}validation"
+    index_key = f"{config_file}{KEY_SEPARATOR}record_index"
+    tags_key = f"{config_file}{KEY_SEPARATOR}tags"
+    cube_key = f"{config_file}{KEY_SEPARATOR}cube"
+    features_key = f"{config_file}{KEY_SEPARATOR}derived_features"
+    # Optional files are only inputs when they exist: a step fails on a missing input
+    schema_inputs = _existing([data_paths.get("schemaPath")])
+    index_spec_inputs = _existing([data_paths.get("indexSpecPath")])
+    source_files = [data_paths["concatenatedFile"]] if concatenating else raw_files
+    # The incremental run keeps per-file state, so it always reads the raw files
+    process_sources = raw_files if incremental else source_files
+    # The cube is only written, and its dimensions only read, when it is enabled
+    cube_inputs, cube_outputs = [], []
+    if _load_config(config_file).get("cube", {}).get("enabled", False):
+        cube_outputs = [data_paths["cubePath"]]
+        cube_inputs = _existing([data_paths.get("valueMapPath")])
+
+    # Intermediate files are only written on request
+    intermediate_paths = {}
+    if write_intermediates and not incremental:
+        if not concatenating:
+            intermediate_paths["concatenated"] = data_paths["concatenatedFile"]
+        intermediate_paths["standardized"] = data_paths["standardizedFile"]
+        intermediate_paths["with_ids"] = data_paths["finalDataPath"]
+        if data_paths["normalizedDataPath"] != data_paths["finalDataPath"]:
+            intermediate_paths["normalized"] = data_paths["normalizedDataPath"]
+
+    steps = [
+        Step("concatenate", functools.partial(concatenate_step, raw_files, data_paths),
+             inputs=raw_files,
+             outputs=[data_paths["concatenatedFile"], data_paths["allFieldsFile"]],
+             enabled=regenerate_fields,
+             description="Concatenating raw files and collecting fields"),
+        Step("fields", functools.partial(fields_step, config_file, data_paths),
+             inputs=[data_paths["allFieldsFile"]],
+             outputs=[fields_key],
+             enabled=regenerate_fields,
+             description="Regenerating 'fields_to_keep'"),
+        Step("profile", functools.partial(profile_step, config_file, source_files, data_paths),
+             inputs=source_files + [fields_key, tags_key],
+             outputs=[data_paths["fieldValuesFile"]],
+             enabled=regenerate_map,
+             description="Profiling field values"),
+        Step("map", functools.partial(map_step, config_file, data_paths),
+             inputs=[data_paths["fieldValuesFile"], fields_key],
+             outputs=[map_key],
+             enabled=regenerate_map,
+             description="Generating normalization map"),
+        Step("process", functools.partial(
+                 process_step, config_file, source_files, raw_files, data_paths,
+                 intermediate_paths, incremental, workers, load_concurrency, engine,
+                 cache_size, metrics),
+             inputs=process_sources + [fields_key, map_key, ids_key, dedup_key, validation_key,
+                                       index_key, tags_key, cube_key, features_key,
+                                       data_paths["groupingConfigPath"]]
+             + schema_inputs + cube_inputs,
+             outputs=[data_paths["groupedDataPath"]] + cube_outputs
+             + [path for name, path in intermediate_paths.items() if name != "concatenated"],
+             params={"incremental": incremental, "intermediates": sorted(intermediate_paths),
+                     "load_async": bool(load_concurrency)},
+             description="Streaming raw records to grouped output"),
+        Step("load", functools.partial(load_step, config_file, data_paths),
+             inputs=[data_paths["groupedDataPath"], tags_key, cube_key,
+                     data_paths["groupingConfigPath"]] + index_spec_inputs + cube_outputs,
+             params={"db": os.getenv("MONGO_DB_NAME"),
+                     "collection": os.getenv("MONGO_COLLECTION_NAME")},
+             enabled=load and not load_concurrency,
+             description="Loading to MongoDB"),
+    ]
+    return PipelineDag(steps)
+
+
+def _incremental_conflicts(workers=1, engine="row", metrics_path=None, prometheus_path=None):
+    """
+    Returns the options that an incremental run does not support: it normalizes in one
+    process, record by record, and has no per-stage metrics.
+    """
+    conflicts = []
+    if workers > 1:
+        conflicts.append("--workers")
+    if engine != "row":
+        conflicts.append("--engine")
+    if metrics_path:
+        conflicts.append("--metrics")
+    if prometheus_path:
+        conflicts.append("--prometheus")
+    return conflicts
+
+
+def main(write_intermediates=False, workers=1, incremental=False, load_concurrency=0,
+         engine="row", cache_size=DEFAULT_CACHE_SIZE, metrics_path=None, prometheus_path=None,
+         profile_dir=None, trace_memory=False, regenerate_fields=False, regenerate_map=False,
+         load=False, start=None, stop=None, only=None, resume=False, jobs=DEFAULT_JOBS):
+    """
+    Runs the pipeline steps selected by `start`, `stop` and `only`.
+
+    :return: True if every selected step completed.
+    """
+    if incremental:
+        conflicts = _incremental_conflicts(workers, engine, metrics_path, prometheus_path)
+        if conflicts:
+            print(f"Error: --incremental cannot be combined with {', '.join(conflicts)}")
+            return False
+    # Load config or create a new one if it doesn't exist
+    if os.path.exists(CONFIG_FILE):
+        config = _load_config(CONFIG_FILE)
     else:
         print(
-            f"Config file not found at {config_file}. A new one will be generated.")
+            f"Config file not found at {CONFIG_FILE}. A new one will be generated.")
         config = {"fields_to_keep": [],
                   "normalization_map": {}, "dataPaths": {}}
-    fields_to_keep = config["fields_to_keep"]
-    normalization_map = config["normalization_map"]
     data_paths = config["dataPaths"]
 
     # Ensure directories exist
     os.makedirs(data_paths["interimDir"], exist_ok=True)
     os.makedirs(data_paths["processedDir"], exist_ok=True)
-    os.makedirs(backup_dir, exist_ok=True)
+    os.makedirs(BACKUP_DIR, exist_ok=True)
 
-    # Step 0: Concatenate raw data
     raw_files = [
         os.path.join(data_paths["rawDir"], f)
         for f in os.listdir(data_paths["rawDir"])
         if f.endswith(".json")
     ]
-    concatenated_file = data_paths["concatenatedFile"]
-    print("--- Step 0: Concatenating files ---")
-    concatenate_json_files(raw_files, concatenated_file)
-
-    # Step 1: Collect fields
-    fields_file = data_paths["allFieldsFile"]
-    print("\n--- Step 1: Collecting fields ---")
-    collect_fields_from_json_files([concatenated_file], fields_file)
-
-    # --- Optional Step: Curate fields ---
-    regenerate_fields = (
-        input("Do you want to regenerate the 'fields_to_keep' list? (y/N): ")
-        .lower()
-        .strip()
-        == "y"
-    )
-    if regenerate_fields:
-        # Back up the existing config file before overwriting it
-        if os.path.exists(config_file):
-            timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-            backup_file = os.path.join(
-                backup_dir, f"config.json.{timestamp}.bak")
-            print(f"Backing up existing config.json to {backup_file}")
-            shutil.copy(config_file, backup_file)
-
-        # Overwrite fields-to-keep in config.json with the latest from all-fields.json
-        with open(fields_file, "r") as f:
-            all_fields = json.load(f)
-        config["fields_to_keep"] = all_fields
-        with open(config_file, "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
-
-        print(f"\n--- Manual Step: Edit the list of fields to keep ---")
-        print(
-            f"The 'fields_to_keep' section in 'config.json' has been regenerated at: {config_file}"
-        )
-        print("Please review this file to curate the fields for the final dataset.")
-        input("Press Enter to continue after editing the file...")
 
-        # Reload config after manual edit
-        with open(config_file, "r", encoding="utf-8") as f:
-            config = json.load(f)
-    else:
-        print("Skipping 'fields_to_keep' regeneration.")
+    metrics = None
+    if metrics_path or prometheus_path or profile_dir or trace_memory:
+        metrics = PipelineMetrics(profile_dir, trace_memory)
+        if trace_memory:
+            # tracemalloc traces the whole process, so steps must not overlap
+            jobs = 1
 
-    # Step 2: Standardize fields
-    standardized_file = data_paths["standardizedFile"]
-    print("\n--- Step 2: Standardizing fields ---")
-    standardize_fields(fields_to_keep, concatenated_file, standardized_file)
+    options = dict(write_intermediates=write_intermediates, incremental=incremental,
+                   workers=workers, load_concurrency=load_concurrency, engine=engine,
+                   cache_size=cache_size, metrics=metrics)
+    dag = build_pipeline_dag(CONFIG_FILE, data_paths, raw_files, regenerate_fields,
+                             regenerate_map, load, **options)
+    try:
+        selected = dag.select(start, stop, only)
+        if "concatenate" in selected:
+            dag = build_pipeline_dag(CONFIG_FILE, data_paths, raw_files, regenerate_fields,
+                                     regenerate_map, load, concatenating=True, **options)
+        dag.check_inputs(selected)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return False
+    if not selected:
+        print("No step to run.")
+        return True
+    print(f"Running steps: {', '.join(selected)}")
 
-    # Step 3: Extract field values
-    field_values_file = data_paths["fieldValuesFile"]
-    print("\n--- Step 3: Extracting field values ---")
-    collect_field_values(standardized_file, field_values_file)
-
-    # Step 4: Generate normalization map
-    print("\n--- Step 4: Generating normalization map ---")
-    regenerate_map = (
-        input("Do you want to regenerate the 'normalization_map'? (y/N): ")
-        .lower()
-        .strip()
-        == "y"
-    )
-    if regenerate_map:
-        # Backup existing config before overwriting
-        if os.path.exists(config_file):
-            timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-            backup_file = os.path.join(
-                backup_dir, f"config.json.{timestamp}.bak")
-            print(f"Backing up existing config to {backup_file}")
-            shutil.copy(config_file, backup_file)
-
-        new_normalization_map = generate_normalization_map(
-            field_values_file, config["fields_to_keep"]
-        )
-        config["normalization_map"] = new_normalization_map
-        with open(config_file, "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+    def step(name, func):
+        if metrics is None:
+            return func
 
-        print(
-            f"Please review and edit the normalization map in: {config_file}")
-        input("Press Enter to continue after editing the map...")
+        def measured():
+            with metrics.step(name):
+                return func()
+        return measured
 
-        # Reload config after manual edit
-        with open(config_file, "r", encoding="utf-8") as f:
-            config = json.load(f)
-    else:
-        # Step 5: Normalize field values
-        print("Skipping 'normalization_map' regeneration.")
-    normalized_file = data_paths["normalizedDataPath"]
-    print("\n--- Step 5: Normalizing field values ---")
-    normalize_field_value(
-        normalization_map, standardized_file, normalized_file)
-
-    # Step 6: Generate IDs
-    final_data_file = data_paths["finalDataPath"]
-    print("\n--- Step 6: Generating IDs ---")
-    add_ids_to_data(normalized_file, final_data_file)
-
-    # Step 7: Group fields
-    print("\n--- Step 7: Grouping fields ---")
-    run_grouping(data_paths)
-
-    # Step 8: Load to MongoDB
-    load_to_db = (
-        input("\nDo you want to load the data to MongoDB? (y/N): ").lower().strip()
-        == "y"
-    )
-    if load_to_db:
-        print("\n--- Step 8: Loading to MongoDB ---")
-        mongo_uri = os.getenv("MONGO_URI")
-        db_name = os.getenv("MONGO_DB_NAME")
-        collection_name = os.getenv("MONGO_COLLECTION_NAME")
-        load_to_mongodb(
-            data_paths["groupedDataPath"], db_name, collection_name, mongo_uri
-        )
-    else:
-        print("\nSkipping loading to MongoDB.")
+    checkpoint_path = data_paths.get(
+        "checkpointFile", os.path.join(data_paths["interimDir"], "checkpoint.json"))
+    succeeded = dag.run(selected, checkpoint_path, resume, jobs, wrap=step)
+
+    if metrics is not None:
+        metrics.write(metrics_path, prometheus_path)
 
-    print("\n--- Pipeline finished ---")
+    print("\n--- Pipeline finished ---" if succeeded else "\n--- Pipeline failed ---")
+    return succeeded
 
 
 if __name__ == "__main__":
+    import argparse
+    import sys
     from dotenv import load_dotenv
 
+    parser = argparse.ArgumentParser(
+        description="Run the data processing pipeline.",
+        epilog=f"Steps, in order: {', '.join(STEP_NAMES)}. 'concatenate' and 'fields' run "
+               f"with --regenerate-fields, 'profile' and 'map' with --regenerate-map, and "
+               f"'load' with --load.")
+    parser.add_argument(
+        "--regenerate-fields", action="store_true",
+        help="Regenerate 'fields_to_keep' in config.json from the raw files.")
+    parser.add_argument(
+        "--regenerate-map", action="store_true",
+        help="Regenerate 'normalization_map' in config.json from the field value profiles.")
+    parser.add_argument(
+        "--load", action="store_true", help="Load the grouped output to MongoDB.")
+    parser.add_argument(
+        "--from", dest="start", choices=STEP_NAMES,
+        help="Start at this step, skipping the steps upstream of it.")
+    parser.add_argument(
+        "--to", dest="stop", choices=STEP_NAMES,
+        help="Stop after this step, skipping the steps downstream of it.")
+    parser.add_argument(
+        "--only", nargs="+", choices=STEP_NAMES, metavar="STEP",
+        help="Run only these steps, even if their flag is not given.")
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Skip the steps that completed in an earlier run and whose inputs did not change.")
+    parser.add_argument(
+        "--jobs", type=int, default=DEFAULT_JOBS,
+        help="Maximum number of independent steps running at the same time.")
+    parser.add_argument(
+        "--write-intermediates", action="store_true",
+        help="Also write the concatenated, standardized and normalized files from dataPaths.")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Number of processes for normalization, ID generation and grouping.")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only recompute the raw files and fields whose content or config changed.")
+    parser.add_argument(
+        "--load-async", type=int, default=0, metavar="CONCURRENCY",
+        help="Stream the grouped records into MongoDB with this many concurrent writers.")
+    parser.add_argument(
+        "--engine", choices=["row", "columnar"], default="row",
+        help="Normalize record by record, or column by column in chunks.")
+    parser.add_argument(
+        "--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+        help="Distinct values memoized per field during normalization (0 disables the cache).")
+    parser.add_argument(
+        "--metrics", metavar="FILE",
+        help="Write the time, records and bytes of every stage and the normalization counters as JSON.")
+    parser.add_argument(
+        "--prometheus", metavar="FILE",
+        help="Write the same metrics in the Prometheus text format.")
+    parser.add_argument(
+        "--profile-dir", metavar="DIR",
+        help="Run every step under cProfile and dump its stats to DIR/<step>.prof.")
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="Record the peak traced memory and top allocation sites of every step.")
+    args = parser.parse_args()
+    if args.only and (args.start or args.stop):
+        parser.error("--only cannot be combined with --from or --to")
+    if args.incremental:
+        conflicts = _incremental_conflicts(args.workers, args.engine, args.metrics, args.prometheus)
+        if conflicts:
+            parser.error(f"--incremental cannot be combined with {', '.join(conflicts)}")
+
     load_dotenv()
-    main()
+    succeeded = main(write_intermediates=args.write_intermediates,
+                     workers=args.workers, incremental=args.incremental,
+                     load_concurrency=args.load_async, engine=args.engine,
+                     cache_size=args.cache_size, metrics_path=args.metrics,
+                     prometheus_path=args.prometheus, profile_dir=args.profile_dir,
+                     trace_memory=args.trace_memory, regenerate_fields=args.regenerate_fields,
+                     regenerate_map=args.regenerate_map, load=args.load, start=args.start,
+                     stop=args.stop, only=args.only, resume=args.resume, jobs=args.jobs)
+    sys.exit(0 if succeeded else 1)
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# The packages live in src/, which the scripts put on the path themselves
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+
+@pytest.fixture
+def mongo_server(monkeypatch):
+    """An in-memory MongoDB server (mongomock)."""
+    mongomock = pytest.importorskip("mongomock")
+    # pymongo 4.11+ passes `sort` to bulk replaces, which mongomock 4.3 does not take
+    add_replace = mongomock.collection.BulkOperationBuilder.add_replace
+
+    def add_replace_without_sort(self, selector, doc, upsert, sort=None, **kwargs):
+        assert sort is None
+        return add_replace(self, selector, doc, upsert, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.BulkOperationBuilder, "add_replace", add_replace_without_sort)
+    return mongomock.MongoClient()
@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from loading import async_load
+from loading.async_load import load_records_to_mongodb
+
+URI = "mongodb://localhost:27017"
+DB = "eduvisa"
+COLLECTION = "applications"
+
+
+class _AsyncCursor:
+    def __init__(self, documents):
+        self._documents = iter(documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._documents)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _AsyncCollection:
+    """The asynchronous collection methods the loader uses, over a mongomock collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def index_information(self):
+        return self.collection.index_information()
+
+    async def drop_index(self, name):
+        self.collection.drop_index(name)
+
+    async def create_index(self, keys, **kwargs):
+        return self.collection.create_index(keys, **kwargs)
+
+    async def bulk_write(self, operations, ordered=True):
+        # Give the other writers a turn, as a network round trip would
+        await asyncio.sleep(0)
+        return self.collection.bulk_write(operations, ordered=ordered)
+
+    def find(self, *args, **kwargs):
+        return _AsyncCursor(list(self.collection.find(*args, **kwargs)))
+
+    async def delete_many(self, query):
+        return self.collection.delete_many(query)
+
+    async def rename(self, name, **kwargs):
+        self.collection.rename(name, **kwargs)
+
+
+class _AsyncClient:
+    def __init__(self, server):
+        self.server = server
+        self.collections = {}
+
+    def __getitem__(self, db_name):
+        client = self
+
+        class _Db:
+            async def drop_collection(self, name):
+                client.server[db_name].drop_collection(name)
+
+            def __getitem__(self, name):
+                return client.collections.setdefault(
+                    (db_name, name), _AsyncCollection(client.server[db_name][name]))
+
+        return _Db()
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch, mongo_server):
+    async_client = _AsyncClient(mongo_server)
+    monkeypatch.setattr(async_load, "AsyncMongoClient", lambda uri, **kwargs: async_client)
+    return async_client
+
+
+def _documents(count, repeat=()):
+    documents = [{"id": f"id-{i}", "n": i} for i in range(count)]
+    return documents + [{"id": f"id-{i}", "n": -i} for i in repeat]
+
+
+def _load(documents, **kwargs):
+    return load_records_to_mongodb(iter(documents), DB, COLLECTION, URI,
+                                   batch_size=3, concurrency=4, **kwargs)
+
+
+def test_concurrent_load_creates_unique_index(client, mongo_server):
+    stats = _load(_documents(20, repeat=[1, 5, 19]))
+    collection = mongo_server[DB][COLLECTION]
+    assert stats["documents"] == 23
+    assert collection.count_documents({}) == 20
+    assert collection.index_information()["id_1"].get("unique") is True
+    # The last upsert of a repeated id wins
+    assert collection.find_one({"id": "id-19"})["n"] == -19
+
+
+def test_rerun_upserts_without_duplicates(client, mongo_server):
+    _load(_documents(20))
+    stats = _load(_documents(15))
+    collection = mongo_server[DB][COLLECTION]
+    assert (stats["inserted"], stats["replaced"], stats["deleted"]) == (0, 15, 5)
+    assert collection.count_documents({}) == 15
+    assert len(collection.distinct("id")) == 15
+
+
+def test_non_unique_id_index_is_replaced_before_writing(client, mongo_server):
+    collection = mongo_server[DB][COLLECTION]
+    collection.create_index("id")
+    _load(_documents(5))
+    assert collection.index_information()["id_1"].get("unique") is True
+
+
+def test_duplicate_key_race_is_retried(client, mongo_server):
+    collection = client[DB][COLLECTION]
+    bulk_write = collection.bulk_write
+    raced = []
+
+    async def racing_bulk_write(operations, ordered=True):
+        if not raced:
+            # The first upsert of this batch loses a race on a new id to another writer
+            raced.append(True)
+            result = await bulk_write(operations[1:], ordered=ordered)
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "E11000"}],
+                                  "nUpserted": result.upserted_count, "nMatched": result.matched_count})
+        return await bulk_write(operations, ordered=ordered)
+
+    collection.bulk_write = racing_bulk_write
+    stats = _load(_documents(6))
+    assert stats["documents"] == 6
+    assert stats["inserted"] == 6
+    assert mongo_server[DB][COLLECTION].count_documents({}) == 6
+
+
+def test_other_write_errors_propagate(client):
+    collection = client[DB][COLLECTION]
+
+    async def failing_bulk_write(operations, ordered=True):
+        raise BulkWriteError({"writeErrors": [{"index": 0, "code": 121, "errmsg": "validation"}]})
+
+    collection.bulk_write = failing_bulk_write
+    with pytest.raises(BulkWriteError):
+        _load(_documents(6))
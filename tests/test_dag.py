@@ -0,0 +1,71 @@
+import json
+import os
+import time
+
+from dataprocessing.dag import PipelineDag, Step
+from run_pipeline import build_pipeline_dag
+
+from conftest import ROOT
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_consumer_runs_after_producer(tmp_path):
+    produced = str(tmp_path / "produced.txt")
+    order = []
+
+    def produce():
+        time.sleep(0.2)
+        _write(produced, "data")
+        order.append("produce")
+
+    def consume():
+        with open(produced, encoding="utf-8") as f:
+            order.append(f.read())
+
+    dag = PipelineDag([Step("produce", produce, outputs=[produced]),
+                       Step("consume", consume, inputs=[produced])])
+    assert dag.run(dag.select(), jobs=4)
+    assert order == ["produce", "data"]
+
+
+def test_step_fails_on_missing_input(tmp_path, capsys):
+    ran = []
+    missing = str(tmp_path / "missing.txt")
+    dag = PipelineDag([Step("read", lambda: ran.append(True), inputs=[missing])])
+    assert not dag.run(dag.select())
+    assert ran == []
+    assert "missing input" in capsys.readouterr().out
+
+
+def test_failed_producer_stops_consumer(tmp_path):
+    produced = str(tmp_path / "produced.txt")
+    ran = []
+
+    def produce():
+        raise RuntimeError("boom")
+
+    dag = PipelineDag([Step("produce", produce, outputs=[produced]),
+                       Step("consume", lambda: ran.append(True), inputs=[produced])])
+    assert not dag.run(dag.select(), jobs=2)
+    assert ran == []
+
+
+def test_pipeline_steps_read_the_concatenated_file():
+    config_file = os.path.join(ROOT, "pipeline-setup", "config.json")
+    with open(config_file, encoding="utf-8") as f:
+        data_paths = json.load(f)["dataPaths"]
+    raw_files = [os.path.join(data_paths["rawDir"], name) for name in ("2023.json", "2024.json")]
+
+    dag = build_pipeline_dag(config_file, data_paths, raw_files, regenerate_fields=True,
+                             regenerate_map=True, concatenating=True)
+    for name in ("profile", "process"):
+        assert data_paths["concatenatedFile"] in dag.steps[name].inputs
+        assert "concatenate" in dag.dependencies(name)
+
+    dag = build_pipeline_dag(config_file, data_paths, raw_files, regenerate_map=True)
+    for name in ("profile", "process"):
+        assert "concatenate" not in dag.dependencies(name)
@@ -0,0 +1,118 @@
+import copy
+import glob
+import json
+import os
+
+import pytest
+
+from dataprocessing.features import compare_with_reference, make_feature_set
+from dataprocessing.pipeline import run_streaming_pipeline
+from dataprocessing.recordio import iter_records
+
+from conftest import ROOT
+
+EDGE_DATES = [None, "", "not a date", "2024-02-30", "2024-13-01", "2024/01/15", "15-01-2024",
+              20240115, 2.5, True, ["2024-01-15"], {"date": "2024-01-15"},
+              "2024-01-15", "2024-01-15T23:59:59Z", "2024-02-29", "0001-01-01", "9999-12-31"]
+# A date field left out of the record
+_MISSING = object()
+
+
+def _load(name):
+    with open(os.path.join(ROOT, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def config():
+    return _load("pipeline-setup/config.json")
+
+
+@pytest.fixture(scope="module")
+def grouping_config():
+    return _load("pipeline-setup/grouping.json")
+
+
+@pytest.fixture(scope="module")
+def features(config, grouping_config):
+    # The features of config.json, whether or not they are enabled there
+    settings = dict(config["derived_features"], enabled=True)
+    return make_feature_set(settings, grouping_config)
+
+
+@pytest.fixture(scope="module")
+def grouped(tmp_path_factory, config, grouping_config):
+    """The grouped records of the sample data, without the optional stages."""
+    output = str(tmp_path_factory.mktemp("grouped") / "grouped-data.json")
+    raw_files = sorted(glob.glob(os.path.join(ROOT, "data", "raw", "*.json")))
+    run_streaming_pipeline(raw_files, config["fields_to_keep"], config["normalization_map"],
+                           grouping_config, output, ids=config.get("ids"))
+    return list(iter_records(output))
+
+
+def _set(record, path, value):
+    for key in path[:-1]:
+        record = record.setdefault(key, {})
+    if value is _MISSING:
+        record.pop(path[-1], None)
+    else:
+        record[path[-1]] = value
+
+
+def test_derived_features_are_opt_in(config, grouping_config):
+    assert config["derived_features"]["enabled"] is False
+    assert make_feature_set(config["derived_features"], grouping_config) is None
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 10_000])
+def test_columns_agree_with_rows_on_sample_data(grouped, features, chunk_size):
+    assert compare_with_reference(copy.deepcopy(grouped), features, chunk_size) == []
+
+
+def test_sample_data_exercises_every_feature(grouped, features):
+    derived = [record[features.key] for record in features.derive_chunk(copy.deepcopy(grouped))]
+    for feature in features.features:
+        assert any(row[feature.name] is not None for row in derived), feature.name
+
+
+def _edge_records(features, template):
+    """Records pairing every edge value of each date field with every other one."""
+    date_paths = [features.paths[field] for field in features.date_fields]
+    records = []
+    for start in EDGE_DATES + [_MISSING]:
+        for end in EDGE_DATES + [_MISSING]:
+            record = copy.deepcopy(template)
+            for i, path in enumerate(date_paths):
+                _set(record, path, start if i % 2 == 0 else end)
+            records.append(record)
+    return records
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 10_000])
+def test_columns_agree_with_rows_on_edge_dates(grouped, features, chunk_size):
+    records = _edge_records(features, grouped[0])
+    assert compare_with_reference(records, features, chunk_size) == []
+
+
+def test_edge_dates(features):
+    deposit = features.paths["deposit_date"]
+    retrieval = features.paths["retrieval_date"]
+
+    def derive(deposit_date, retrieval_date):
+        record = {}
+        _set(record, deposit, deposit_date)
+        _set(record, retrieval, retrieval_date)
+        return features.derive_chunk([record])[0][features.key]
+
+    # Reversed ranges give negative intervals
+    assert derive("2024-03-01", "2024-02-01")["deposit_to_retrieval_days"] == -29
+    assert derive("2024-02-01", "2024-03-01")["deposit_to_retrieval_days"] == 29
+    assert derive("2024-01-15T23:59:59Z", "2024-01-16")["deposit_to_retrieval_days"] == 1
+    # Missing and unparsable dates give nulls, not errors
+    for value in [_MISSING, None, "", "2024-02-30", "not a date", 20240115, True]:
+        row = derive(value, "2024-02-01")
+        assert row["deposit_to_retrieval_days"] is None
+        assert row["deposit_month"] is None
+        assert row["deposit_weekday"] is None
+    row = derive("0001-01-01", "9999-12-31")
+    assert (row["deposit_month"], row["deposit_weekday"]) == ("0001-01", 0)
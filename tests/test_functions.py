@@ -0,0 +1,78 @@
+import pytest
+
+from dataprocessing.functions import FUNCTION_REGISTRY, FunctionRegistry
+
+
+def _registry():
+    registry = FunctionRegistry()
+    registry.plugins_loaded = True
+    registry["plain"] = lambda value, item=None: f"<{value}>"
+    return registry
+
+
+def test_plain_callable_resolves_by_name_or_name_only_dict():
+    registry = _registry()
+    assert registry.resolve("plain") is registry["plain"]
+    assert registry.resolve({"name": "plain"}) is registry["plain"]
+    assert registry.resolve({"name": "missing"}) is None
+
+
+def test_plain_callable_rejects_settings():
+    with pytest.raises(ValueError, match="does not take settings"):
+        _registry().resolve({"name": "plain", "bins": [400]})
+
+
+def test_transform_function_binds_settings():
+    bucket = FUNCTION_REGISTRY.resolve({"name": "bucket", "bins": [400]})
+    assert bucket(300) != bucket(500)
+    with pytest.raises(ValueError, match="does not take"):
+        FUNCTION_REGISTRY.resolve({"name": "bucket", "bins": [400], "unknown": 1})
+
+
+@pytest.mark.parametrize("text,guessed,comma,dot", [
+    ("12", 12, 12, 12),
+    ("-0,5", -0.5, -0.5, None),
+    ("1,5", 1.5, 1.5, None),
+    ("1,2345", 1.2345, 1.2345, None),
+    # One separator before three digits reads either way
+    ("1,234", None, 1.234, 1234),
+    ("1.234", None, 1234, 1.234),
+    # A repeated separator groups thousands
+    ("1,234,567", 1234567, None, 1234567),
+    ("1.234.567", 1234567, 1234567, None),
+    # With both separators, the last one is the decimal one
+    ("1,234.50", 1234.5, None, 1234.5),
+    ("1.234,50", 1234.5, 1234.5, None),
+    ("-1,234,567.25", -1234567.25, None, -1234567.25),
+    ("1 234,50 €", 1234.5, 1234.5, None),
+    ("12,34,567", None, None, None),
+    ("1.234,567.8", None, None, None),
+    ("1,", None, None, None),
+    ("abc", None, None, None),
+])
+def test_parse_number(text, guessed, comma, dot):
+    for spec, expected in [("parse_number", guessed),
+                           ({"name": "parse_number", "decimal": ","}, comma),
+                           ({"name": "parse_number", "decimal": "."}, dot)]:
+        result = FUNCTION_REGISTRY.resolve(spec)(text)
+        assert result == expected and type(result) is type(expected), (spec, result)
+
+
+def test_parse_number_rejects_other_decimal_separators():
+    with pytest.raises(ValueError, match="'decimal'"):
+        FUNCTION_REGISTRY.resolve({"name": "parse_number", "decimal": " "})
+
+
+@pytest.mark.parametrize("name,value,expected", [
+    ("to_uppercase", "réunion", "RÉUNION"),
+    ("trim", "  a b  ", "a b"),
+    ("collapse_whitespace", " a \t b\n", "a b"),
+    ("split_comma", "a,b", ["a", "b"]),
+    ("strip_accents", "Réunion Île", "Reunion Ile"),
+    ("parse_date", "15/01/2024", "2024-01-15"),
+    ("parse_date", "2024-01-15T10:00:00", "2024-01-15"),
+    ("parse_date", "31/02/2024", None),
+    ("to_uppercase", 12, 12),
+])
+def test_built_ins(name, value, expected):
+    assert FUNCTION_REGISTRY.resolve(name)(value) == expected
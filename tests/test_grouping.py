@@ -0,0 +1,113 @@
+import json
+import os
+
+import pytest
+
+from dataprocessing.grouping import _process_grouping_level, compile_grouping, validate_grouping
+from dataprocessing.pipeline import run_streaming_pipeline
+
+from conftest import ROOT
+
+GROUPING = {
+    "id": "id",
+    "outcome": "decision",
+    "profile": {"age": "age", "id": "id", "nested": {"city": "city"}},
+    "it's \"quoted\"\n": "odd\\field",
+    "ignored": 3,
+}
+SCHEMA = {
+    "type": "object",
+    "required": ["id", "outcome", "profile"],
+    "properties": {
+        "id": {"type": "string"},
+        "outcome": {"type": "string"},
+        "profile": {"type": "object", "required": ["age", "nested"],
+                    "properties": {"age": {"type": "integer"}, "id": {"type": "string"},
+                                   "nested": {"type": "object", "properties": {"city": {}}}}},
+        "it's \"quoted\"\n": {},
+    },
+}
+FIELDS = ["decision", "age", "city", "odd\\field"]
+
+
+def _load(name):
+    with open(os.path.join(ROOT, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("record", [
+    {"id": "a", "decision": "APPROVED", "age": 20, "city": "Paris", "odd\\field": 1},
+    {"id": "a", "decision": "APPROVED"},
+    {"age": None, "city": "Lyon"},
+    {},
+])
+def test_compiled_grouping_matches_reference(record):
+    project = compile_grouping(GROUPING)
+    assert json.dumps(project(record)) == json.dumps(_process_grouping_level(record, GROUPING))
+
+
+def test_compiled_repo_grouping_matches_reference():
+    grouping = _load("pipeline-setup/grouping.json")
+    fields = _load("pipeline-setup/config.json")["fields_to_keep"]
+    project = compile_grouping(grouping)
+    full = {field: i for i, field in enumerate(fields + ["id"])}
+    partial = {field: i for i, field in enumerate(fields[::2])}
+    for record in (full, partial, {}):
+        assert json.dumps(project(record)) == json.dumps(_process_grouping_level(record, grouping))
+
+
+def test_consistent_grouping_has_no_messages():
+    assert validate_grouping(GROUPING, FIELDS, SCHEMA) == []
+
+
+def test_fields_missing_from_fields_to_keep():
+    messages = validate_grouping(GROUPING, ["decision", "age", "odd\\field"])
+    assert messages == ["grouping.json reads 1 field(s) that are not in fields_to_keep, "
+                        "so they are never in the grouped output: city"]
+
+
+def test_fields_left_out_of_grouping():
+    messages = validate_grouping(GROUPING, FIELDS + ["unused", "other"])
+    assert messages == ["2 field(s) of fields_to_keep are not in grouping.json and are "
+                        "left out of the grouped output: unused, other"]
+
+
+def test_paths_not_described_by_schema():
+    grouping = dict(GROUPING, extra="age", profile=dict(GROUPING["profile"], more="city"))
+    messages = validate_grouping(grouping, schema=SCHEMA)
+    assert messages == ["grouping.json produces 2 path(s) that schema.json does not "
+                        "describe: profile.more, extra"]
+
+
+def test_type_mismatches_with_schema():
+    grouping = dict(GROUPING, outcome={"value": "decision"}, profile=dict(GROUPING["profile"], nested="city"))
+    messages = validate_grouping(grouping, schema=SCHEMA)
+    assert messages == ["grouping.json and schema.json disagree on the type of: "
+                        "outcome (grouped as an object), "
+                        "profile.nested (copied from 'city' but an object in the schema)"]
+
+
+def test_required_paths_not_produced():
+    grouping = {key: value for key, value in GROUPING.items() if key != "outcome"}
+    grouping["profile"] = {"id": "id"}
+    messages = validate_grouping(grouping, schema=SCHEMA)
+    assert messages == ["schema.json requires 3 path(s) that grouping.json does not "
+                        "produce: profile.age, profile.nested, outcome"]
+
+
+def test_repo_schema_requires_identity():
+    # Why validation ships disabled (see the README)
+    messages = validate_grouping(_load("pipeline-setup/grouping.json"), schema=_load("schema.json"))
+    assert messages[-1] == "schema.json requires 1 path(s) that grouping.json does not produce: identity"
+
+
+def test_pipeline_warns_before_running(tmp_path, capsys):
+    raw = tmp_path / "raw.json"
+    raw.write_text(json.dumps([{"decision": "APPROVED", "age": 20}]), encoding="utf-8")
+    output = str(tmp_path / "grouped.json")
+    run_streaming_pipeline([str(raw)], ["decision", "age"], {}, GROUPING, output)
+    out = capsys.readouterr().out
+    assert "Warning: grouping.json reads 2 field(s) that are not in fields_to_keep" in out
+    with open(output, encoding="utf-8") as f:
+        grouped = json.load(f)
+    assert grouped[0]["outcome"] == "APPROVED" and "it's \"quoted\"\n" not in grouped[0]
@@ -0,0 +1,108 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from dataprocessing import functions
+from dataprocessing.functions import FUNCTION_REGISTRY, FunctionRegistry, TransformFunction
+from dataprocessing.incremental import normalization_hash, run_incremental_pipeline
+
+NORMALIZATION_MAP = {
+    "city": {"value_mappings": {}, "dynamic_rules": [{"if": {"apply_function": "city_code"}}],
+             "default": None},
+    "name": {"value_mappings": {}, "dynamic_rules": [], "default": None},
+}
+GROUPING = {"id": "id", "city": "city", "name": "name"}
+
+
+def shout(value):
+    return value.upper()
+
+
+def whisper(value):
+    return value.lower()
+
+
+@pytest.fixture
+def run(tmp_path, capsys):
+    raw = tmp_path / "raw.json"
+    raw.write_text(json.dumps([{"city": "Paris", "name": "Ana"}, {"city": "Lyon", "name": "Bo"}]),
+                   encoding="utf-8")
+    output = str(tmp_path / "grouped.json")
+
+    def run():
+        capsys.readouterr()
+        run_incremental_pipeline([str(raw)], ["city", "name"], NORMALIZATION_MAP, GROUPING,
+                                 output, str(tmp_path / "cache"))
+        with open(output, encoding="utf-8") as f:
+            return [record["city"] for record in json.load(f)], capsys.readouterr().out
+    return run
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # Keeps the functions registered by a test out of the other tests
+    monkeypatch.setattr(FUNCTION_REGISTRY, "plugins_loaded", True)
+    monkeypatch.delitem(FUNCTION_REGISTRY, "city_code", raising=False)
+    yield FUNCTION_REGISTRY
+    FUNCTION_REGISTRY.pop("city_code", None)
+
+
+def test_changed_function_renormalizes_its_fields(run, registry):
+    registry.add(TransformFunction("city_code", shout))
+    cities, _ = run()
+    assert cities == ["PARIS", "LYON"]
+    cities, out = run()
+    assert "Reusing cached records" in out
+
+    registry.add(TransformFunction("city_code", whisper))
+    cities, out = run()
+    assert cities == ["paris", "lyon"]
+    assert "Re-normalizing 1 field(s)" in out
+
+
+def test_function_registered_after_a_run_renormalizes_its_fields(run, registry):
+    cities, _ = run()
+    # The rule cannot fire: the default applies
+    assert cities == [None, None]
+    registry.add(TransformFunction("city_code", shout))
+    cities, out = run()
+    assert cities == ["PARIS", "LYON"]
+    assert "Re-normalizing 1 field(s)" in out
+
+
+def test_fields_without_functions_keep_their_hash(registry):
+    registry.add(TransformFunction("city_code", shout))
+    name = NORMALIZATION_MAP["name"]
+    assert normalization_hash(name) == normalization_hash(json.loads(json.dumps(name)))
+    before = normalization_hash(NORMALIZATION_MAP["city"])
+    registry.add(TransformFunction("city_code", whisper))
+    assert normalization_hash(NORMALIZATION_MAP["city"]) != before
+
+
+def _plugin_registry(monkeypatch, version):
+    def register(registry):
+        registry.add(TransformFunction("city_code", shout))
+
+    dist = SimpleNamespace(metadata={"Name": "city-functions"}, version=version)
+    entry_point = SimpleNamespace(name="cities", load=lambda: register, dist=dist)
+    monkeypatch.setattr("importlib.metadata.entry_points", lambda group: [entry_point])
+    registry = FunctionRegistry()
+    registry.load_plugins()
+    return registry
+
+
+def test_fingerprint_covers_the_plugin_version(monkeypatch):
+    first = _plugin_registry(monkeypatch, "1.0").fingerprint("city_code")
+    second = _plugin_registry(monkeypatch, "1.1").fingerprint("city_code")
+    assert first["distribution"] == "city-functions==1.0"
+    assert second["distribution"] == "city-functions==1.1"
+    assert (first["module"], first["qualname"]) == (__name__, "shout")
+
+
+def test_fingerprint_covers_the_code_of_built_ins():
+    fingerprint = FUNCTION_REGISTRY.fingerprint({"name": "bucket", "bins": [400]})
+    assert (fingerprint["module"], fingerprint["qualname"]) == (functions.__name__, "bucket")
+    assert fingerprint["distribution"] is None
+    assert fingerprint["code"] != FUNCTION_REGISTRY.fingerprint("parse_number")["code"]
+    assert FUNCTION_REGISTRY.fingerprint("not_registered") is None
@@ -0,0 +1,117 @@
+import json
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from loading import load_to_db
+from loading.load_to_db import load_to_mongodb
+
+URI = "mongodb://localhost:27017"
+DB = "eduvisa"
+COLLECTION = "applications"
+
+
+@pytest.fixture
+def client(monkeypatch, mongo_server):
+    """One in-memory server shared by every MongoClient the loader opens."""
+    monkeypatch.setattr(load_to_db, "MongoClient", lambda uri, **kwargs: _Unclosable(mongo_server))
+    return mongo_server
+
+
+class _Unclosable:
+    """The loader closes its client; the test keeps reading the same server."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getitem__(self, name):
+        return self._client[name]
+
+    def close(self):
+        pass
+
+
+def _write(path, documents):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(documents, f)
+    return str(path)
+
+
+def _documents(count):
+    return [{"id": f"id-{i}", "outcome": "APPROVED" if i % 2 else "REFUSED"} for i in range(count)]
+
+
+def _load(path, **kwargs):
+    return load_to_mongodb(path, DB, COLLECTION, URI, batch_size=3, **kwargs)
+
+
+def test_load_creates_unique_id_index(tmp_path, client):
+    stats = _load(_write(tmp_path / "data.json", _documents(10)))
+    collection = client[DB][COLLECTION]
+    assert stats["inserted"] == 10
+    assert collection.count_documents({}) == 10
+    assert collection.index_information()["id_1"].get("unique") is True
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"id": "id-0"})
+
+
+def test_rerun_upserts_without_duplicates(tmp_path, client):
+    path = _write(tmp_path / "data.json", _documents(10))
+    _load(path)
+    stats = _load(path)
+    collection = client[DB][COLLECTION]
+    assert (stats["inserted"], stats["replaced"], stats["deleted"]) == (0, 10, 0)
+    assert collection.count_documents({}) == 10
+    assert len(collection.distinct("id")) == 10
+
+
+def test_rerun_replaces_changed_and_deletes_missing(tmp_path, client):
+    documents = _documents(10)
+    _load(_write(tmp_path / "data.json", documents))
+    documents = documents[1:]
+    documents[0]["outcome"] = "CHANGED"
+    stats = _load(_write(tmp_path / "data.json", documents))
+    collection = client[DB][COLLECTION]
+    assert stats["deleted"] == 1
+    assert collection.count_documents({}) == 9
+    assert collection.find_one({"id": "id-1"})["outcome"] == "CHANGED"
+    assert collection.find_one({"id": "id-0"}) is None
+
+
+def test_repeated_id_in_one_load_keeps_one_document(tmp_path, client):
+    documents = _documents(4) + [{"id": "id-2", "outcome": "LATEST"}, {"outcome": "NO ID"}]
+    stats = _load(_write(tmp_path / "data.json", documents))
+    collection = client[DB][COLLECTION]
+    assert stats["skipped"] == 1
+    assert collection.count_documents({"id": "id-2"}) == 1
+    assert collection.find_one({"id": "id-2"})["outcome"] == "LATEST"
+
+
+def test_non_unique_id_index_is_replaced(tmp_path, client):
+    collection = client[DB][COLLECTION]
+    collection.create_index("id")
+    _load(_write(tmp_path / "data.json", _documents(3)))
+    assert collection.index_information()["id_1"].get("unique") is True
+
+
+def test_staging_load_replaces_collection(tmp_path, client):
+    _load(_write(tmp_path / "data.json", _documents(5)))
+    stats = _load(_write(tmp_path / "data.json", _documents(3)), use_staging=True)
+    db = client[DB]
+    assert stats["inserted"] == 3
+    assert db[COLLECTION].count_documents({}) == 3
+    assert f"{COLLECTION}_staging" not in db.list_collection_names()
+    assert db[COLLECTION].index_information()["id_1"].get("unique") is True
+
+
+def test_errors_propagate(tmp_path, client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("write failed")
+
+    monkeypatch.setattr(load_to_db, "upsert_documents", fail)
+    with pytest.raises(RuntimeError, match="write failed"):
+        _load(_write(tmp_path / "data.json", _documents(3)))
+
+
+def test_missing_file_returns_none(tmp_path, client):
+    assert _load(str(tmp_path / "missing.json")) is None
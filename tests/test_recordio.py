@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from dataprocessing import recordio
+from dataprocessing.recordio import IndexedRecordFile, iter_json_array, open_record_writer
+
+FORMATS = ["ndjson", "json",
+           pytest.param("msgpack", marks=pytest.mark.skipif(recordio.msgpack is None,
+                                                           reason="msgpack is not installed"))]
+RECORDS = [{"id": f"id-{i}", "n": i, "text": "é" * i} for i in range(5)]
+# Arrays whose elements end on every offset of small chunks: escapes, numbers, literals
+ARRAYS = [
+    '[]',
+    ' \n[ \t]\n',
+    '[1]',
+    '[12345678901234567890, -0.5e-10, 3.25E+2, 0]',
+    '[true,false,null,"null"]',
+    '["a\\"b", "\\\\", "\\\\\\"", "\\/", "\\b\\f\\n\\r\\t", "]", "[,]", "\\u005d"]',
+    '["\\u00e9t\\u00e9", "\\ud83d\\ude00", "\u00e9\u20ac\U0001f600", ""]',
+    '[{"a": [1, {"b": "}]"}], "c\\"": {}}, [[[]]], {}]',
+    '[\n  {"id": "x", "n": 1},\n  {"id": "y", "n": 22}\n]\n',
+]
+
+
+@pytest.fixture(params=FORMATS)
+def indexed(request, tmp_path):
+    path = str(tmp_path / f"records.{request.param}")
+    with open_record_writer(path, request.param, index=True) as writer:
+        for record in RECORDS:
+            writer.write(record)
+    with IndexedRecordFile(path) as records:
+        yield records
+
+
+def _decode(records, raw):
+    if records.fmt == "msgpack":
+        return recordio.msgpack.unpackb(bytes(raw), raw=False)
+    return json.loads(bytes(raw))
+
+
+def test_negative_positions_count_from_the_end(indexed):
+    for position in range(-len(RECORDS), 0):
+        expected = RECORDS[position]
+        assert indexed.record(position) == expected
+        assert _decode(indexed, indexed.raw(position)) == expected
+        assert bytes(indexed.raw(position)) == bytes(indexed.raw(position + len(RECORDS)))
+
+
+@pytest.mark.parametrize("position", [len(RECORDS), -len(RECORDS) - 1, -2 * len(RECORDS)])
+def test_out_of_range_positions_raise(indexed, position):
+    with pytest.raises(IndexError):
+        indexed.raw(position)
+    with pytest.raises(IndexError):
+        indexed.record(position)
+
+
+def _write(tmp_path, text):
+    path = tmp_path / "array.json"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("text", ARRAYS)
+def test_iter_json_array_across_chunk_boundaries(tmp_path, text):
+    path = _write(tmp_path, text)
+    expected = json.loads(text)
+    for chunk_size in list(range(1, len(text) + 2)) + [1 << 16]:
+        assert list(iter_json_array(path, chunk_size)) == expected, chunk_size
+
+
+@pytest.mark.parametrize("text", ["", "  ", "{}", '"[1]"', "[1,]", "[1 2]", "[1", '["a]', '["\\"]', "[tru]"])
+def test_iter_json_array_rejects_malformed_files(tmp_path, text):
+    path = _write(tmp_path, text)
+    for chunk_size in (1, 2, 3, 1 << 16):
+        with pytest.raises(ValueError):
+            list(iter_json_array(path, chunk_size))
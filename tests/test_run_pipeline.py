@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import run_pipeline
+
+from conftest import ROOT
+
+
+@pytest.mark.parametrize("options,conflicts", [
+    (["--workers", "2"], "--workers"),
+    (["--engine", "columnar"], "--engine"),
+    (["--metrics", "metrics.json", "--prometheus", "metrics.prom"], "--metrics, --prometheus"),
+])
+def test_incremental_rejects_unsupported_options(options, conflicts):
+    result = subprocess.run([sys.executable, os.path.join("src", "run_pipeline.py"), "--incremental"] + options,
+                            cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 2
+    assert f"--incremental cannot be combined with {conflicts}" in result.stderr
+
+
+def test_main_rejects_unsupported_incremental_options(capsys):
+    assert not run_pipeline.main(incremental=True, workers=4, engine="columnar")
+    assert "--incremental cannot be combined with --workers, --engine" in capsys.readouterr().out
+
+
+# sha256 of the grouped output of each raw file, as written by the step-by-step scripts
+# of the original pipeline (concatenate, standardize, normalize, add IDs, group)
+BASELINE_SHA256 = {
+    "2023.json": "aaed642563cd9d9f81ce7a49bf919ec2e3ec00a70b142ce8187a8da259188adb",
+    "2024.json": "ac3f3e22a3e1aec881bb2d1a7b249bdfa468524ec4473615febb3b7fabe6426f",
+    "2025.json": "385ecc51a7ce97f1f933b417c21b8acc6d0538148e8dc8e693fe1bcb20e9008a",
+}
+OPTIONAL_STAGES = ("dedup", "validation", "tags", "cube", "derived_features")
+RUNS = {
+    "serial": {},
+    "workers": {"workers": 3},
+    "columnar": {"engine": "columnar"},
+    "incremental": {"incremental": True},
+}
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """A copy of the pipeline setup in a temporary directory, with the optional stages off."""
+    def make(raw_names):
+        shutil.copytree(os.path.join(ROOT, "pipeline-setup"), tmp_path / "pipeline-setup")
+        for name in ("schema.json", "value-map.json"):
+            shutil.copy(os.path.join(ROOT, name), tmp_path / name)
+        os.makedirs(tmp_path / "data" / "raw")
+        for name in raw_names:
+            shutil.copy(os.path.join(ROOT, "data", "raw", name), tmp_path / "data" / "raw" / name)
+        config_path = tmp_path / "pipeline-setup" / "config.json"
+        config = json.loads(config_path.read_text(encoding="utf-8"))
+        for stage in OPTIONAL_STAGES:
+            config[stage]["enabled"] = False
+        config_path.write_text(json.dumps(config, indent=2), encoding="utf-8")
+        monkeypatch.chdir(tmp_path)
+        return tmp_path
+    return make
+
+
+def _grouped_output(root, **options):
+    assert run_pipeline.main(**options)
+    with open(os.path.join(root, "data", "processed", "grouped-data.json"), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("raw_name", sorted(BASELINE_SHA256))
+@pytest.mark.parametrize("run", RUNS)
+def test_grouped_output_matches_baseline(project, raw_name, run):
+    root = project([raw_name])
+    output = _grouped_output(root, **RUNS[run])
+    assert hashlib.sha256(output).hexdigest() == BASELINE_SHA256[raw_name]
+
+
+def test_all_runs_write_identical_output(project):
+    # The raw files are read in directory order, so the output of several files is
+    # compared between runs rather than with a fixed hash
+    root = project(sorted(BASELINE_SHA256))
+    serial = _grouped_output(root)
+    for run, options in RUNS.items():
+        assert _grouped_output(root, **options) == serial, run
+    # An incremental run that reuses its cache writes the same output again
+    assert _grouped_output(root, incremental=True) == serial
@@ -0,0 +1,41 @@
+import pytest
+
+from dataprocessing.normalize import compile_normalization_map, normalize_record
+from dataprocessing.tags import TagCodec, TagCollector, TagIndex, split_tags
+
+FIELD = "positive_tags"
+GROUPING = {"id": "id", "profile": {"tags": FIELD}}
+# The normalization map splits the tag string, as in pipeline-setup/config.json
+NORMALIZATION_MAP = {FIELD: {"value_mappings": {}, "dynamic_rules": [{"if": {"apply_function": "split_comma"}}],
+                             "default": None}}
+
+
+@pytest.mark.parametrize("value", ["a, b ,c", "a, b ,c".split(","), [" a", "b ", "  ", "c", None]])
+def test_split_tags_strips_strings_and_lists(value):
+    assert split_tags(value) == ["a", "b", "c"]
+
+
+def test_spaced_tags_round_trip_through_collect_encode_and_decode():
+    standardized = [{"id": "1", FIELD: "fast, free housing"}, {"id": "2", FIELD: " free housing ,fast,"},
+                    {"id": "3", FIELD: "fast"}]
+    # Tags are counted on the standardized strings...
+    collector = TagCollector([FIELD])
+    list(collector.observe(standardized))
+    codec = TagCodec([FIELD], GROUPING)
+    collector.update(codec.vocabularies)
+    assert codec.vocabularies[FIELD].tags == ["fast", "free housing"]
+
+    # ...and encoded from the lists the normalization map splits them into
+    plan = compile_normalization_map(NORMALIZATION_MAP)
+    grouped = [{"id": record["id"], "profile": {"tags": normalize_record(record, plan)[FIELD]}}
+               for record in standardized]
+    assert grouped[0]["profile"]["tags"] == ["fast", " free housing"]
+    encoded = [codec.encode(record) for record in grouped]
+    assert codec.vocabularies[FIELD].tags == ["fast", "free housing"]
+    assert [record["profile"]["tags"] for record in encoded] == [[0, 1], [0, 1], [0]]
+
+    index = TagIndex.from_records(encoded, codec, FIELD)
+    assert index.records(index.select(all_of=["free housing"])) == ["1", "2"]
+
+    decoded = [codec.decode(record)["profile"]["tags"] for record in encoded]
+    assert decoded == [["fast", "free housing"], ["fast", "free housing"], ["fast"]]
@@ -0,0 +1,158 @@
+import json
+import os
+import random
+
+import pytest
+from jsonschema import Draft7Validator
+
+from dataprocessing.validation import RecordValidator, compile_schema, validation_stage
+
+from conftest import ROOT
+
+# The formats both validators check: jsonschema only checks "date-time" with an extra
+# package, and its "email" check is looser than ours
+FORMATS = ("date",)
+
+KEYWORD_CASES = [
+    ({"type": "integer"}, [1, 1.0, 1.5, True, "1", None]),
+    ({"type": ["string", "null"]}, ["a", None, 0, []]),
+    ({"enum": [1, "a", None, [1]]}, [1, 1.0, True, "a", None, [1], [True], "b"]),
+    ({"const": {"a": [1, 2]}}, [{"a": [1, 2]}, {"a": [1.0, 2]}, {"a": [2, 1]}, {}]),
+    ({"minimum": 2, "exclusiveMaximum": 5}, [1, 2, 4.99, 5, "x"]),
+    ({"exclusiveMinimum": 0, "maximum": 1}, [0, 0.5, 1, 1.01]),
+    ({"multipleOf": 0.5}, [1, 1.5, 1.25, 0]),
+    ({"minLength": 2, "maxLength": 3}, ["a", "ab", "abc", "abcd", "é" * 3, 12]),
+    ({"pattern": "^a+b?$"}, ["a", "aab", "b", "xab", 3]),
+    ({"format": "date"}, ["2024-02-29", "2023-02-29", "2024-W01-1", "20240101", "2024-1-01", 5]),
+    ({"items": {"type": "integer"}, "minItems": 1, "maxItems": 2}, [[], [1], [1, 2], [1, "a"], [1, 2, 3]]),
+    ({"items": [{"type": "string"}, {"type": "integer"}], "additionalItems": False},
+     [[], ["a"], ["a", 1], ["a", 1, 2], [1, "a"]]),
+    ({"items": [{"type": "string"}], "additionalItems": {"type": "null"}}, [["a", None], ["a", 1]]),
+    ({"contains": {"const": 3}}, [[1, 3], [1, 2], []]),
+    ({"uniqueItems": True}, [[1, 2], [1, 1], [1, 1.0], [1, True], [{"a": 1}, {"a": 1}], []]),
+    ({"properties": {"a": {"type": "string"}}, "required": ["a", "b"]},
+     [{"a": "x", "b": 1}, {"a": 1, "b": 1}, {"a": "x"}, {}, "not an object"]),
+    ({"properties": {"a": {}}, "patternProperties": {"^x": {"type": "integer"}},
+      "additionalProperties": {"type": "boolean"}},
+     [{"a": 1, "x1": 2, "c": True}, {"x1": "2"}, {"c": 1}, {}]),
+    ({"additionalProperties": False, "properties": {"a": {}}}, [{"a": 1}, {"b": 1}]),
+    ({"propertyNames": {"maxLength": 2}, "minProperties": 1, "maxProperties": 2},
+     [{"ab": 1}, {"abc": 1}, {}, {"a": 1, "b": 2, "c": 3}]),
+    ({"dependencies": {"a": ["b"], "c": {"required": ["d"]}}},
+     [{"a": 1, "b": 1}, {"a": 1}, {"c": 1, "d": 1}, {"c": 1}, {}]),
+    ({"allOf": [{"type": "integer"}, {"minimum": 3}]}, [3, 2, 3.5]),
+    ({"anyOf": [{"type": "string"}, {"minimum": 3}]}, ["a", 3, 2]),
+    ({"oneOf": [{"type": "integer"}, {"minimum": 3}]}, [1, 4, 3.5, 2.5]),
+    ({"not": {"type": "null"}}, [None, 1]),
+    ({"if": {"properties": {"a": {"const": 1}}}, "then": {"required": ["b"]},
+      "else": {"required": ["c"]}},
+     [{"a": 1, "b": 1}, {"a": 1}, {"a": 2, "c": 1}, {"a": 2}]),
+    ({"definitions": {"node": {"type": "object", "properties": {"next": {"$ref": "#/definitions/node"},
+                                                                 "value": {"type": "integer"}}}},
+      "$ref": "#/definitions/node"},
+     [{"value": 1, "next": {"value": 2, "next": {}}}, {"next": {"next": {"value": "x"}}}]),
+    (True, [1, None]),
+    (False, [1, None]),
+]
+
+
+def _reference(schema):
+    return Draft7Validator(schema, format_checker=Draft7Validator.FORMAT_CHECKER)
+
+
+def _reference_paths(validator, instance):
+    """The JSON pointers of the values jsonschema reports errors on."""
+    paths = set()
+    for error in validator.iter_errors(instance):
+        path = "".join("/" + str(part).replace("~", "~0").replace("/", "~1")
+                       for part in error.absolute_path)
+        paths.add(path)
+    return paths
+
+
+def _check(schema, instance):
+    reference = _reference(schema)
+    errors = compile_schema(schema, FORMATS)(instance)
+    assert (not errors) == reference.is_valid(instance), (schema, instance, errors)
+    return errors, reference
+
+
+@pytest.mark.parametrize("schema,instances", KEYWORD_CASES)
+def test_keywords_agree_with_jsonschema(schema, instances):
+    for instance in instances:
+        _check(schema, instance)
+
+
+def _sample(schema, rng, depth=0):
+    """A random instance of a schema: mostly valid, sometimes not."""
+    if rng.random() < 0.05:
+        return rng.choice([None, "x", 1, -1, 2.5, True, [], {}, "2024-13-01", "2024-01-15"])
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    types = schema.get("type", "object")
+    kind = rng.choice(types) if isinstance(types, list) else types
+    if kind == "object":
+        instance = {name: _sample(sub, rng, depth + 1)
+                    for name, sub in schema.get("properties", {}).items() if rng.random() < 0.9}
+        if rng.random() < 0.05:
+            instance["unexpected"] = 1
+        return instance
+    if kind == "array":
+        return [_sample(schema.get("items", {}), rng, depth + 1) for _ in range(rng.randint(0, 3))]
+    if kind == "string":
+        if schema.get("format") == "date":
+            return f"{rng.randint(2020, 2026)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        return rng.choice(["", "a", "texte", "2024-01-01"])
+    if kind == "integer":
+        return rng.randint(-3, 120)
+    if kind == "number":
+        return rng.choice([rng.randint(-3, 5000), rng.uniform(-1, 5000)])
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return None
+
+
+def _load_schema():
+    with open(os.path.join(ROOT, "schema.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_schema_json_agrees_with_jsonschema():
+    schema = _load_schema()
+    validate = compile_schema(schema, FORMATS)
+    reference = _reference(schema)
+    rng = random.Random(7)
+    outcomes = set()
+    for _ in range(500):
+        instance = _sample(schema, rng)
+        errors = validate(instance)
+        assert {path for path, _ in errors} == _reference_paths(reference, instance), instance
+        outcomes.add(not errors)
+    # Both valid and invalid records were generated
+    assert outcomes == {True, False}
+
+
+def test_error_paths_agree_with_jsonschema():
+    schema = {"type": "object",
+              "properties": {"a": {"type": "array", "items": {"type": "integer"}},
+                             "b/c": {"type": "object", "required": ["d"]}}}
+    for instance in [{"a": [1, "x", 2, None]}, {"b/c": {}}, {"a": "x", "b/c": []}]:
+        errors, reference = _check(schema, instance)
+        assert {path for path, _ in errors} == _reference_paths(reference, instance)
+
+
+def test_unsupported_keyword_is_rejected():
+    with pytest.raises(ValueError):
+        compile_schema({"type": "object", "unknownKeyword": 1})
+
+
+def test_quarantine_keeps_invalid_records_out(tmp_path):
+    schema = {"type": "object", "required": ["id"], "properties": {"id": {"type": "string"}}}
+    quarantine = str(tmp_path / "quarantine.ndjson")
+    validator = RecordValidator(schema, quarantine, "quarantine")
+    records = [{"id": "a"}, {"id": 1}, {}]
+    assert list(validation_stage(records, validator)) == [{"id": "a"}]
+    with open(quarantine, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["record"] for line in lines] == [{"id": 1}, {}]
+    assert (validator.stats.valid, validator.stats.invalid) == (1, 2)